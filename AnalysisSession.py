@@ -0,0 +1,147 @@
+"""One submission, parsed at most once and shared by every detector.
+
+    session = AnalysisSession.fromPath('testCodeC.py')
+    session.getD4()
+    session.getC4(50)
+    session.getG4(4, 8, 70)
+
+An AnalysisSession takes a path (fromPath, or any os.PathLike) or a source
+as str or bytes. The file is read and parsed the first time a result is
+needed, and the single-pass traversal of VisitorMC3.analyze runs at most
+once: it gathers the facts shared between
+detectors (e.g. the range() constants and iteration variables of the For
+loops behind C2, C4 and C8, or the declared names behind A4 and G4), from
+which every getXX is answered. Any combination of getXX calls, in any
+order and with any constants, therefore costs one parse and one walk.
+
+Unlike the getters of VisitorMC3, results do not accumulate between calls,
+and the targets that make some of them raise are skipped (see
+VisitorMC3.analyze).
+"""
+import ast
+import os
+
+from VisitorMC3 import VisitorMC3, MC3_CODES
+
+class AnalysisSession:
+    def __init__(self, source = None, path = None):
+        """source is the code itself (str or bytes), or an os.PathLike to read
+           it from; a path given as str goes in path.
+        """
+        if isinstance(source, os.PathLike):
+            source, path = None, source
+
+        if (source is None) == (path is None):
+            raise ValueError('give either a source or a path')
+
+        self.path = os.fspath(path) if path is not None else None
+        self._source = source
+
+        self._tree = None
+        self._visitor = None
+        self._verdicts = None
+
+    @classmethod
+    def fromPath(cls, path):
+        return cls(path=path)
+
+    @property
+    def source(self):
+        """The code, read from the path on first use.
+        """
+        if self._source is None:
+            with open(self.path, 'rb') as file:
+                self._source = file.read()
+        return self._source
+
+    @property
+    def tree(self):
+        """The parsed code. Raises SyntaxError if it does not parse.
+        """
+        if self._tree is None:
+            self._tree = ast.parse(self.source)
+        return self._tree
+
+    def traversal(self):
+        """The VisitorMC3 holding the facts gathered by the single traversal.
+        """
+        if self._visitor is None:
+            visitor = VisitorMC3()
+            visitor.resetTraversal()
+            visitor.visit(self.tree)
+            self._visitor = visitor
+        return self._visitor
+
+    def fixedVerdicts(self):
+        if self._verdicts is None:
+            self._verdicts = self.traversal().fixedVerdicts(self.tree)
+        return self._verdicts
+
+    def analyze(self, constThreshold = 1, numListsThreshold = 0, varLenThreshold = 0,
+                funcLenThreshold = 0, totalNamesThreshold = 100):
+        """Same result as VisitorMC3.analyze, reusing the session's traversal.
+        """
+        verdicts = dict(self.fixedVerdicts())
+        verdicts.update(self.traversal().thresholdVerdicts(constThreshold, numListsThreshold,
+                                                           varLenThreshold, funcLenThreshold,
+                                                           totalNamesThreshold))
+        return {code: verdicts[code] for code in MC3_CODES}
+
+    def getA4(self):
+        '''A4 - Redefinition of built-in.'''
+        builtinRedefinition, variables, functions, arguments = self.fixedVerdicts()['A4']
+        return builtinRedefinition, list(variables), list(functions), list(arguments)
+
+    def getB6(self):
+        '''B6 - Boolean comparison attempted with while loop.'''
+        return self.fixedVerdicts()['B6']
+
+    def getB8(self):
+        '''B8 - Non utilisation of elif/else.'''
+        return self.fixedVerdicts()['B8']
+
+    def getB9(self):
+        '''B9 - elif/else retesting already checked conditions'''
+        return self.fixedVerdicts()['B9']
+
+    def getB12(self):
+        '''B12 - Consecutive equal if statements with distinct operations in
+           their blocks.'''
+        return self.fixedVerdicts()['B12']
+
+    def getC1(self):
+        '''C1 - While condition tested again inside its block'''
+        return self.fixedVerdicts()['C1']
+
+    def getC2(self):
+        '''C2 - Redundant or unnecessary loop.'''
+        return self.fixedVerdicts()['C2']
+
+    def getC4(self, constThreshold):
+        '''C4 - Arbitrary number of for loop execution instead of while.'''
+        return self.traversal().thresholdVerdicts(constThreshold=constThreshold)['C4']
+
+    def getC8(self):
+        '''C8 - for loop having its iteration variable overwritten'''
+        return self.fixedVerdicts()['C8']
+
+    def getD4(self):
+        return self.fixedVerdicts()['D4']
+
+    def getE2(self, numListsThreshold = 0):
+        '''E2 - Redundant or unnecessary use of lists.'''
+        return self.traversal().thresholdVerdicts(numListsThreshold=numListsThreshold)['E2']
+
+    def getG4(self, varLenThreshold, funcLenThreshold, totalNamesThreshold):
+        '''G4 - Functions/variables with non significant name.'''
+        return self.traversal().thresholdVerdicts(varLenThreshold=varLenThreshold,
+                                                  funcLenThreshold=funcLenThreshold,
+                                                  totalNamesThreshold=totalNamesThreshold)['G4']
+
+    def getG5(self):
+        '''G5 - Arbitrary organization of declarations.'''
+        return self.fixedVerdicts()['G5']
+
+    def getH1(self):
+        '''H1 - Statement with no effect.'''
+        return self.fixedVerdicts()['H1']
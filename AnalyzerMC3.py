@@ -0,0 +1,150 @@
+"""Reentrant front end for the single-pass detection engine of VisitorMC3.
+
+An AnalyzerMC3 only holds the instructor's constants, which never change
+after construction. Every call to analyze() runs its traversal on a fresh
+VisitorMC3 and returns an immutable ReportMC3, so a single analyzer can be
+reused across files and shared by the threads of a ThreadPoolExecutor.
+
+MetricsMC3 holds the raw numbers behind the threshold-based detectors
+(C4, E2 and G4), which do not depend on the analyzer's constants.
+"""
+import ast
+import math
+from collections import namedtuple
+
+from VisitorMC3 import VisitorMC3, MC3_CODES
+from prefilter import relevantDetectors
+
+class ReportMC3(namedtuple('ReportMC3', MC3_CODES + ['builtinVariables', 'builtinFunctions',
+                                                     'builtinArguments', 'ruleCodes'])):
+    """Immutable result of an analysis: one boolean per MC³ (ReportMC3.A4,
+       ReportMC3.B6, ...) plus the names found by A4, as tuples, and the codes
+       of the analyzer's own rules that were found (see PatternRules.py).
+    """
+    __slots__ = ()
+
+    def detected(self):
+        """Names of the MC³ present in the code, in MC3_CODES order, followed
+           by the codes of the rules found.
+        """
+        return [code for code in MC3_CODES if getattr(self, code)] + list(self.ruleCodes)
+
+    @classmethod
+    def fromAnalysis(cls, analysis):
+        """Builds a report from the dict returned by VisitorMC3.analyze.
+        """
+        builtinRedefinition, variables, functions, arguments = analysis['A4']
+        flags = [builtinRedefinition] + [analysis[code] for code in MC3_CODES[1:]]
+        ruleCodes = tuple(code for code, found in analysis.items()
+                          if code not in MC3_CODES and found)
+        return cls(*flags, tuple(variables), tuple(functions), tuple(arguments), ruleCodes)
+
+    @classmethod
+    def empty(cls):
+        """A report where no MC³ is present.
+        """
+        return cls(*[False]*len(MC3_CODES), (), (), (), ())
+
+class MetricsMC3(namedtuple('MetricsMC3', ['maxRangeConstant', 'numLists',
+                                           'varNameLengths', 'funcNameLengths'])):
+    """Threshold-independent evidence behind C4, E2 and G4: the largest numeric
+       constant in a range() of a For loop (None if there is none), the number
+       of declared lists and the lengths of the distinct declared variable and
+       function names.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def fromVisitor(cls, visitor):
+        """Builds the metrics from a VisitorMC3 that has just been traversed.
+        """
+        maxRangeConstant = max(visitor.rangeConstants) if visitor.rangeConstants else None
+        return cls(maxRangeConstant, visitor.numLists,
+                   tuple(len(name) for name in visitor.varNames),
+                   tuple(len(name) for name in visitor.funcNames))
+
+    def maxRangeFloat(self, missing = math.nan):
+        """maxRangeConstant as a float, or missing if there is none. Ints too
+           large for a float become infinite.
+        """
+        if self.maxRangeConstant is None:
+            return missing
+
+        try:
+            return float(self.maxRangeConstant)
+        except OverflowError:
+            return math.inf if self.maxRangeConstant > 0 else -math.inf
+
+class AnalyzerMC3:
+    def __init__(self, constThreshold = 1, numListsThreshold = 0, varLenThreshold = 0,
+                 funcLenThreshold = 0, totalNamesThreshold = 100, rules = (), telemetry = None):
+        self._thresholds = (constThreshold, numListsThreshold, varLenThreshold,
+                            funcLenThreshold, totalNamesThreshold)
+        self._rules = tuple(rules)
+        self._telemetry = telemetry
+
+    @property
+    def thresholds(self):
+        """The constants given to the constructor, in VisitorMC3.analyze order.
+        """
+        return self._thresholds
+
+    @property
+    def rules(self):
+        """The Rules given to the constructor, run along with the MC³ detectors.
+        """
+        return self._rules
+
+    def analyze(self, tree, detectors = None, firstHit = False, imports = None):
+        """Detects every MC³ in a parsed tree and returns a ReportMC3. If given,
+           detectors restricts the analysis to these codes. With firstHit, the
+           traversal stops once all of them have fired (see VisitorMC3.analyze).
+           imports are the names the tree imports from the other modules of a
+           project (see ProjectAnalyzer.py). With a Telemetry given to the
+           constructor, the analysis is instrumented into it.
+        """
+        visitor = VisitorMC3(self._rules, imports)
+        if self._telemetry is not None:
+            self._telemetry.instrument(visitor)
+        return ReportMC3.fromAnalysis(visitor.analyze(tree, *self._thresholds,
+                                                      detectors=detectors, firstHit=firstHit))
+
+    def findOccurrences(self, tree, detectors = None):
+        """Returns the list of Finding(code, line, col) of every occurrence of
+           the MC³ detected in a parsed tree (see VisitorMC3.findOccurrences).
+        """
+        return VisitorMC3(self._rules).findOccurrences(tree, *self._thresholds,
+                                                       detectors=detectors)
+
+    def analyzeWithMetrics(self, tree):
+        """Returns both the ReportMC3 and the MetricsMC3 of a tree, from a single
+           traversal.
+        """
+        visitor = VisitorMC3(self._rules)
+        report = ReportMC3.fromAnalysis(visitor.analyze(tree, *self._thresholds))
+        return report, MetricsMC3.fromVisitor(visitor)
+
+    def metrics(self, tree):
+        """Extracts the MetricsMC3 of a parsed tree, so that C4, E2 and G4 can be
+           evaluated for many thresholds without walking the tree again (see
+           thresholdSweep.py).
+        """
+        visitor = VisitorMC3(self._rules)
+        visitor.resetTraversal()
+        visitor.visit(tree)
+        return MetricsMC3.fromVisitor(visitor)
+
+    def analyzeSource(self, source, prefilter = False):
+        """Parses a source (str or bytes) and analyzes it. With prefilter, only
+           the detectors whose keywords appear in the source are run, and a
+           source where none appears is not even parsed (see prefilter.py).
+        """
+        if not prefilter:
+            return self.analyze(ast.parse(source))
+
+        #The keywords of the rules are not known, so they always run
+        detectors = relevantDetectors(source) | set(rule.code for rule in self._rules)
+        if len(detectors) == 0:
+            return ReportMC3.empty()
+
+        return self.analyze(ast.parse(source), detectors)
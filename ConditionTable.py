@@ -0,0 +1,156 @@
+"""Canonical conditions shared by the B9, B12 and C1 detectors.
+
+A ConditionTable hash-conses expressions: structurally equal expressions
+(whatever their positions and Load/Store contexts) get the same integer id,
+built bottom-up from the ids of their children, so comparing two
+expressions is comparing two ints.
+
+The key of a condition also folds negations and flipped comparisons: e.g.
+"a > 0", "0 < a" and "not a <= 0" share a key, and the key of their
+opposite ("a <= 0", "0 >= a" or "not a > 0") is negation() of it. The
+detectors can then check a whole if/elif chain or run of consecutive Ifs
+with set lookups, in time linear in its length.
+"""
+import ast
+
+INVERSE_COMPARE_OPS = {ast.Eq: ast.NotEq,
+                       ast.NotEq: ast.Eq,
+                       ast.Lt: ast.GtE,
+                       ast.LtE: ast.Gt,
+                       ast.Gt: ast.LtE,
+                       ast.GtE: ast.Lt,
+                       ast.In: ast.NotIn,
+                       ast.NotIn: ast.In,
+                       ast.Is: ast.IsNot,
+                       ast.IsNot: ast.Is}
+
+# Comparisons keyed as the negation of their inverse e.g. a >= b as not a < b
+NEGATIVE_COMPARE_OPS = (ast.NotEq, ast.GtE, ast.Gt, ast.NotIn, ast.IsNot)
+
+# a < b is not b <= a, and a <= b is not b < a
+FLIPPED_COMPARE_OPS = {ast.Lt: ast.LtE, ast.LtE: ast.Lt}
+
+# Fields that do not change what an expression computes
+IGNORED_FIELDS = ('ctx', 'kind', 'type_comment')
+
+def negation(key):
+    """Key of the opposite of a condition.
+    """
+    return key ^ 1
+
+class ConditionTable:
+    def __init__(self):
+        self.ids = {}           # structural key -> expression id
+        self.conditions = {}    # test node -> condition key
+
+    def intern(self, key):
+        return self.ids.setdefault(key, len(self.ids))
+
+    def expression(self, node):
+        """Id of an expression, equal for structurally equal expressions.
+        """
+        if isinstance(node, ast.AST):
+            return self.intern((type(node).__name__,) +
+                               tuple(self.expression(value)
+                                     for field, value in ast.iter_fields(node)
+                                     if field not in IGNORED_FIELDS))
+
+        if isinstance(node, list):
+            return self.intern(('list',) + tuple(self.expression(item) for item in node))
+
+        #Identifiers and constant values; the type keeps 1, 1.0 and True apart
+        return self.intern((type(node), node))
+
+    def condition(self, node):
+        """Key of a test expression: twice the id of its positive form, plus 1
+           if it is negated.
+        """
+        key = self.conditions.get(node)
+        if key is None:
+            key = self.conditions[node] = self.canonicalCondition(node)
+        return key
+
+    def canonicalCondition(self, node):
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return negation(self.condition(node.operand))
+
+        if not (isinstance(node, ast.Compare) and len(node.ops) == 1):
+            return 2*self.expression(node)
+
+        op = type(node.ops[0])
+        left = self.expression(node.left)
+        right = self.expression(node.comparators[0])
+
+        negated = op in NEGATIVE_COMPARE_OPS
+        if negated:
+            op = INVERSE_COMPARE_OPS[op]
+
+        #Operands are put in id order: a == b is b == a, a < b is not b <= a
+        if left > right and op not in (ast.In, ast.NotIn):
+            left, right = right, left
+            if op in FLIPPED_COMPARE_OPS:
+                op = FLIPPED_COMPARE_OPS[op]
+                negated = not negated
+
+        return 2*self.intern(('Compare', op.__name__, left, right)) + negated
+
+    def operands(self, node):
+        """Keys of the conditions combined by a test, descending into BoolOps.
+        """
+        if isinstance(node, ast.BoolOp):
+            return [key for value in node.values for key in self.operands(value)]
+
+        return [self.condition(node)]
+
+def elifChain(node):
+    """The If statements of the if/elif chain starting at node.
+    """
+    chain = [node]
+    while len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If):
+        node = node.orelse[0]
+        chain.append(node)
+
+    return chain
+
+def chainRetests(table, chain):
+    """B9: the If statements in the elif/else blocks of a chain that test the
+       opposite of a condition already checked above them in the chain.
+    """
+    checked = set()
+    retests = []
+
+    for arm in chain:
+        checked.add(table.condition(arm.test))
+        for node in arm.orelse:
+            if isinstance(node, ast.If) and \
+               any(negation(key) in checked for key in table.operands(node.test)):
+                retests.append(node)
+
+    return retests
+
+def nextIfRun(table, run, node):
+    """One step of B12 over consecutive sibling nodes, where run holds the
+       condition keys of the Ifs (with no elif/else) right before node, or is
+       None: returns whether node is such an If repeating one of them, and the
+       run left for the next sibling.
+    """
+    if not isinstance(node, ast.If) or len(node.orelse) > 0:
+        return False, None
+
+    key = table.condition(node.test)
+    if run is None:
+        return False, {key}
+
+    if key in run:
+        return True, run
+
+    run.add(key)
+    return False, run
+
+def oppositeIfs(table, loop):
+    """C1: the If statements right inside a while loop's body that test the
+       opposite of the loop's condition.
+    """
+    opposite = negation(table.condition(loop.test))
+    return [item for item in loop.body
+            if isinstance(item, ast.If) and table.condition(item.test) == opposite]
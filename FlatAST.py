@@ -0,0 +1,287 @@
+"""Flattened, array-backed ASTs for vectorized detection.
+
+A FlatAST stores one or many parsed files as a single table of NumPy
+arrays, one row per node, instead of a graph of ast objects:
+
+    types        node type, as an index into NODE_TYPES
+    parents      row of the parent node (-1 for the root of each file)
+    fields       field of the parent the node is in, as an index into FIELDS
+    positions    position of the node in that field, if it is a list
+    childStart   first row of the node's children...
+    childEnd     ...and one past the last: nodes are stored breadth-first
+                 (the order of ast.walk), so the children of a node are
+                 always contiguous
+    lines        line number (-1 for nodes without one)
+    constKinds   kind of value of Constant nodes, as an index into CONST_KINDS
+    constValues  numeric value of Constant nodes (NaN for the other ones)
+    names        identifier of Name, FunctionDef, arg... as an index into
+                 identifiers (-1 for the other nodes); identifiers are
+                 interned once per table
+    fileStarts   first row of each file (the table has numFiles + 1 of them)
+
+Tables of many files can be built at once (FlatAST.fromTrees), and the
+detectors below (B6, C2, C4, E2 and H1) are masks and joins over these
+arrays that answer for every file of the table in one go. The verdicts
+match VisitorMC3.analyze. Requires NumPy.
+"""
+import ast
+import math
+from collections import deque
+
+import numpy as np
+
+NODE_TYPES = sorted((cls for cls in vars(ast).values()
+                     if isinstance(cls, type) and issubclass(cls, ast.AST)),
+                    key=lambda cls: cls.__name__)
+TYPE_CODES = {cls: code for code, cls in enumerate(NODE_TYPES)}
+
+FIELDS = sorted(set(field for cls in NODE_TYPES for field in cls._fields))
+FIELD_CODES = {field: code for code, field in enumerate(FIELDS)}
+
+CONST_KINDS = ['none', 'int', 'float', 'bool', 'str', 'NoneType', 'bytes', 'Ellipsis',
+               'complex']
+CONST_KIND_CODES = {kind: code for code, kind in enumerate(CONST_KINDS)}
+
+# Attribute holding the identifier of the nodes that have one
+NAME_ATTRIBUTES = {ast.Name: 'id', ast.FunctionDef: 'name', ast.AsyncFunctionDef: 'name',
+                   ast.ClassDef: 'name', ast.arg: 'arg', ast.Attribute: 'attr'}
+
+def typeCode(cls):
+    return TYPE_CODES[cls]
+
+def constantRow(value):
+    """(kind code, numeric value) of a Constant's value.
+    """
+    kind = type(value).__name__ if value is not ... else 'Ellipsis'
+    code = CONST_KIND_CODES.get(kind, CONST_KIND_CODES['none'])
+
+    if kind in ('int', 'bool', 'float'):
+        try:
+            return code, float(value)
+        except OverflowError:
+            #copysign would convert value to a float too
+            return code, math.inf if value > 0 else -math.inf
+
+    if kind == 'complex' and value.imag == 0:
+        return code, value.real
+
+    return code, math.nan
+
+class FlatAST:
+    def __init__(self, types, parents, fields, positions, childStart, childEnd, lines,
+                 constKinds, constValues, names, identifiers, fileStarts):
+        self.types = types
+        self.parents = parents
+        self.fields = fields
+        self.positions = positions
+        self.childStart = childStart
+        self.childEnd = childEnd
+        self.lines = lines
+        self.constKinds = constKinds
+        self.constValues = constValues
+        self.names = names
+        self.identifiers = identifiers
+        self.fileStarts = fileStarts
+
+    @classmethod
+    def fromTree(cls, tree):
+        return cls.fromTrees([tree])
+
+    @classmethod
+    def fromTrees(cls, trees):
+        """Flattens parsed trees into a single table, in the given order.
+        """
+        types, parents, fields, positions, childStart, childEnd, lines = [], [], [], [], [], [], []
+        constKinds, constValues, names = [], [], []
+        identifiers, identifierCodes = [], {}
+        fileStarts = []
+
+        def add(node, parent, field, position):
+            types.append(TYPE_CODES[type(node)])
+            parents.append(parent)
+            fields.append(field)
+            positions.append(position)
+            lines.append(getattr(node, 'lineno', -1))
+
+            if isinstance(node, ast.Constant):
+                kind, value = constantRow(node.value)
+            else:
+                kind, value = 0, math.nan
+            constKinds.append(kind)
+            constValues.append(value)
+
+            attribute = NAME_ATTRIBUTES.get(type(node))
+            if attribute is not None:
+                name = getattr(node, attribute)
+                if name not in identifierCodes:
+                    identifierCodes[name] = len(identifiers)
+                    identifiers.append(name)
+                names.append(identifierCodes[name])
+            else:
+                names.append(-1)
+
+        for tree in trees:
+            fileStarts.append(len(types))
+            add(tree, -1, -1, -1)
+
+            queue = deque([tree])
+            row = len(types) - 1
+            while queue:
+                node = queue.popleft()
+                childStart.append(len(types))
+
+                for field, value in ast.iter_fields(node):
+                    if isinstance(value, list):
+                        for position, child in enumerate(value):
+                            if isinstance(child, ast.AST):
+                                add(child, row, FIELD_CODES[field], position)
+                                queue.append(child)
+
+                    elif isinstance(value, ast.AST):
+                        add(value, row, FIELD_CODES[field], -1)
+                        queue.append(value)
+
+                childEnd.append(len(types))
+                row += 1
+
+        fileStarts.append(len(types))
+
+        return cls(np.array(types, dtype=np.int16), np.array(parents, dtype=np.int32),
+                   np.array(fields, dtype=np.int16), np.array(positions, dtype=np.int32),
+                   np.array(childStart, dtype=np.int32), np.array(childEnd, dtype=np.int32),
+                   np.array(lines, dtype=np.int32), np.array(constKinds, dtype=np.int8),
+                   np.array(constValues, dtype=np.float64), np.array(names, dtype=np.int32),
+                   identifiers, np.array(fileStarts, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.types)
+
+    @property
+    def numFiles(self):
+        return len(self.fileStarts) - 1
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.types, self.parents, self.fields,
+                                              self.positions, self.childStart, self.childEnd,
+                                              self.lines, self.constKinds, self.constValues,
+                                              self.names, self.fileStarts))
+
+    def fileIds(self):
+        """The file (index in the table) of every node.
+        """
+        return np.repeat(np.arange(self.numFiles), np.diff(self.fileStarts))
+
+    def perFile(self, mask):
+        """Whether each file has at least one node in mask.
+        """
+        return self.countPerFile(mask) > 0
+
+    def countPerFile(self, mask):
+        rows = np.flatnonzero(mask)
+        return np.bincount(np.searchsorted(self.fileStarts, rows, side='right') - 1,
+                           minlength=self.numFiles)
+
+    def isType(self, *classes):
+        return np.isin(self.types, [TYPE_CODES[cls] for cls in classes])
+
+    def inField(self, field):
+        return self.fields == FIELD_CODES[field]
+
+    def child(self, field, position = -1):
+        """For every node, the row of its child in field (at position, for list
+           fields), or -1 if it has none.
+        """
+        mask = self.inField(field) & (self.positions == position)
+        rows = np.full(len(self), -1, dtype=np.int32)
+        rows[self.parents[mask]] = np.flatnonzero(mask)
+        return rows
+
+    def countChildren(self, field):
+        """For every node, the number of its children in a list field.
+        """
+        mask = self.inField(field)
+        return np.bincount(self.parents[mask], minlength=len(self))
+
+    def lookup(self, rows, array, default):
+        """array[rows], with default where rows is -1.
+        """
+        return np.where(rows >= 0, array[rows], default)
+
+    def identifierCode(self, name):
+        try:
+            return self.identifiers.index(name)
+        except ValueError:
+            return -2
+
+# Detectors: each returns one verdict per file of the table
+
+def breaksInWhileBody(flat):
+    """Mask of the Break statements directly in the body of a While loop, and
+       the row of that loop for every node.
+    """
+    parents = np.maximum(flat.parents, 0)
+    mask = flat.isType(ast.Break) & flat.inField('body') & \
+           (flat.types[parents] == typeCode(ast.While)) & (flat.parents >= 0)
+    return mask, parents
+
+def detectB6(flat):
+    '''B6 - Boolean comparison attempted with while loop.'''
+    breaks, loops = breaksInWhileBody(flat)
+    tests = flat.lookup(flat.child('test'), flat.types, -1)
+    return flat.perFile(breaks & np.isin(tests[loops], [typeCode(ast.Compare),
+                                                        typeCode(ast.BoolOp)]))
+
+def rangeConstants(flat):
+    """Mask of the For loops iterating over range(constant), and the kind and
+       value of that constant for every node.
+    """
+    calls = flat.child('iter')
+    isCall = flat.lookup(calls, flat.types, -1) == typeCode(ast.Call)
+    calls = np.maximum(calls, 0)
+
+    funcs = flat.child('func')[calls]
+    isRange = (flat.lookup(funcs, flat.types, -1) == typeCode(ast.Name)) & \
+              (flat.lookup(funcs, flat.names, -1) == flat.identifierCode('range'))
+
+    args = flat.child('args', 0)[calls]
+    oneConstant = (flat.countChildren('args')[calls] == 1) & \
+                  (flat.lookup(args, flat.types, -1) == typeCode(ast.Constant))
+
+    mask = flat.isType(ast.For) & isCall & isRange & oneConstant
+    return mask, flat.lookup(args, flat.constKinds, 0), flat.lookup(args, flat.constValues,
+                                                                    math.nan)
+
+def detectC2(flat):
+    '''C2 - Redundant or unnecessary loop.'''
+    breaks, loops = breaksInWhileBody(flat)
+    tests = flat.child('test')
+    whileTrue = (flat.lookup(tests, flat.constKinds, 0) == CONST_KIND_CODES['bool']) & \
+                (flat.lookup(tests, flat.constValues, math.nan) == 1)
+
+    forLoops, kinds, values = rangeConstants(flat)
+    rangeOne = forLoops & (kinds == CONST_KIND_CODES['int']) & (values == 1)
+
+    return flat.perFile(breaks & whileTrue[loops]) | flat.perFile(rangeOne)
+
+def detectC4(flat, constThreshold = 1):
+    '''C4 - Arbitrary number of for loop execution instead of while.'''
+    forLoops, kinds, values = rangeConstants(flat)
+    numeric = np.isin(kinds, [CONST_KIND_CODES['int'], CONST_KIND_CODES['float'],
+                              CONST_KIND_CODES['bool']])
+    return flat.perFile(forLoops & numeric & (values >= constThreshold))
+
+def detectE2(flat, numListsThreshold = 0):
+    '''E2 - Redundant or unnecessary use of lists.'''
+    values = flat.lookup(flat.child('value'), flat.types, -1)
+    lists = flat.isType(ast.Assign) & np.isin(values, [typeCode(ast.List),
+                                                       typeCode(ast.ListComp)])
+    numLists = flat.countPerFile(lists)
+    return (numLists > 0) & (numLists >= numListsThreshold)
+
+def detectH1(flat):
+    '''H1 - Statement with no effect.'''
+    values = flat.child('value')
+    isConstant = flat.lookup(values, flat.types, -1) == typeCode(ast.Constant)
+    notString = flat.lookup(values, flat.constKinds, 0) != CONST_KIND_CODES['str']
+    return flat.perFile(flat.isType(ast.Expr) & isConstant & notString)
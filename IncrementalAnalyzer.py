@@ -0,0 +1,176 @@
+"""Incremental analysis of successive versions of the same code.
+
+Resubmissions and code being edited mostly differ from their previous
+version in a few top-level statements (typically one function). An
+IncrementalAnalyzer runs the single-pass traversal of VisitorMC3 on each
+top-level statement on its own and caches what it gathered, keyed by a
+hash of the statement's source. Analyzing a new version then only
+traverses the statements that changed:
+
+    analyzer = IncrementalAnalyzer(50, 5, 4, 8, 70)
+    analyzer.analyzeSource(firstVersion)
+    analyzer.analyzeSource(secondVersion)    # only the edited statements
+    analyzer.lastTraversed                   # are visited again
+
+The facts cached per statement are the ones the whole-module verdicts are
+built from: the MC³ found inside the statement, the built-in names it
+redefines, its range() constants, lists and declared names, and its scope
+analysis, with the D4 accesses that depend on the module variables kept
+apart. They are combined for the whole module at every call, so the
+verdicts that span statements (G4 percentages, E2 and C4 counts, D4
+globals, B12 between top-level Ifs and G5, which only looks at the
+statement types) are the same as VisitorMC3.analyze's.
+
+The cache is shared by all the sources given to the analyzer, so a single
+one can serve the submissions of a whole class. It keeps the facts of at
+most maxStatements statements, evicting the least recently used ones.
+"""
+import ast
+import hashlib
+import importlib.util
+from collections import OrderedDict, namedtuple
+
+from AnalyzerMC3 import ReportMC3
+from ConditionTable import ConditionTable, nextIfRun
+from VisitorMC3 import VisitorMC3
+
+class StatementFacts(namedtuple('StatementFacts', ['hits', 'builtinVarEntries',
+                                                   'builtinFuncEntries', 'builtinArgEntries',
+                                                   'rangeConstants', 'numLists', 'varNames',
+                                                   'funcNames', 'hasClasses', 'moduleVariables',
+                                                   'accessCandidates'])):
+    """What the traversal of VisitorMC3 gathers from a single top-level
+       statement, with no reference to its nodes.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def fromStatement(cls, node):
+        visitor = VisitorMC3()
+        visitor.resetTraversal()
+        visitor.visit(ast.Module(body=[node], type_ignores=[]))
+
+        symbols = visitor.symbols
+        return cls(frozenset(visitor.hits), tuple(visitor.builtinVarEntries),
+                   tuple(visitor.builtinFuncEntries), tuple(visitor.builtinArgEntries),
+                   tuple(visitor.rangeConstants), visitor.numLists, tuple(visitor.varNames),
+                   tuple(visitor.funcNames), symbols.hasClasses(),
+                   frozenset(symbols.moduleVariables()), frozenset(symbols.accessCandidates()))
+
+class ModuleSymbols:
+    """Stands in for the SymbolTable of a whole module, from the scope analysis
+       of its statements.
+    """
+    def __init__(self, facts):
+        self.classes = any(fact.hasClasses for fact in facts)
+
+        moduleVariables = set().union(*[fact.moduleVariables for fact in facts])
+        self.accesses = sorted(set((funcName, name, reason)
+                                   for fact in facts
+                                   for funcName, name, reason, needsModuleVariable
+                                   in fact.accessCandidates
+                                   if not needsModuleVariable or name in moduleVariables))
+
+    def hasClasses(self):
+        return self.classes
+
+    def outerScopeAccesses(self):
+        return self.accesses
+
+def sourceLines(source):
+    """The lines of a source (str or bytes) as ast numbers them, encoded in
+       UTF-8 like the column offsets.
+    """
+    if isinstance(source, bytes):
+        source = importlib.util.decode_source(source)
+    else:
+        source = source.replace('\r\n', '\n').replace('\r', '\n')
+
+    return [line.encode('utf-8', 'surrogatepass') for line in source.split('\n')]
+
+def statementKey(node, lines):
+    """Hash of the source of a top-level statement, decorators included.
+    """
+    start = min([node.lineno] + [decorator.lineno for decorator in
+                                 getattr(node, 'decorator_list', [])])
+    startCol = node.col_offset if start == node.lineno else 0
+
+    segment = lines[start - 1:node.end_lineno]
+    segment[-1] = segment[-1][:node.end_col_offset]
+    segment[0] = segment[0][startCol:]
+
+    return hashlib.blake2b(b'\n'.join(segment), digest_size=16).digest()
+
+class IncrementalAnalyzer:
+    def __init__(self, constThreshold = 1, numListsThreshold = 0, varLenThreshold = 0,
+                 funcLenThreshold = 0, totalNamesThreshold = 100, maxStatements = 100000):
+        self._thresholds = (constThreshold, numListsThreshold, varLenThreshold,
+                            funcLenThreshold, totalNamesThreshold)
+        self.maxStatements = maxStatements
+        self.statements = OrderedDict()     # statement key -> StatementFacts
+
+        self.lastStatements = 0
+        self.lastTraversed = 0
+
+    @property
+    def thresholds(self):
+        return self._thresholds
+
+    def facts(self, node, lines):
+        key = statementKey(node, lines)
+
+        fact = self.statements.get(key)
+        if fact is not None:
+            self.statements.move_to_end(key)
+            return fact
+
+        fact = StatementFacts.fromStatement(node)
+        self.lastTraversed += 1
+
+        self.statements[key] = fact
+        if len(self.statements) > self.maxStatements:
+            self.statements.popitem(last=False)
+
+        return fact
+
+    def analyzeSource(self, source):
+        """Parses a source (str or bytes) and returns its ReportMC3, traversing
+           only the top-level statements not seen before. lastStatements and
+           lastTraversed tell how many statements the source has and how many
+           of them were traversed.
+        """
+        tree = ast.parse(source)
+        lines = sourceLines(source)
+
+        self.lastStatements = len(tree.body)
+        self.lastTraversed = 0
+        facts = [self.facts(node, lines) for node in tree.body]
+
+        visitor = VisitorMC3()
+        visitor.resetTraversal()
+        visitor.symbols = ModuleSymbols(facts)
+
+        #Entries are sorted by (depth, visit order): statements are visited one
+        #after the other, so their index orders them within a depth
+        for index, fact in enumerate(facts):
+            for entries, factEntries in [(visitor.builtinVarEntries, fact.builtinVarEntries),
+                                         (visitor.builtinFuncEntries, fact.builtinFuncEntries),
+                                         (visitor.builtinArgEntries, fact.builtinArgEntries)]:
+                entries.extend(((depth, index, order), name)
+                               for (depth, order), name in factEntries)
+
+            visitor.hits.update(fact.hits)
+            visitor.rangeConstants.extend(fact.rangeConstants)
+            visitor.numLists += fact.numLists
+            visitor.varNames.update(dict.fromkeys(fact.varNames))
+            visitor.funcNames.update(dict.fromkeys(fact.funcNames))
+
+        #B12 between top-level statements, which are traversed apart
+        table = ConditionTable()
+        run = None
+        for node in tree.body:
+            equalIfs, run = nextIfRun(table, run, node)
+            if equalIfs:
+                visitor.hits.add('B12')
+
+        return ReportMC3.fromAnalysis(visitor.buildReport(tree, *self._thresholds))
@@ -0,0 +1,367 @@
+"""Durable queue of MC4 analysis jobs, stored in a local SQLite database.
+
+Each job is a file to analyze, usually one student's submission. Jobs are
+claimed in priority order, and within a priority in the order they were
+enqueued:
+
+    LATEST      the latest submission of its student
+    SUPERSEDED  a submission its student has since replaced by a newer one
+    RERUN       a rerun, e.g. after the constants changed
+
+so at a deadline, when students resubmit again and again, every student's
+latest submission is analyzed before any older one. Queuing a path that is
+already waiting in the queue updates that job instead of adding another.
+
+Claimed jobs are leased to their runner for a while: a runner keeps
+renewing the leases of the jobs it is running, and the jobs of a runner
+that died are queued again once their lease expires (see recover). A job
+whose analysis raised, or crashed its worker, is retried after a delay
+doubling with each attempt; after maxAttempts, it is moved to the dead
+letters (state 'dead') until retryDead queues it again. Runners run the
+jobs that were tried before on their own (see mc4queue.py), so a file
+crashing its worker process does not take the other files of the pool
+down with it. Several runners, possibly on other machines sharing the
+file, can work on the same queue.
+
+stats() tells the queue depth per priority and the latencies of recent
+jobs, from their enqueuing to the start and to the end of their analysis.
+"""
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from Telemetry import LatencyHistogram, QUANTILES
+
+LATEST, SUPERSEDED, RERUN = 0, 1, 2
+
+PRIORITY_NAMES = {LATEST: 'latest', SUPERSEDED: 'superseded', RERUN: 'rerun'}
+
+STATES = ('queued', 'running', 'done', 'dead')
+
+# Upper bounds, in seconds, of the histogram buckets of queue latencies
+QUEUE_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0,
+                         1800.0, 3600.0)
+
+class Job(namedtuple('Job', ['id', 'path', 'student', 'submitted', 'priority', 'attempts'])):
+    """A claimed job: the file to analyze, its student (None if unknown), the
+       time it was submitted at, its priority and how many times it was
+       claimed, this time included.
+    """
+    __slots__ = ()
+
+def studentOf(path):
+    """The default student of a submission: the name of its directory, as in
+       submissions/<student>/<file>.py.
+    """
+    return os.path.basename(os.path.dirname(os.path.abspath(path))) or None
+
+class JobQueue:
+    def __init__(self, path, maxAttempts = 3, retryDelay = 5.0, busyTimeout = 60.0):
+        self.maxAttempts = maxAttempts
+        self.retryDelay = retryDelay
+
+        #Transactions are explicit, see transaction()
+        self.connection = sqlite3.connect(path, timeout=busyTimeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                       id INTEGER PRIMARY KEY,
+                                       path TEXT NOT NULL,
+                                       student TEXT,
+                                       submitted REAL NOT NULL,
+                                       priority INTEGER NOT NULL,
+                                       state TEXT NOT NULL,
+                                       attempts INTEGER NOT NULL DEFAULT 0,
+                                       enqueued REAL NOT NULL,
+                                       availableAt REAL NOT NULL,
+                                       leaseUntil REAL,
+                                       runner TEXT,
+                                       started REAL,
+                                       finished REAL,
+                                       codes TEXT,
+                                       error TEXT)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobsClaim "
+                                "ON jobs (state, priority, enqueued, id)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobsStudent "
+                                "ON jobs (student, submitted)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobsPath ON jobs (path, state)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobsFinished ON jobs (finished)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """Runs a block in a write transaction, taking the database's write
+           lock upfront so that concurrent runners never claim the same job.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    # Producers
+
+    def enqueue(self, path, student = None, submitted = None, rerun = False):
+        """Queues a file. student defaults to studentOf(path) and submitted to
+           the file's modification time. Returns the job's id.
+        """
+        return self.enqueueMany([(path, student, submitted)], rerun)[0]
+
+    def enqueueMany(self, items, rerun = False, now = None):
+        """Queues (path, student, submitted) items, in a single transaction so a
+           burst of submissions costs one commit. Returns their job ids.
+        """
+        now = time.time() if now is None else now
+        ids = []
+
+        with self.transaction() as connection:
+            for path, student, submitted in items:
+                if student is None:
+                    student = studentOf(path)
+                if submitted is None:
+                    try:
+                        submitted = os.path.getmtime(path)
+                    except OSError:
+                        submitted = now
+
+                ids.append(self.insertJob(connection, path, student, submitted, rerun, now))
+
+        return ids
+
+    def insertJob(self, connection, path, student, submitted, rerun, now):
+        if rerun:
+            priority = RERUN
+        else:
+            newest = connection.execute("""SELECT MAX(submitted) FROM jobs
+                                           WHERE student = ? AND priority != ?""",
+                                        (student, RERUN)).fetchone()[0]
+            priority = SUPERSEDED if newest is not None and newest > submitted else LATEST
+
+            if priority == LATEST:
+                connection.execute("""UPDATE jobs SET priority = ?
+                                      WHERE student = ? AND state = 'queued' AND priority = ?
+                                            AND submitted < ?""",
+                                   (SUPERSEDED, student, LATEST, submitted))
+
+        waiting = connection.execute("""SELECT id, priority FROM jobs
+                                        WHERE path = ? AND state = 'queued'""",
+                                     (path,)).fetchone()
+        if waiting is not None:
+            jobId, waitingPriority = waiting
+            connection.execute("""UPDATE jobs SET student = ?, submitted = ?, priority = ?
+                                  WHERE id = ?""",
+                               (student, submitted, min(priority, waitingPriority), jobId))
+            return jobId
+
+        return connection.execute("""INSERT INTO jobs (path, student, submitted, priority, state,
+                                                       enqueued, availableAt)
+                                     VALUES (?, ?, ?, ?, 'queued', ?, ?)""",
+                                  (path, student, submitted, priority, now, now)).lastrowid
+
+    # Runners
+
+    def claim(self, count, runner, lease = 300.0, retried = None, now = None):
+        """Claims up to count queued jobs for a runner, for lease seconds, in
+           priority order. Returns them as Jobs. With retried set, only jobs
+           that were (True) or were not (False) tried before are claimed.
+        """
+        now = time.time() if now is None else now
+        attempts = {None: '', True: 'AND attempts > 0', False: 'AND attempts = 0'}[retried]
+
+        with self.transaction() as connection:
+            rows = connection.execute(f"""SELECT id, path, student, submitted, priority, attempts
+                                          FROM jobs
+                                          WHERE state = 'queued' AND availableAt <= ? {attempts}
+                                          ORDER BY priority, enqueued, id LIMIT ?""",
+                                      (now, count)).fetchall()
+
+            connection.executemany("""UPDATE jobs SET state = 'running', attempts = attempts + 1,
+                                                      leaseUntil = ?, runner = ?, started = ?
+                                      WHERE id = ?""",
+                                   [(now + lease, runner, now, row[0]) for row in rows])
+
+        return [Job(jobId, path, student, submitted, priority, attempts + 1)
+                for jobId, path, student, submitted, priority, attempts in rows]
+
+    def renew(self, jobIds, lease = 300.0, now = None):
+        """Extends the leases of running jobs, which their runner still works on.
+        """
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            connection.executemany("""UPDATE jobs SET leaseUntil = ?
+                                      WHERE id = ? AND state = 'running'""",
+                                   [(now + lease, jobId) for jobId in jobIds])
+
+    def complete(self, jobId, codes, error = None, now = None):
+        """Stores the result of a job. error is the message of a file that could
+           not be analyzed (e.g. a syntax error), which is a result too.
+        """
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            connection.execute("""UPDATE jobs SET state = 'done', finished = ?, codes = ?,
+                                                  error = ?, leaseUntil = NULL
+                                  WHERE id = ?""",
+                               (now, ' '.join(codes), error, jobId))
+
+    def fail(self, jobId, error, now = None):
+        """Records that a job's analysis raised or crashed. It is queued again
+           after a delay, or moved to the dead letters once it has been tried
+           maxAttempts times. Returns its new state.
+        """
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            return self.retryOrBury(connection, jobId, error, now)
+
+    def retryOrBury(self, connection, jobId, error, now):
+        row = connection.execute("SELECT attempts FROM jobs WHERE id = ?", (jobId,)).fetchone()
+        if row is None:
+            return None
+
+        attempts = row[0]
+        if attempts >= self.maxAttempts:
+            connection.execute("""UPDATE jobs SET state = 'dead', finished = ?, error = ?,
+                                                  leaseUntil = NULL
+                                  WHERE id = ?""", (now, error, jobId))
+            return 'dead'
+
+        delay = self.retryDelay*2**(attempts - 1)
+        connection.execute("""UPDATE jobs SET state = 'queued', availableAt = ?, error = ?,
+                                              leaseUntil = NULL
+                              WHERE id = ?""", (now + delay, error, jobId))
+        return 'queued'
+
+    def recover(self, now = None):
+        """Handles the running jobs whose lease expired, i.e. whose runner died,
+           like failed ones. Returns how many there were.
+        """
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            expired = connection.execute("""SELECT id, runner FROM jobs
+                                            WHERE state = 'running' AND leaseUntil < ?""",
+                                         (now,)).fetchall()
+            for jobId, runner in expired:
+                self.retryOrBury(connection, jobId, f"lease of runner {runner} expired", now)
+
+        return len(expired)
+
+    # Dead letters and housekeeping
+
+    def deadJobs(self):
+        """(id, path, student, attempts, last error) of the dead letters.
+        """
+        return self.connection.execute("""SELECT id, path, student, attempts, error FROM jobs
+                                          WHERE state = 'dead' ORDER BY id""").fetchall()
+
+    def retryDead(self, jobIds = None, now = None):
+        """Queues dead letters again (all of them by default), with a fresh
+           count of attempts. Returns how many were queued.
+        """
+        now = time.time() if now is None else now
+        with self.transaction() as connection:
+            if jobIds is None:
+                cursor = connection.execute("""UPDATE jobs SET state = 'queued', attempts = 0,
+                                                               availableAt = ?, finished = NULL
+                                               WHERE state = 'dead'""", (now,))
+                return cursor.rowcount
+
+            return sum(connection.execute("""UPDATE jobs SET state = 'queued', attempts = 0,
+                                                             availableAt = ?, finished = NULL
+                                             WHERE id = ? AND state = 'dead'""",
+                                          (now, jobId)).rowcount for jobId in jobIds)
+
+    def purge(self, before):
+        """Deletes the finished jobs (done or dead) that finished before a time.
+           Returns how many were deleted.
+        """
+        with self.transaction() as connection:
+            return connection.execute("""DELETE FROM jobs
+                                         WHERE state IN ('done', 'dead') AND finished < ?""",
+                                      (before,)).rowcount
+
+    # Results and visibility
+
+    def hasRetries(self, now = None):
+        """Whether a job that was tried before is queued and due.
+        """
+        now = time.time() if now is None else now
+        return self.connection.execute("""SELECT EXISTS (SELECT 1 FROM jobs
+                                                         WHERE state = 'queued' AND attempts > 0
+                                                               AND availableAt <= ?)""",
+                                       (now,)).fetchone()[0] == 1
+
+    def depth(self):
+        """Number of queued jobs, including the ones waiting for a retry delay.
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM jobs "
+                                       "WHERE state = 'queued'").fetchone()[0]
+
+    def results(self, latest = False):
+        """Yields (path, codes, error) for the done jobs, in the order they were
+           queued. With latest, only each student's latest submission.
+        """
+        query = "SELECT path, codes, error FROM jobs WHERE state = 'done' ORDER BY id"
+        if latest:
+            #Jobs without a student are their own latest submission
+            query = """SELECT path, codes, error FROM (
+                           SELECT id, path, codes, error,
+                                  ROW_NUMBER() OVER (PARTITION BY COALESCE(student, path)
+                                                     ORDER BY submitted DESC, finished DESC)
+                                  AS rank
+                           FROM jobs WHERE state = 'done')
+                       WHERE rank = 1 ORDER BY id"""
+
+        for path, codes, error in self.connection.execute(query):
+            yield path, codes.split() if error is None else [], error
+
+    def stats(self, window = 300.0, now = None):
+        """Queue depth and latencies: the number of jobs per state, of queued
+           jobs per priority (and how many wait for a retry delay), the age of
+           the oldest queued job, and, over the jobs finished in the last
+           window seconds, the throughput and the quantiles of their wait (from
+           enqueuing to their last start) and of their total latency.
+        """
+        now = time.time() if now is None else now
+
+        states = dict.fromkeys(STATES, 0)
+        states.update(self.connection.execute("SELECT state, COUNT(*) FROM jobs "
+                                              "GROUP BY state").fetchall())
+
+        queued = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+        for priority, count in self.connection.execute("""SELECT priority, COUNT(*) FROM jobs
+                                                          WHERE state = 'queued'
+                                                          GROUP BY priority"""):
+            queued[PRIORITY_NAMES[priority]] = count
+
+        delayed, oldest = self.connection.execute("""SELECT SUM(availableAt > ?), MIN(enqueued)
+                                                     FROM jobs WHERE state = 'queued'""",
+                                                  (now,)).fetchone()
+
+        wait, total = LatencyHistogram(QUEUE_LATENCY_BUCKETS), \
+                      LatencyHistogram(QUEUE_LATENCY_BUCKETS)
+        for enqueued, started, finished in self.connection.execute(
+                """SELECT enqueued, started, finished FROM jobs
+                   WHERE state = 'done' AND finished >= ?""", (now - window,)):
+            wait.observe(max(started - enqueued, 0.0))
+            total.observe(max(finished - enqueued, 0.0))
+
+        return {'states': states,
+                'queued': queued,
+                'delayed': delayed or 0,
+                'oldestQueuedSeconds': now - oldest if oldest is not None else None,
+                'window': window,
+                'finished': total.count,
+                'perSecond': total.count/window,
+                'waitSeconds': {str(q): wait.quantile(q) for q in QUANTILES},
+                'latencySeconds': {str(q): total.quantile(q) for q in QUANTILES}}
@@ -0,0 +1,281 @@
+"""Declarative MC³ rules, matched during the single traversal of VisitorMC3.
+
+A rule gives a code and a pattern describing an AST shape. Patterns are
+written like the output of ast.dump, so the shape of an example can be
+copied from ast.dump(ast.parse(example)) and loosened:
+
+    While(test=Compare | BoolOp, body=has(Break))
+    For(iter=Call(func=Name(id='range'), args=[Constant(value=1)]))
+    Expr(value=Constant(value=~str))
+
+The language is:
+
+    Type(field=p, ...)  a node of that ast type (or a subclass, e.g. stmt)
+                        whose fields match the given patterns; a bare Type
+                        matches any node of that type
+    'text', 1, True     a value equal to it and of the same type
+    str, int, ...       a value of that Python type
+    [p, q]              a list of exactly these items
+    has(p)              a list with at least one item (directly) matching p
+    item(i, p)          a list whose i-th item exists and matches p
+    p | q               either pattern
+    ~p                  anything p does not match
+    _                   anything
+
+A RuleTable compiles rules to a table from node type to the rules whose
+pattern starts with that type, so each node is only matched against the
+rules that can apply to it, and any number of rules run in one traversal.
+Rules can be kept in a text file, one "CODE pattern" per line (see
+readRules), and given to mc4.py with --rules.
+"""
+import ast
+import functools
+import re
+from collections import namedtuple
+
+# Python types that can be used in patterns of field values
+VALUE_TYPES = {'str': str, 'bytes': bytes, 'int': int, 'float': float, 'complex': complex,
+               'bool': bool}
+
+RULE_LINE = re.compile(r'([A-Za-z][A-Za-z0-9_]*)\s+(.+)')
+
+class Rule(namedtuple('Rule', ['code', 'pattern'])):
+    """An MC³ code (new, or one of MC3_CODES to extend it) detected at every
+       node matching pattern, in the language described above.
+    """
+    __slots__ = ()
+
+class AnyPattern:
+    def match(self, value):
+        return True
+
+class ValuePattern:
+    def __init__(self, value):
+        self.value = value
+
+    def match(self, value):
+        return type(value) is type(self.value) and value == self.value
+
+class TypePattern:
+    def __init__(self, valueType):
+        self.valueType = valueType
+
+    def match(self, value):
+        return isinstance(value, self.valueType)
+
+class NodePattern:
+    def __init__(self, types, fields):
+        self.types = types
+        self.fields = list(fields.items())
+
+    def match(self, value):
+        if not isinstance(value, self.types):
+            return False
+
+        for field, pattern in self.fields:
+            if not pattern.match(getattr(value, field, None)):
+                return False
+
+        return True
+
+class ListPattern:
+    def __init__(self, items):
+        self.items = items
+
+    def match(self, value):
+        return isinstance(value, list) and len(value) == len(self.items) and \
+               all(pattern.match(item) for pattern, item in zip(self.items, value))
+
+class HasPattern:
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def match(self, value):
+        return isinstance(value, list) and any(self.pattern.match(item) for item in value)
+
+class ItemPattern:
+    def __init__(self, index, pattern):
+        self.index = index
+        self.pattern = pattern
+
+    def match(self, value):
+        return isinstance(value, list) and -len(value) <= self.index < len(value) and \
+               self.pattern.match(value[self.index])
+
+class AnyOfPattern:
+    def __init__(self, patterns):
+        self.patterns = patterns
+
+    def match(self, value):
+        return any(pattern.match(value) for pattern in self.patterns)
+
+class NotPattern:
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def match(self, value):
+        return not self.pattern.match(value)
+
+def astType(name):
+    nodeType = getattr(ast, name, None)
+    if isinstance(nodeType, type) and issubclass(nodeType, ast.AST):
+        return nodeType
+    return None
+
+def parsePattern(text):
+    """Compiles a pattern written in the language above. Raises ValueError
+       if it is not valid.
+    """
+    try:
+        expression = ast.parse(text.strip(), mode='eval').body
+    except SyntaxError as e:
+        raise ValueError(f"invalid pattern {text!r}: {e.msg}")
+
+    return compilePattern(expression)
+
+def compilePattern(node):
+    if isinstance(node, ast.Name):
+        if node.id == '_':
+            return AnyPattern()
+
+        if node.id in VALUE_TYPES:
+            return TypePattern(VALUE_TYPES[node.id])
+
+        if astType(node.id) is not None:
+            return NodePattern(astType(node.id), {})
+
+        raise ValueError(f"unknown node type {node.id!r}")
+
+    if isinstance(node, ast.Constant):
+        return ValuePattern(node.value)
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and \
+       isinstance(node.operand, ast.Constant) and \
+       isinstance(node.operand.value, (int, float, complex)):
+        return ValuePattern(-node.operand.value)
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+        return NotPattern(compilePattern(node.operand))
+
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        patterns = []
+        for side in (node.left, node.right):
+            pattern = compilePattern(side)
+            patterns.extend(pattern.patterns if isinstance(pattern, AnyOfPattern) else [pattern])
+        return AnyOfPattern(patterns)
+
+    if isinstance(node, ast.List):
+        return ListPattern([compilePattern(item) for item in node.elts])
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        return compileCall(node.func.id, node.args, node.keywords)
+
+    raise ValueError(f"unexpected {ast.unparse(node)!r} in pattern")
+
+def compileCall(name, args, keywords):
+    if name == 'has' and len(args) == 1 and len(keywords) == 0:
+        return HasPattern(compilePattern(args[0]))
+
+    if name == 'item' and len(args) == 2 and len(keywords) == 0:
+        index = compilePattern(args[0])
+        if not (isinstance(index, ValuePattern) and type(index.value) is int):
+            raise ValueError('item() takes an integer index')
+        return ItemPattern(index.value, compilePattern(args[1]))
+
+    nodeType = astType(name)
+    if nodeType is None:
+        raise ValueError(f"unknown node type {name!r}")
+
+    if len(args) > 0:
+        raise ValueError(f"fields of {name} must be given by name e.g. {name}(field=...)")
+
+    fields = {}
+    for keyword in keywords:
+        if keyword.arg not in nodeType._fields and \
+           not any(keyword.arg in subclass._fields for subclass in concreteTypes(nodeType)):
+            raise ValueError(f"{name} has no field {keyword.arg!r}")
+        fields[keyword.arg] = compilePattern(keyword.value)
+
+    return NodePattern(nodeType, fields)
+
+def concreteTypes(nodeType):
+    """A node type and all its subclasses, e.g. every statement type for stmt.
+    """
+    types = [nodeType]
+    for subclass in nodeType.__subclasses__():
+        types.extend(concreteTypes(subclass))
+    return types
+
+def rootTypes(pattern):
+    """The node types a pattern can match, or None if it is not restricted
+       to some node types.
+    """
+    if isinstance(pattern, NodePattern):
+        return concreteTypes(pattern.types)
+
+    if isinstance(pattern, AnyOfPattern):
+        types = [rootTypes(alternative) for alternative in pattern.patterns]
+        if None not in types:
+            return [nodeType for alternative in types for nodeType in alternative]
+
+    return None
+
+class RuleTable:
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.codes = list(dict.fromkeys(rule.code for rule in self.rules))
+        self.dispatch = {}      # node type -> [(code, pattern)]
+
+        for rule in self.rules:
+            try:
+                pattern = parsePattern(rule.pattern)
+            except ValueError as e:
+                raise ValueError(f"rule {rule.code}: {e}")
+
+            types = rootTypes(pattern)
+            if types is None:
+                raise ValueError(f"rule {rule.code}: the pattern must be a node type, "
+                                 f"e.g. While(...), or alternatives of node types")
+
+            for nodeType in dict.fromkeys(types):
+                self.dispatch.setdefault(nodeType, []).append((rule.code, pattern))
+
+    def matches(self, node):
+        """The codes of the rules matching a node, with repetitions.
+        """
+        return [code for code, pattern in self.dispatch.get(type(node), ())
+                if pattern.match(node)]
+
+    def findMatches(self, root, codes = None):
+        """(code, node) of every match in a tree, for the rules of the given
+           codes (all rules by default).
+        """
+        return [(code, node) for node in ast.walk(root)
+                for code, pattern in self.dispatch.get(type(node), ())
+                if (codes is None or code in codes) and pattern.match(node)]
+
+@functools.lru_cache(maxsize=64)
+def compileRules(rules):
+    """RuleTable of a tuple of Rules, compiled once per process.
+    """
+    return RuleTable(rules)
+
+def readRules(file):
+    """Rules from a text file: one "CODE pattern" per line, blank lines and
+       lines starting with # ignored. Raises ValueError on invalid lines or
+       patterns.
+    """
+    rules = []
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        match = RULE_LINE.fullmatch(line)
+        if match is None:
+            raise ValueError(f"line {number}: expected a code followed by a pattern")
+
+        rules.append(Rule(match.group(1), match.group(2)))
+
+    compileRules(tuple(rules))
+    return tuple(rules)
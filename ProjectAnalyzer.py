@@ -0,0 +1,360 @@
+"""Project mode: analysis of submissions made of several modules.
+
+A project is a directory of modules (and packages) submitted together, e.g.
+one student's submission to a multi-file assignment. Each module gets its
+own ReportMC3, as if analyzed alone, except that A4 and D4 also see what it
+imports from the other modules of the project:
+
+    from helpers import max     A4, if helpers defines a function or a
+                                variable named max
+    from config import total    D4 for the functions using total, if it is
+    import config               a variable of config, or using config.total
+
+Each module is parsed at most once and summarized in a ModuleSummary: its
+variables, its functions with their parameters, its classes, its __all__
+and its import statements. The import graph is resolved from the summaries
+alone, from the project's root or from the importing module's directory
+(where a script's imports are looked for). Summaries are cached by a hash
+of the module's source, and reports by that hash together with everything
+the module imports from the project, so a module shared by a whole cohort,
+such as a skeleton given by the instructor, is parsed and analyzed once
+rather than once per submission.
+"""
+import ast
+import hashlib
+import os
+from collections import OrderedDict, namedtuple
+
+from AnalyzerMC3 import AnalyzerMC3
+from SymbolTable import buildSymbolTable
+
+# Nodes whose body does not run at module level
+SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+
+class ImportStatement(namedtuple('ImportStatement', ['module', 'level', 'names',
+                                                     'moduleLevel'])):
+    """An import as written: module is None for import a.b, c (names are then
+       the modules), level is the number of leading dots of a relative import
+       and names are (name, asname) pairs. moduleLevel tells if it runs at
+       module level, outside any function or class.
+    """
+    __slots__ = ()
+
+class ModuleSummary(namedtuple('ModuleSummary', ['variables', 'functions', 'classes',
+                                                 'exports', 'imports'])):
+    """What the other modules of a project can use of a module: its module
+       level variables, functions as (name, parameters) and classes, the names
+       in its __all__ (None if it has none) and its ImportStatements, in the
+       order of importNodes.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def fromTree(cls, tree):
+        table = buildSymbolTable(tree)
+        functions = tuple((scope.node.name, tuple(scope.parameters))
+                          for scope in table.module.children if scope.kind == 'function')
+        classes = tuple(scope.node.name for scope in table.module.children
+                        if scope.kind == 'class')
+
+        imports = []
+        for node, moduleLevel in importNodes(tree):
+            module = node.module if isinstance(node, ast.ImportFrom) else None
+            level = node.level if isinstance(node, ast.ImportFrom) else 0
+            imports.append(ImportStatement(module, level,
+                                           tuple((alias.name, alias.asname)
+                                                 for alias in node.names), moduleLevel))
+
+        return cls(tuple(sorted(table.moduleVariables())), functions, classes,
+                   dunderAll(tree), tuple(imports))
+
+class ImportedName(namedtuple('ImportedName', ['name', 'kind', 'variables'])):
+    """A name bound by an import from another module of the project. kind is
+       'variable', 'function', 'class' or 'module'; the variables of a module
+       are given to tell which of its attributes are variables.
+    """
+    __slots__ = ()
+
+def importNodes(tree):
+    """(node, moduleLevel) for every Import and ImportFrom node of a tree, in
+       depth-first order.
+    """
+    nodes = []
+    stack = [(tree, True)]
+    while stack:
+        node, moduleLevel = stack.pop()
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            nodes.append((node, moduleLevel))
+            continue
+
+        inside = moduleLevel and not isinstance(node, SCOPES)
+        stack.extend((child, inside) for child in reversed(list(ast.iter_child_nodes(node))))
+
+    return nodes
+
+def dunderAll(tree):
+    """The names of a literal __all__ = [...] at module level, or None.
+    """
+    names = None
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and \
+           isinstance(node.targets[0], ast.Name) and node.targets[0].id == '__all__' and \
+           isinstance(node.value, (ast.List, ast.Tuple)) and \
+           all(isinstance(item, ast.Constant) and isinstance(item.value, str)
+               for item in node.value.elts):
+            names = tuple(item.value for item in node.value.elts)
+
+    return names
+
+def sourceDigest(source):
+    if isinstance(source, str):
+        source = source.encode('utf-8', 'surrogatepass')
+    return hashlib.blake2b(source, digest_size=16).digest()
+
+class Project:
+    """The modules of a project and how they import each other. summaries maps
+       each module's dotted name (e.g. pkg.helpers) to its ModuleSummary, or
+       to None if it could not be parsed; packages are the modules that are
+       a package's __init__.py.
+    """
+    def __init__(self, summaries, packages = ()):
+        self.summaries = summaries
+        self.packages = set(packages)
+        self.namespaces = {}
+
+        #Directories holding modules can be imported as namespace packages
+        self.directories = set('.'.join(name.split('.')[:end]) for name in summaries
+                               for end in range(1, name.count('.') + 1))
+
+    def isModule(self, name):
+        return name in self.summaries or name in self.directories
+
+    def resolve(self, importer, name, level = 0):
+        """The module of the project that an import in module importer refers
+           to, or None if it is not in the project.
+        """
+        parent = importer.split('.')
+        if importer not in self.packages:
+            parent = parent[:-1]
+
+        if level > 0:
+            if level - 1 > len(parent):
+                return None
+            base = parent[:len(parent) - level + 1]
+            candidates = ['.'.join(base + name.split('.')) if name else '.'.join(base)]
+        else:
+            candidates = [name, '.'.join(parent + [name])]
+
+        for candidate in candidates:
+            if candidate and self.isModule(candidate):
+                return candidate
+
+        return None
+
+    def moduleName(self, name, module):
+        summary = self.summaries.get(module)
+        return ImportedName(name, 'module',
+                            frozenset(summary.variables) if summary is not None else frozenset())
+
+    def namespace(self, module):
+        """The names a module binds at module level, to ImportedNames: its own
+           variables, functions and classes, and what its module-level imports
+           bind from the project. Within an import cycle, a module only sees
+           the own names of the modules still being resolved.
+        """
+        names = self.namespaces.get(module)
+        if names is not None:
+            return names
+
+        names = self.namespaces[module] = {}
+        summary = self.summaries.get(module)
+        if summary is None:
+            return names
+
+        for kind, defined in [('class', summary.classes),
+                              ('function', [name for name, _ in summary.functions]),
+                              ('variable', summary.variables)]:
+            for name in defined:
+                names[name] = ImportedName(name, kind, frozenset())
+
+        for statement in summary.imports:
+            if statement.moduleLevel:
+                for imported in self.importedNames(module, statement):
+                    names.setdefault(imported.name, imported)
+
+        return names
+
+    def importedNames(self, module, statement):
+        """The ImportedNames an ImportStatement of a module binds from the project.
+        """
+        found = []
+
+        if statement.module is None and statement.level == 0:
+            for name, asname in statement.names:
+                #import a.b binds a, import a.b as c binds a.b
+                target = self.resolve(module, name if asname else name.split('.')[0])
+                if target is not None:
+                    found.append(self.moduleName(asname or name.split('.')[0], target))
+            return tuple(found)
+
+        base = self.resolve(module, statement.module or '', statement.level)
+        if base is None:
+            return ()
+
+        namespace = self.namespace(base)
+        for name, asname in statement.names:
+            if name == '*':
+                exports = self.summaries[base].exports if self.summaries.get(base) else None
+                if exports is None:
+                    exports = [export for export in namespace if not export.startswith('_')]
+                found.extend(namespace[export] for export in exports if export in namespace)
+
+            elif name in namespace:
+                found.append(namespace[name]._replace(name=asname or name))
+
+            elif self.isModule(f"{base}.{name}"):
+                found.append(self.moduleName(asname or name, f"{base}.{name}"))
+
+        return tuple(found)
+
+    def bindings(self, module):
+        """The ImportedNames of each ImportStatement of a module, in order.
+        """
+        return tuple(self.importedNames(module, statement)
+                     for statement in self.summaries[module].imports)
+
+def projectModules(path):
+    """(module name, file path, is a package) of every module of a project
+       directory, in sorted path order. A single .py file is a project too.
+    """
+    if not os.path.isdir(path):
+        return [(os.path.splitext(os.path.basename(path))[0], path, False)]
+
+    modules = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith('.py'):
+                continue
+
+            filePath = os.path.join(dirpath, filename)
+            parts = os.path.relpath(filePath, path)[:-3].split(os.sep)
+            isPackage = len(parts) > 1 and parts[-1] == '__init__'
+            if isPackage:
+                parts = parts[:-1]
+            modules.append(('.'.join(parts), filePath, isPackage))
+
+    return modules
+
+class ProjectAnalyzer:
+    def __init__(self, constThreshold = 1, numListsThreshold = 0, varLenThreshold = 0,
+                 funcLenThreshold = 0, totalNamesThreshold = 100, rules = (),
+                 maxModules = 100000):
+        self._analyzer = AnalyzerMC3(constThreshold, numListsThreshold, varLenThreshold,
+                                     funcLenThreshold, totalNamesThreshold, rules)
+        self.maxModules = maxModules
+        self.summaries = OrderedDict()  # source digest -> ModuleSummary
+        self.reports = OrderedDict()    # (source digest, bindings) -> ReportMC3
+
+        self.lastModules = 0
+        self.lastParsed = 0
+        self.lastAnalyzed = 0
+
+    @property
+    def thresholds(self):
+        return self._analyzer.thresholds
+
+    @property
+    def rules(self):
+        return self._analyzer.rules
+
+    def cached(self, cache, key):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def store(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.maxModules:
+            cache.popitem(last=False)
+
+    def parse(self, source):
+        self.lastParsed += 1
+        return ast.parse(source)
+
+    def analyzeSources(self, sources, packages = ()):
+        """Analyzes the modules of a project, given as {dotted module name:
+           source (str or bytes)}, packages being the names of the __init__
+           modules. Returns {module name: (ReportMC3, None)}, or (None, error
+           message) for the modules that could not be analyzed. lastModules,
+           lastParsed and lastAnalyzed tell how many modules the project has
+           and how many of them had to be parsed and analyzed.
+        """
+        self.lastModules = len(sources)
+        self.lastParsed = 0
+        self.lastAnalyzed = 0
+
+        digests, trees, summaries, results = {}, {}, {}, {}
+        for name, source in sources.items():
+            digests[name] = sourceDigest(source)
+
+            summary = self.cached(self.summaries, digests[name])
+            if summary is None:
+                try:
+                    trees[name] = self.parse(source)
+                    summary = ModuleSummary.fromTree(trees[name])
+                except (SyntaxError, ValueError, RecursionError) as e:
+                    results[name] = (None, f"{type(e).__name__}: {e}")
+                    continue
+                self.store(self.summaries, digests[name], summary)
+
+            summaries[name] = summary
+
+        project = Project(summaries, packages)
+        for name, source in sources.items():
+            if name in results:
+                continue
+
+            bindings = project.bindings(name)
+            key = (digests[name], bindings)
+
+            report = self.cached(self.reports, key)
+            if report is None:
+                try:
+                    tree = trees[name] if name in trees else self.parse(source)
+                    imports = {node: names for (node, _), names in zip(importNodes(tree), bindings)
+                               if len(names) > 0}
+                    report = self._analyzer.analyze(tree, imports=imports or None)
+                except (SyntaxError, ValueError, RecursionError) as e:
+                    results[name] = (None, f"{type(e).__name__}: {e}")
+                    continue
+
+                self.lastAnalyzed += 1
+                self.store(self.reports, key, report)
+
+            results[name] = (report, None)
+
+        return {name: results[name] for name in sources}
+
+    def analyzePath(self, path):
+        """Analyzes a project directory (or a single file) and returns (file
+           path, ReportMC3, error message) for each of its modules, in sorted
+           path order, the report being None on errors.
+        """
+        modules = projectModules(path)
+
+        sources, errors, packages = {}, {}, []
+        for name, filePath, isPackage in modules:
+            try:
+                with open(filePath, 'rb') as file:
+                    sources[name] = file.read()
+            except (OSError, ValueError) as e:
+                errors[name] = f"{type(e).__name__}: {e}"
+
+            if isPackage:
+                packages.append(name)
+
+        results = self.analyzeSources(sources, packages)
+        return [(filePath, *results.get(name, (None, errors.get(name))))
+                for name, filePath, _ in modules]
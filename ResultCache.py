@@ -0,0 +1,97 @@
+"""On-disk cache of MC4 results, stored in a local SQLite database.
+
+Results are keyed by a hash of the source code, the instructor's constants
+and VisitorMC3.DETECTOR_VERSION, so a cached result is only reused when
+none of them changed. The cache holds at most maxEntries results; when it
+grows beyond that, the least recently used ones are evicted.
+"""
+import hashlib
+import sqlite3
+import time
+
+from VisitorMC3 import DETECTOR_VERSION
+
+def cacheKey(source, thresholds, prefilter = False, rules = ()):
+    """Hash of a source (bytes) together with the constants and rules used to
+       analyze it. Constants are hashed as floats, so 70 and 70.0 share their
+       results. Results of prefiltered runs are kept apart, since the files
+       they do not parse are never reported as syntax errors.
+    """
+    thresholds = tuple(float(threshold) for threshold in thresholds)
+
+    digest = hashlib.sha256()
+    digest.update(f"{DETECTOR_VERSION}|{thresholds!r}|".encode())
+    if prefilter:
+        digest.update(b"prefilter|")
+    if rules:
+        digest.update(f"{tuple(tuple(rule) for rule in rules)!r}|".encode())
+    digest.update(source)
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, path, maxEntries = 1000000, commitEvery = 1000):
+        self.maxEntries = maxEntries
+        self.commitEvery = commitEvery
+        self.pending = 0
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                       key TEXT PRIMARY KEY,
+                                       codes TEXT NOT NULL,
+                                       lastUsed REAL NOT NULL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS resultsLastUsed "
+                                "ON results (lastUsed)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, key):
+        """Returns the cached list of detected MC³, or None on a miss.
+        """
+        row = self.connection.execute("SELECT codes FROM results WHERE key = ?",
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+
+        self.connection.execute("UPDATE results SET lastUsed = ? WHERE key = ?",
+                                (time.time(), key))
+        self.touch()
+        return row[0].split()
+
+    def put(self, key, codes):
+        self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                                (key, ' '.join(codes), time.time()))
+        self.touch()
+
+    def touch(self):
+        """Commits (and evicts) once every commitEvery writes.
+        """
+        self.pending += 1
+        if self.pending >= self.commitEvery:
+            self.commit()
+
+    def commit(self):
+        self.evict()
+        self.connection.commit()
+        self.pending = 0
+
+    def evict(self):
+        """Removes the least recently used results beyond maxEntries.
+        """
+        excess = len(self) - self.maxEntries
+        if excess > 0:
+            self.connection.execute("""DELETE FROM results WHERE key IN (
+                                           SELECT key FROM results
+                                           ORDER BY lastUsed LIMIT ?)""", (excess,))
+
+    def close(self):
+        self.commit()
+        self.connection.close()
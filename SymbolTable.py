@@ -0,0 +1,325 @@
+"""Scope analysis shared by the MC4 detectors.
+
+A SymbolTable records, for the module and every function, lambda, class and
+comprehension, which names are parameters, which are bound (assigned,
+imported or defined), which are used and which are declared global or
+nonlocal. Names are then resolved like Python does: local to the scope,
+free (bound in an enclosing function) or global.
+
+The table is filled by hooks called during a traversal, so it can be built
+by the single-pass engine of VisitorMC3 alongside the other detectors, or
+on its own with buildSymbolTable(tree). Either way the tree is visited
+once, however deeply functions are nested.
+"""
+import ast
+
+LOCAL, FREE, GLOBAL = 'local', 'free', 'global'
+
+COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+class Scope:
+    def __init__(self, node, kind, parent):
+        self.node = node
+        self.kind = kind            # 'module', 'function', 'lambda', 'class' or 'comprehension'
+        self.parent = parent
+        self.children = []
+
+        self.parameters = []
+        self.bindings = {}          # name -> set of 'variable', 'import' and 'definition'
+        self.uses = set()
+        self.declaredGlobal = set()
+        self.declaredNonlocal = set()
+        self.attributes = set()     # (name, attr) of the name.attr used, in project mode
+
+        if parent is not None:
+            parent.children.append(self)
+
+    def bind(self, name, kind):
+        self.bindings.setdefault(name, set()).add(kind)
+
+    def isBound(self, name):
+        return name in self.bindings or name in self.parameters
+
+    def lookup(self, name):
+        """The scope whose binding a name used in this scope refers to (the
+           module scope for globals and builtins).
+        """
+        scope = self
+        while scope.parent is not None:
+            #Names in a class body are not visible to the functions inside it
+            if scope is self or scope.kind != 'class':
+                if name in scope.declaredGlobal:
+                    break
+
+                if scope.isBound(name) and name not in scope.declaredNonlocal:
+                    return scope
+
+            scope = scope.parent
+
+        while scope.parent is not None:
+            scope = scope.parent
+        return scope
+
+    def resolve(self, name):
+        """Where a name used in this scope comes from: LOCAL, FREE or GLOBAL.
+        """
+        scope = self.lookup(name)
+
+        if scope.kind == 'module':
+            return GLOBAL
+
+        return LOCAL if scope is self else FREE
+
+    def isWithin(self, other):
+        scope = self
+        while scope is not None and scope is not other:
+            scope = scope.parent
+        return scope is other
+
+    def function(self):
+        """The nearest def (FunctionDef or AsyncFunctionDef) scope enclosing this
+           one, itself included, or None.
+        """
+        scope = self
+        while scope is not None and scope.kind != 'function':
+            scope = scope.parent
+        return scope
+
+class SymbolTable:
+    """imports, in project mode, maps the Import and ImportFrom nodes of the
+       tree to the names they bind from the other modules of the submission
+       (see ProjectAnalyzer.py): imported variables then count as module
+       variables, and so do the variables of imported modules used as
+       module.variable.
+    """
+    def __init__(self, root = None, imports = None):
+        self.module = Scope(root, 'module', None)
+        self.current = self.module
+        self.scopes = [self.module]
+        self.walrusTargets = set()
+
+        self.imports = imports or {}
+        self.importedModules = {}   # module name bound at module level -> its variables
+
+    # Hooks called by the traversal
+
+    def enterScope(self, node):
+        """Opens the scope of a function, lambda, class or comprehension. Must
+           be called right before visiting the part of node evaluated inside
+           it (see scopedBody).
+        """
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            kind = 'function'
+        elif isinstance(node, ast.Lambda):
+            kind = 'lambda'
+        elif isinstance(node, ast.ClassDef):
+            kind = 'class'
+        else:
+            kind = 'comprehension'
+
+        scope = Scope(node, kind, self.current)
+        if kind in ('function', 'lambda'):
+            arguments = node.args
+            for arg in arguments.posonlyargs + arguments.args + arguments.kwonlyargs + \
+                       [arguments.vararg, arguments.kwarg]:
+                if arg is not None:
+                    scope.parameters.append(arg.arg)
+
+        self.scopes.append(scope)
+        self.current = scope
+
+    def exitScope(self):
+        self.current = self.current.parent
+
+    def record(self, node):
+        """Records the names bound, used or declared by a single node. Must be
+           called for every node, in the scope where it is evaluated.
+        """
+        scope = self.current
+
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                scope.uses.add(node.id)
+            elif id(node) in self.walrusTargets:
+                self.walrusTargets.discard(id(node))
+                while scope.kind == 'comprehension':
+                    scope = scope.parent
+                scope.bind(node.id, 'variable')
+            else:
+                scope.bind(node.id, 'variable')
+
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            scope.bind(node.name, 'definition')
+
+        elif isinstance(node, ast.AugAssign):
+            #i += 1 reads i before storing it
+            if isinstance(node.target, ast.Name):
+                scope.uses.add(node.target.id)
+
+        elif isinstance(node, ast.NamedExpr):
+            self.walrusTargets.add(id(node.target))
+
+        elif isinstance(node, ast.Global):
+            scope.declaredGlobal.update(node.names)
+
+        elif isinstance(node, ast.Nonlocal):
+            scope.declaredNonlocal.update(node.names)
+
+        elif isinstance(node, ast.alias):
+            if node.name != '*':
+                scope.bind(node.asname or node.name.split('.')[0], 'import')
+
+        elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)):
+            if node.name is not None:
+                scope.bind(node.name, 'variable')
+
+        elif isinstance(node, ast.MatchMapping):
+            if node.rest is not None:
+                scope.bind(node.rest, 'variable')
+
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for imported in self.imports.get(node, ()):
+                #from module import * binds no alias
+                scope.bind(imported.name, 'import')
+                if imported.kind == 'variable':
+                    scope.bind(imported.name, 'importedVariable')
+                elif imported.kind == 'module' and scope is self.module:
+                    self.importedModules[imported.name] = imported.variables
+
+        elif self.imports and isinstance(node, ast.Attribute) and \
+             isinstance(node.value, ast.Name):
+            scope.attributes.add((node.value.id, node.attr))
+
+    # Queries
+
+    def hasClasses(self):
+        return any(scope.kind == 'class' for scope in self.scopes)
+
+    def moduleVariables(self):
+        """Names assigned at module level, leaving out imports, functions and
+           classes. In project mode, the variables imported from other modules
+           of the submission are included.
+        """
+        return set(name for name, kinds in self.module.bindings.items()
+                   if 'variable' in kinds or 'importedVariable' in kinds)
+
+    def outerScopeAccesses(self):
+        """D4: (function name, variable name, reason) for each variable of an
+           outer scope that a function touches. Lambdas and comprehensions count
+           for the def they are in. Reasons are 'global' (uses or declares a
+           module variable), 'free' (uses a variable of an enclosing function)
+           and 'shadow' (assigns a local with the name of a module variable).
+        """
+        moduleVariables = self.moduleVariables()
+        return sorted(set((funcName, name, reason)
+                          for funcName, name, reason, needsModuleVariable
+                          in self.accessCandidates()
+                          if not needsModuleVariable or name in moduleVariables))
+
+    def accessCandidates(self):
+        """The accesses of outerScopeAccesses, before knowing the module
+           variables: each one comes with whether it only counts if the name is
+           a module variable. Lets a module be checked one statement at a time
+           (see IncrementalAnalyzer.py).
+        """
+        candidates = set()
+
+        for scope in self.scopes:
+            function = scope.function()
+            if function is None:
+                continue
+
+            funcName = function.node.name
+            for name in scope.uses:
+                owner = scope.lookup(name)
+
+                if owner.kind == 'module':
+                    candidates.add((funcName, name, 'global', True))
+
+                elif not owner.isWithin(function):
+                    candidates.add((funcName, name, 'free', False))
+
+            for name in scope.declaredGlobal:
+                candidates.add((funcName, name, 'global', False))
+
+            for name, attr in scope.attributes:
+                if attr in self.importedModules.get(name, ()) and \
+                   scope.lookup(name).kind == 'module':
+                    candidates.add((funcName, f"{name}.{attr}", 'global', False))
+
+            if scope is function:
+                for name, kinds in scope.bindings.items():
+                    if 'variable' in kinds and name not in scope.parameters and \
+                       name not in scope.declaredGlobal:
+                        candidates.add((funcName, name, 'shadow', True))
+
+        return candidates
+
+class NullSymbolTable:
+    """Stands in for a SymbolTable when D4 is not needed: the hooks do nothing.
+    """
+    def enterScope(self, node):
+        pass
+
+    def exitScope(self):
+        pass
+
+    def record(self, node):
+        pass
+
+    def hasClasses(self):
+        return False
+
+    def outerScopeAccesses(self):
+        return []
+
+def scopedBody(node):
+    """Splits a scope-creating node into the children evaluated in the
+       enclosing scope and the ones evaluated in its own scope.
+    """
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return [node.args] + node.decorator_list + \
+               ([node.returns] if node.returns is not None else []), node.body
+
+    if isinstance(node, ast.Lambda):
+        return [node.args], [node.body]
+
+    if isinstance(node, ast.ClassDef):
+        return node.bases + node.keywords + node.decorator_list, node.body
+
+    #Comprehensions: only the first iterable is evaluated outside
+    first = node.generators[0]
+    elts = [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+    inner = elts + [first.target] + first.ifs
+    for generator in node.generators[1:]:
+        inner.append(generator)
+
+    return [first.iter], inner
+
+class SymbolTableBuilder(ast.NodeVisitor):
+    """Fills a SymbolTable on its own, for callers that do not run the
+       single-pass engine.
+    """
+    def __init__(self, table):
+        self.table = table
+
+    def generic_visit(self, node):
+        self.table.record(node)
+
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda,
+                             ast.ClassDef) + COMPREHENSIONS):
+            outer, inner = scopedBody(node)
+            for child in outer:
+                self.visit(child)
+
+            self.table.enterScope(node)
+            for child in inner:
+                self.visit(child)
+            self.table.exitScope()
+        else:
+            super().generic_visit(node)
+
+def buildSymbolTable(tree, imports = None):
+    table = SymbolTable(tree, imports)
+    SymbolTableBuilder(table).visit(tree)
+    return table
@@ -0,0 +1,375 @@
+"""Optional per-detector instrumentation and latency telemetry for MC4.
+
+A Telemetry collects, for each detector of the fused traversal
+(VisitorMC3.analyze), the files it analyzed, the wall time spent in its
+handlers, the AST nodes they were given and how often it fired, together
+with latency histograms per detector and per file (p50/p95/p99) and a log
+of the slowest files. It can be written as a JSON snapshot or as a Prometheus
+textfile (for node_exporter's textfile collector):
+
+    python mc4.py submissions/ --telemetry mc4.prom
+
+Nothing here is used unless asked for: instrument() wraps the handlers of
+a single visitor instance (see HANDLERS), along with its symbol table and
+its rules, so uninstrumented analyses run exactly as before. The numbers
+come from the analysis whose results are reported, not from a second one.
+
+Telemetries are plain picklable objects and merge() adds one into another,
+so each worker can fill its own and the parent process combines them.
+"""
+import ast
+import copy
+import heapq
+import json
+import os
+import tempfile
+import time
+
+from VisitorMC3 import MC3_CODES, TraversalSettled
+
+# Methods of VisitorMC3 doing the work of each MC³ during analyze. D4 is done by
+# the symbol table, and B6, B8, C2 and H1 (like any other rule) by rule patterns
+HANDLERS = {'A4': ('detectBuiltinNames', 'detectBuiltinDefinition', 'detectBuiltinImports'),
+            'B9': ('detectElifRetests',),
+            'B12': ('detectEqualIfs',),
+            'C1': ('detectWhileOpposites',),
+            'C4': ('detectRangeConstant',),
+            'C8': ('detectIterVarAssigned',),
+            'E2': ('detectListDeclaration',),
+            'G4': ('hasNonSignificantNames',),
+            'G5': ('hasArbitraryDeclarations',)}
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+class LatencyHistogram:
+    """Fixed-bucket histogram, so memory does not grow with the number of
+       observations and histograms from different workers can be added.
+    """
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets) + 1)    # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Estimates a quantile by linear interpolation inside its bucket, like
+           Prometheus' histogram_quantile. Returns None without observations.
+        """
+        if self.count == 0:
+            return None
+
+        rank = q*self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count > 0:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower)*(rank - seen)/count
+            seen += count
+
+        return self.buckets[-1]
+
+    def toDict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'quantiles': {str(q): self.quantile(q) for q in QUANTILES},
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'],
+                                    self.counts))}
+
+class CheckStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.nodes = 0
+        self.hits = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.nodes += other.nodes
+        self.hits += other.hits
+        self.errors += other.errors
+        self.latency.merge(other.latency)
+
+    def toDict(self):
+        return {'calls': self.calls, 'seconds': self.seconds, 'nodes': self.nodes,
+                'hits': self.hits, 'errors': self.errors, 'latency': self.latency.toDict()}
+
+class TimedPattern:
+    """Stands for a rule pattern of an instrumented visitor.
+    """
+    __slots__ = ('match',)
+
+    def __init__(self, match):
+        self.match = match
+
+class TimedSymbolTable:
+    """Stands for the symbol table of an instrumented visitor, timing its
+       methods as the work of D4.
+    """
+    def __init__(self, table, timed):
+        self.table = table
+        self.timed = timed
+
+    def __getattr__(self, name):
+        value = getattr(self.table, name)
+        return self.timed('D4', value) if callable(value) else value
+
+class Telemetry:
+    def __init__(self, slowFileSeconds = 1.0, slowFileLimit = 100):
+        self.slowFileSeconds = slowFileSeconds
+        self.slowFileLimit = slowFileLimit
+
+        self.checks = {code: CheckStats() for code in MC3_CODES}
+        self.files = 0
+        self.nodes = 0
+        self.fileLatency = LatencyHistogram()
+        self.slowFiles = []     # heap of (seconds, path, nodes, slowest check)
+
+        #Gathered by the instrumented analyses until observeFile
+        self.fileNodes = 0
+        self.fileChecks = {}
+
+    # Collection
+
+    def instrument(self, visitor):
+        """Wraps the handlers of a VisitorMC3 instance, its symbol table and
+           the patterns of its rules so that each analyze() call records here
+           the time each detector spent and the nodes it was given, whether
+           it fired or raised, and the nodes visited. Returns the visitor.
+        """
+        spent, examined, failed = {}, {}, set()
+
+        def timed(code, handler):
+            def instrumented(*args):
+                start = time.perf_counter()
+                try:
+                    return handler(*args)
+                except TraversalSettled:
+                    raise
+                except Exception:
+                    failed.add(code)
+                    raise
+                finally:
+                    spent[code] = spent.get(code, 0.0) + time.perf_counter() - start
+                    if len(args) > 0 and isinstance(args[0], ast.AST):
+                        examined[code] = examined.get(code, 0) + 1
+
+            return instrumented
+
+        for code, methods in HANDLERS.items():
+            for method in methods:
+                setattr(visitor, method, timed(code, getattr(visitor, method)))
+
+        #The rule tables are shared between visitors, so this one gets a copy
+        ruleTable = copy.copy(visitor.ruleTable)
+        ruleTable.dispatch = {nodeType: [(code, TimedPattern(timed(code, pattern.match)))
+                                         for code, pattern in patterns]
+                              for nodeType, patterns in visitor.ruleTable.dispatch.items()}
+        visitor.ruleTable = ruleTable
+
+        resetTraversal = visitor.resetTraversal
+        def instrumentedReset(*args, **kwargs):
+            resetTraversal(*args, **kwargs)
+            visitor.symbols = TimedSymbolTable(visitor.symbols, timed)
+
+        visitor.resetTraversal = instrumentedReset
+
+        analyze = visitor.analyze
+        def instrumentedAnalyze(root, *args, **kwargs):
+            detectors = kwargs.get('detectors', args[5] if len(args) > 5 else None)
+            codes = [code for code in MC3_CODES + visitor.ruleCodes
+                     if detectors is None or code in detectors]
+            spent.clear()
+            examined.clear()
+            failed.clear()
+
+            report = None
+            try:
+                report = analyze(root, *args, **kwargs)
+            finally:
+                #analyze only visits the tree when a detector other than G5 runs
+                visited = visitor.order + 1 if set(codes) - {'G5'} else 0
+                hits = set(code for code in codes if report is not None and
+                           (report[code][0] if code == 'A4' else report[code]))
+                self.observeAnalysis(codes, spent, examined, hits, failed, visited)
+
+            return report
+
+        visitor.analyze = instrumentedAnalyze
+
+        return visitor
+
+    def observeAnalysis(self, codes, spent, examined, hits, failed, visited):
+        """Records an instrumented analysis: the seconds spent and the nodes
+           examined by each detector in codes, the ones that fired or raised,
+           and the nodes visited by the traversal.
+        """
+        for code in codes:
+            seconds = spent.get(code, 0.0)
+            self.observeCheck(code, seconds, examined.get(code, 0), code in hits,
+                              code in failed)
+            self.fileChecks[code] = self.fileChecks.get(code, 0.0) + seconds
+
+        self.fileNodes += visited
+
+    def observeCheck(self, code, seconds, nodes, hit, error = False):
+        stats = self.checks.setdefault(code, CheckStats())
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.nodes += nodes
+        stats.hits += hit
+        stats.errors += error
+        stats.latency.observe(seconds)
+
+    def observeFile(self, path, seconds, nodes = None, checkSeconds = None):
+        """Records the latency of a whole file. nodes and checkSeconds, the
+           time taken by each detector on that file, default to what the
+           instrumented analyses gathered since the previous file; the
+           slowest detector is named in the slow-file log.
+        """
+        if nodes is None:
+            nodes = self.fileNodes
+        if checkSeconds is None:
+            checkSeconds = self.fileChecks
+        self.fileNodes, self.fileChecks = 0, {}
+
+        self.files += 1
+        self.nodes += nodes
+        self.fileLatency.observe(seconds)
+
+        if seconds >= self.slowFileSeconds:
+            slowest = max(checkSeconds, key=checkSeconds.get) if checkSeconds else None
+            entry = (seconds, path, nodes, slowest)
+            if len(self.slowFiles) < self.slowFileLimit:
+                heapq.heappush(self.slowFiles, entry)
+            else:
+                heapq.heappushpop(self.slowFiles, entry)
+
+    def merge(self, other):
+        for code, stats in other.checks.items():
+            self.checks.setdefault(code, CheckStats()).merge(stats)
+
+        self.files += other.files
+        self.nodes += other.nodes
+        self.fileLatency.merge(other.fileLatency)
+
+        for entry in other.slowFiles:
+            if entry[0] < self.slowFileSeconds:
+                continue
+            if len(self.slowFiles) < self.slowFileLimit:
+                heapq.heappush(self.slowFiles, entry)
+            else:
+                heapq.heappushpop(self.slowFiles, entry)
+
+    # Export
+
+    def snapshot(self):
+        return {'files': self.files,
+                'nodes': self.nodes,
+                'fileLatency': self.fileLatency.toDict(),
+                'checks': {code: stats.toDict() for code, stats in self.checks.items()},
+                'slowFiles': [{'path': path, 'seconds': seconds, 'nodes': nodes,
+                               'slowestCheck': slowest}
+                              for seconds, path, nodes, slowest in sorted(self.slowFiles,
+                                                                          reverse=True)]}
+
+    def prometheusText(self):
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        def labelled(labels, extra = None):
+            labels = labels + ([extra] if extra is not None else [])
+            return '{' + ','.join(labels) + '}' if labels else ''
+
+        def histogramSamples(histogram, labels):
+            samples, cumulative = [], 0
+            for bound, count in zip([str(bound) for bound in histogram.buckets] + ['+Inf'],
+                                    histogram.counts):
+                cumulative += count
+                samples.append(('_bucket' + labelled(labels, f'le="{bound}"'), cumulative))
+            samples.append(('_sum' + labelled(labels), histogram.sum))
+            samples.append(('_count' + labelled(labels), histogram.count))
+            return samples
+
+        def quantileSamples(histogram, labels):
+            return [(labelled(labels, f'quantile="{q}"'), histogram.quantile(q))
+                    for q in QUANTILES if histogram.count > 0]
+
+        metric('mc4_files_total', 'counter', 'Files analyzed.', [('', self.files)])
+        metric('mc4_nodes_total', 'counter', 'AST nodes visited in the files analyzed.',
+               [('', self.nodes)])
+
+        lines.append('# HELP mc4_file_seconds Time to parse and analyze a file.')
+        lines.append('# TYPE mc4_file_seconds histogram')
+        for suffix, value in histogramSamples(self.fileLatency, []):
+            lines.append(f"mc4_file_seconds{suffix} {value}")
+        metric('mc4_file_seconds_quantile', 'gauge', 'Estimated file latency quantiles.',
+               quantileSamples(self.fileLatency, []))
+
+        for name, attribute, help in [('calls', 'calls', 'Files analyzed by each detector.'),
+                                      ('seconds', 'seconds', 'Time spent in each detector.'),
+                                      ('nodes', 'nodes', 'AST nodes given to each detector.'),
+                                      ('hits', 'hits', 'Files where each MC³ was found.'),
+                                      ('errors', 'errors', 'Files where a detector raised.')]:
+            metric(f"mc4_check_{name}_total", 'counter', help,
+                   [(f'{{detector="{code}"}}', getattr(stats, attribute))
+                    for code, stats in self.checks.items()])
+
+        lines.append('# HELP mc4_check_seconds Time spent by each detector on a file.')
+        lines.append('# TYPE mc4_check_seconds histogram')
+        for code, stats in self.checks.items():
+            for suffix, value in histogramSamples(stats.latency, [f'detector="{code}"']):
+                lines.append(f"mc4_check_seconds{suffix} {value}")
+
+        metric('mc4_check_seconds_quantile', 'gauge', 'Estimated detector latency quantiles.',
+               [sample for code, stats in self.checks.items()
+                for sample in quantileSamples(stats.latency, [f'detector="{code}"'])])
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Writes a JSON snapshot (.json) or a Prometheus textfile (anything
+           else). The file is replaced atomically, as the textfile collector
+           requires.
+        """
+        if path.endswith('.json'):
+            content = json.dumps(self.snapshot(), indent=2)
+        else:
+            content = self.prometheusText()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, tempPath = tempfile.mkstemp(dir=directory, prefix='.mc4-telemetry-')
+        try:
+            with os.fdopen(handle, 'w') as file:
+                file.write(content)
+            os.replace(tempPath, path)
+        except BaseException:
+            os.unlink(tempPath)
+            raise
@@ -1,7 +1,52 @@
 import ast
+from collections import namedtuple
+
+from ConditionTable import ConditionTable, chainRetests, elifChain, nextIfRun, oppositeIfs
+from PatternRules import Rule, compileRules
+from SymbolTable import NullSymbolTable, SymbolTable, buildSymbolTable, scopedBody
+
+LIST_OF_BUILTINS = ['abs', 'all', 'any', 'ascii', 'bin', 'bool', 'bytearray', 'bytes', 
+                    'callable', 'chr', 'classmethod', 'compile', 'complex', 'delattr',
+                    'dict', 'dir', 'divmod', 'enumerate', 'eval', 'exec', 'filter',
+                    'float', 'format', 'frozenset', 'getattr', 'global', 'hasattr',
+                    'hash', 'help', 'hex', 'id', 'input', 'int', 'isinstance', 'issubclass',
+                    'iter', 'len', 'list', 'locals', 'map', 'max', 'memoryview', 'min', 'next',
+                    'object', 'oct', 'open', 'ord', 'pow', 'print', 'property', 'range', 'repr',
+                    'reversed', 'round', 'set', 'setattr', 'slice', 'sorted', 'staticmethod',
+                    'str', 'sum', 'super', 'tuple', 'type', 'vars', 'zip']
+
+MC3_CODES = ['A4', 'B6', 'B8', 'B9', 'B12', 'C1', 'C2', 'C4', 'C8', 'D4', 'E2', 'G4', 'G5', 'H1']
+
+# Bump whenever a detector changes its verdicts, so cached results are not reused
+DETECTOR_VERSION = 5
+
+# The MC³ that only depend on the shape of a node (see PatternRules.py)
+BUILTIN_RULES = (Rule('B6', 'While(test=Compare | BoolOp, body=has(Break))'),
+                 Rule('B8', 'If(orelse=item(0, If(orelse=[])))'),
+                 Rule('C2', 'While(test=Constant(value=True), body=has(Break))'),
+                 Rule('C2', "For(iter=Call(func=Name(id='range'), args=[Constant(value=1)]))"),
+                 Rule('H1', 'Expr(value=Constant(value=~str))'))
+
+class Finding(namedtuple('Finding', ['code', 'line', 'col'])):
+    """One occurrence of an MC³, at the line and column of the node it was
+       found at (see VisitorMC3.findOccurrences).
+    """
+    __slots__ = ()
+
+class TraversalSettled(Exception):
+    """Raised to end a short-circuit traversal once every detector has fired.
+    """
 
 class VisitorMC3(ast.NodeVisitor):
-    def __init__(self):
+    def __init__(self, rules = (), imports = None):
+        #Rules of other codes than MC3_CODES are reported after them
+        self.ruleTable = compileRules(BUILTIN_RULES + tuple(rules))
+        self.ruleCodes = [code for code in self.ruleTable.codes if code not in MC3_CODES]
+
+        #Project mode: Import/ImportFrom node -> the ImportedNames it binds from
+        #the other modules of the submission (see ProjectAnalyzer.py)
+        self.imports = imports
+
         self.builtinRedefinition = False
         self.declaredVariablesAsBuiltIn = []
         self.declaredFunctionsAsBuiltin = []
@@ -32,19 +77,15 @@ class VisitorMC3(ast.NodeVisitor):
            Checks the whole tree checking if any declared variable, function
            name or function argument is within Python's list of built-ins.
 
+           In project mode, names imported from the other modules of the
+           submission count too, as variables or functions depending on what
+           they are in the module they come from.
+
            Rationale: Python lets its users to redefine built-in functions, but,
            considering an CS1 scope, the student is probably doing this unintentionally.
            Thus, it would be best if they are alerted about this practice.
         """
-        list_of_builtins = ['abs', 'all', 'any', 'ascii', 'bin', 'bool', 'bytearray', 'bytes', 
-                            'callable', 'chr', 'classmethod', 'compile', 'complex', 'delattr',
-                            'dict', 'dir', 'divmod', 'enumerate', 'eval', 'exec', 'filter',
-                            'float', 'format', 'frozenset', 'getattr', 'global', 'hasattr',
-                            'hash', 'help', 'hex', 'id', 'input', 'int', 'isinstance', 'issubclass',
-                            'iter', 'len', 'list', 'locals', 'map', 'max', 'memoryview', 'min', 'next',
-                            'object', 'oct', 'open', 'ord', 'pow', 'print', 'property', 'range', 'repr',
-                            'reversed', 'round', 'set', 'setattr', 'slice', 'sorted', 'staticmethod',
-                            'str', 'sum', 'super', 'tuple', 'type', 'vars', 'zip']
+        list_of_builtins = LIST_OF_BUILTINS
 
         #Declared variables
         for node in ast.walk(root):
@@ -62,12 +103,24 @@ class VisitorMC3(ast.NodeVisitor):
                             if name.id in list_of_builtins and name.id not in self.declaredVariablesAsBuiltIn:
                                 self.declaredVariablesAsBuiltIn.append(name.id)
 
+            if isinstance(node, (ast.Import, ast.ImportFrom)) and self.imports is not None:
+                for imported in self.imports.get(node, ()): #e.g. from helpers import max
+                    if imported.kind == 'variable' and imported.name in list_of_builtins and \
+                       imported.name not in self.declaredVariablesAsBuiltIn:
+                        self.declaredVariablesAsBuiltIn.append(imported.name)
+
 
         #Declared function names
         for node in ast.walk(root):
             if isinstance(node, ast.FunctionDef):
                 if node.name in list_of_builtins and node.name not in self.declaredFunctionsAsBuiltin:
                     self.declaredFunctionsAsBuiltin.append(node.name)
+
+            if isinstance(node, (ast.Import, ast.ImportFrom)) and self.imports is not None:
+                for imported in self.imports.get(node, ()):
+                    if imported.kind == 'function' and imported.name in list_of_builtins and \
+                       imported.name not in self.declaredFunctionsAsBuiltin:
+                        self.declaredFunctionsAsBuiltin.append(imported.name)
         
         #Arguments in declared function names
         for node in ast.walk(root):
@@ -95,12 +148,8 @@ class VisitorMC3(ast.NodeVisitor):
            students are trying to use the While loop as an If-statament. This MC³
            is a special case of C2 - Redundant or unnecessary loop.
         """
-        for node in ast.walk(root):
-            if isinstance(node, ast.While):
-                if isinstance(node.test, ast.Compare) or isinstance(node.test, ast.BoolOp):
-                    for item in node.body:
-                        if isinstance(item, ast.Break):
-                            self.boolOpAttemptedWithWhile = True
+        if self.ruleTable.findMatches(root, ['B6']):
+            self.boolOpAttemptedWithWhile = True
     
     def checkNonUtilizationElifElse(self, root):
         """Designed as a counter for B8 - Non utilization of elif/else.
@@ -119,180 +168,65 @@ class VisitorMC3(ast.NodeVisitor):
            but it's better to flag 'em out to the student nonetheless.
         """
 
-        def checkElifWithoutElse(root):
-            """This checks if there is an If, followed by an Elif without an Else.
-
-               It uses the orelse field present in each If statement. In the case of
-               an Elif, there is an immediate If statement in the parent orelse. However,
-               this can trigger false positives when an If is immediately used inside 
-               an Else.
-            """
-            for node in ast.walk(root):
-                if isinstance(node, ast.If):
-                    if len(node.orelse) > 0:
-                        if isinstance(node.orelse[0], ast.If):
-                            if len(node.orelse[0].orelse) == 0:
-                                self.nonUtilizationElifElse = True
-
-        checkElifWithoutElse(root)
+        #1) is the rule If(orelse=item(0, If(orelse=[]))). It can trigger false
+        #positives when an If is immediately used inside an Else
+        if self.ruleTable.findMatches(root, ['B8']):
+            self.nonUtilizationElifElse = True
 
     def checkElifRetestingCondition(self, root):
         """Designed as a counter for B9 - elif/else retesting already checked 
            conditions.
            
-           Checks the whole tree for an If/Elif statement that has a SINGLE Compare 
-           node (e.g. if a > 0) that is followed by Elif stataments in which the
-           opposite comparison is made (e.g. elif a <= 0). While searching for
-           the opposite comparisons, this methods checks BinOps until a Compare node
-           is reached, thus comparing with the original statement. Will also work with
-           If statements declared in the Else block of the first If analyzed.
+           Checks the whole tree for If/Elif chains in which an Elif (or an If
+           declared in the Else block) tests the opposite of a condition
+           already checked above it in the chain (e.g. if a > 0 ... elif b ...
+           elif a <= 0). The condition can be any expression (e.g. if done ...
+           elif not done); BoolOps in the retesting test are searched for it.
+           Conditions are compared through their canonical keys (see
+           ConditionTable), so negated and flipped comparisons (e.g. elif
+           0 >= a or elif not a > 0) are recognized too.
 
            Rationale: if the student declares an Elif/Else checking the opposite
            comparison made in an above If statement, this second check is unnecessary
            because of the Elif syntax.
         """
-
-        def compareLeft(node1, node2):
-            """Helper function that compares the left side of two If tests.
-            """
-            if isinstance(node1, ast.Name) and isinstance(node2, ast.Name):
-                return node1.id == node2.id
-
-            return False
-        
-        def compareOps(node1, node2):
-            """Helper function that compares the operation of two If tests. It
-            returns True if they are opposite.
-            """
-            invOp = {ast.Eq: ast.NotEq,
-                     ast.NotEq: ast.Eq,
-                     ast.Lt: ast.GtE,
-                     ast.LtE: ast.Gt,
-                     ast.Gt: ast.LtE,
-                     ast.GtE: ast.Lt,
-                     ast.In: ast.NotIn,
-                     ast.NotIn: ast.In,
-                     ast.Is: ast.IsNot,
-                     ast.IsNot: ast.Is}
-
-            if len(node1) == len(node2) == 1:
-                return invOp[type(node1[0])] == type(node2[0])
-
-            return False
-        
-        def compareRight(node1, node2):
-            """Helper function that compares the right side of two If tests.
-            """
-            if len(node1) == len(node2) == 1:
-                if isinstance(node1[0], ast.Constant) and isinstance(node2[0], ast.Constant):
-                    return node1[0].value == node2[0].value
-                
-                if isinstance(node1[0], ast.Name) and isinstance(node2[0], ast.Name):
-                    return node1[0].id == node2[0].id
-
-                return False
-            return False
-
-        def compareElifsR(node, mainLeft, mainOps, mainCps):
-            '''Helper function that recursively traverses through all Elif/Else
-               and checks if any of their Compare nodes tests the opposite
-               comparison of the first Compare node identified in the prime If
-               statement.
-            '''
-
-            if isinstance(node, ast.Compare):
-                if compareLeft(mainLeft, node.left) and \
-                   compareOps(mainOps, node.ops) and \
-                   compareRight(mainCps, node.comparators):
-                    self.elifRetestingCondition = True
-            
-            if isinstance(node, ast.BoolOp):
-                for chd in node.values:
-                    compareElifsR(chd, mainLeft, mainOps, mainCps)
-
+        table = ConditionTable()
+        chained = set()
 
         for node in ast.walk(root):
-            if isinstance(node, ast.If):
-                if len(node.orelse) > 0 and isinstance(node.test, ast.Compare):
-                    mainIfL = node.test.left
-                    mainIfOps = node.test.ops
-                    mainIfCps = node.test.comparators
+            if isinstance(node, ast.If) and node not in chained:
+                chain = elifChain(node)
+                chained.update(chain[1:])
 
-                    for chd in node.orelse:
-                        if isinstance(chd, ast.If):
-                            compareElifsR(chd.test, mainIfL, mainIfOps, mainIfCps)
+                if chainRetests(table, chain):
+                    self.elifRetestingCondition = True
 
     def checkConsecutiveIfs(self, root):
         """Designed as a counter for B12 - Consecutive equal if statements with 
            distinct operations in their blocks.
            
-           Checks the whole tree for two consecutive equal If statements. Currently
-           only works with If statements in which the test is either an ast.Name
-           (e.g. "if a") or a single ast.Compare node (e.g. "if a > 2").
+           Checks the whole tree for runs of consecutive If statements (with no
+           Elif/Else, in the same block) in which two If statements test the
+           same condition. The condition can be any expression, compared through
+           its canonical key (see ConditionTable) e.g. "if a > 2" and "if 2 < a"
+           are equal.
             
            Rationale: if the code has two (or more) consecutive equal If statements,
            the student is probably dividing a rationale for a single If in multiple
            If's, but they can be declared inside a single If block.
         """
-        def compareLeft(node1, node2):
-            """Helper function that compares the left side of the 1st and 2nd
-               If tests.
-            """
-            if isinstance(node1, ast.Name) and isinstance(node2, ast.Name):
-                return node1.id == node2.id
-
-            return False
-        
-        def compareOps(node1, node2):
-            """Helper function that compares the operation used in the While test 
-               and the If test.
-            """
-            if len(node1) == len(node2) == 1:
-                return node1[0] == node2[0]
-            
-            return False
-        
-        def compareRight(node1, node2):
-            """Helper function that compares the right side of the 1st and 2nd
-               If tests.
-            """
-            if len(node1) == len(node2) == 1:
-                if isinstance(node1[0], ast.Constant) and isinstance(node2[0], ast.Constant):
-                    return node1[0].value == node2[0].value
-                
-                if isinstance(node1[0], ast.Name) and isinstance(node2[0], ast.Name):
-                    return node1[0].id == node2[0].id
-
-                return False
-            return False
+        table = ConditionTable()
 
         for node in ast.walk(root):
-            conseqIf = False
-            
-            for child in ast.iter_child_nodes(node):
-                if isinstance(child, ast.If) and conseqIf is False:
-                    if len(child.orelse) == 0:  #checking if there are no elifs
-                        conseqIf = True
-                        firstIf = child
-                elif isinstance(child, ast.If) and conseqIf is True:
-                    if len(child.orelse) == 0:  #checking if there are no elifs
-                        secondIf = child
-
-                        if isinstance(firstIf.test, ast.Name) and isinstance(secondIf.test, ast.Name):
-                            if firstIf.test.id == secondIf.test.id:
-                                self.consecutiveEqualIfs = True
-
-                        if isinstance(firstIf.test, ast.Compare) and isinstance(secondIf.test, ast.Compare):
-                            L = compareLeft(firstIf.test.left, secondIf.test.left)
-                            O = compareOps(firstIf.test.ops, secondIf.test.ops)
-                            R = compareRight(firstIf.test.comparators, secondIf.test.comparators)
-
-                            if L and O and R: 
-                                self.consecutiveEqualIfs = True
-
-                    conseqIf = False
-                else:
-                    conseqIf = False
+            for field, value in ast.iter_fields(node):
+                if not isinstance(value, list):
+                    continue
+
+                run = None
+                for child in value:
+                    equalIfs, run = nextIfRun(table, run, child)
+                    if equalIfs:
+                        self.consecutiveEqualIfs = True
 
     def checkWhileCondInItsBody(self, root):
         """Designed as a counter for C1 - While condition tested again inside 
@@ -301,68 +235,20 @@ class VisitorMC3(ast.NodeVisitor):
            Checks the whole tree for a While loop that has its test condition
            tested again inside its block in order to break the loop. This means
            that the inside test is composed as the inverse of test used in the
-           While loop. Currently only works with comparisons of two variables
-           or one variable and one constant.
+           While loop, compared through their canonical keys (see
+           ConditionTable) e.g. "while i < n" and "if i >= n" or "while not
+           found" and "if found". Only If statements directly in the loop's
+           body are checked.
 
            Rationale: if the code has a While condition that has the inverse of
            its test tested again inside its block, it probably means the interior
            test is redundant and can be expressed in other ways.
         """
-        def compareLeft(node1, node2):
-            """Helper function that compares the left side of the While test and
-               the If test.
-            """
-            if isinstance(node1, ast.Name) and isinstance(node2, ast.Name):
-                return node1.id == node2.id
-
-            return False
-        
-        def compareOps(node1, node2):
-            """Helper function that compares the operation used in the While test 
-               and the If test.
-            """
-            invOp = {ast.Eq: ast.NotEq,
-                     ast.NotEq: ast.Eq,
-                     ast.Lt: ast.GtE,
-                     ast.LtE: ast.Gt,
-                     ast.Gt: ast.LtE,
-                     ast.GtE: ast.Lt,
-                     ast.In: ast.NotIn,
-                     ast.NotIn: ast.In,
-                     ast.Is: ast.IsNot,
-                     ast.IsNot: ast.Is}
-
-            if len(node1) == len(node2) == 1:
-                return invOp[type(node1[0])] == type(node2[0])
-
-            return False
-        
-        def compareRight(node1, node2):
-            """Helper function that compares the right side of the While test and
-               the If test.
-            """
-            if len(node1) == len(node2) == 1:
-                if isinstance(node1[0], ast.Constant) and isinstance(node2[0], ast.Constant):
-                    return node1[0].value == node2[0].value
-                
-                if isinstance(node1[0], ast.Name) and isinstance(node2[0], ast.Name):
-                    return node1[0].id == node2[0].id
-
-                return False
-            return False
+        table = ConditionTable()
 
         for node in ast.walk(root):
-            if isinstance(node, ast.While):
-                if isinstance(node.test, ast.Compare):
-                    for item in node.body:
-                        if isinstance(item, ast.If):
-                            if isinstance(item.test, ast.Compare):
-                                L = compareLeft(node.test.left, item.test.left)
-                                O = compareOps(node.test.ops, item.test.ops)
-                                R = compareRight(node.test.comparators, item.test.comparators)
-
-                                if L and O and R: 
-                                    self.whileCondInItsBody = True
+            if isinstance(node, ast.While) and oppositeIfs(table, node):
+                self.whileCondInItsBody = True
 
     def checkRedundantLoop(self, root):
         """Designed as a counter for C2 - Redundant or unnecessary loop.
@@ -375,39 +261,8 @@ class VisitorMC3(ast.NodeVisitor):
            no need for said loop. The While scenario can be possibly interpreted as
            B6 - Boolean comparison attempted with While loop.
         """
-        def checkWhile(root):
-            """Helper function that checks if a While loop has a loose break within 
-               its body.
-            """
-            for node in ast.walk(root):
-                if isinstance(node, ast.While):
-                    if isinstance(node.test, ast.Constant):
-                        if node.test.value is True:
-                            for item in node.body:
-                                if isinstance(item, ast.Break):
-                                    #print("While-True-Break", end="")
-                                    self.redundantLoop = True
-        
-        def checkFor(root):
-            """Helper function that checks if a For loop uses a range(1).
-            """
-            hasRange = hasConstant = False
-            for node in ast.walk(root):
-                if isinstance(node, ast.For):
-                    if isinstance(node.iter, ast.Call):
-                        if isinstance(node.iter.func, ast.Name) and node.iter.func.id == "range":
-                            hasRange = True
-                            if len(node.iter.args) == 1:
-                                if isinstance(node.iter.args[0], ast.Constant):
-                                    if node.iter.args[0].value == 1:
-                                        hasConstant = True
-
-            if hasRange is True and hasConstant is True:
-                #print("for-range(1)", end="")
-                self.redundantLoop = True
-        
-        checkWhile(root)
-        checkFor(root)
+        if self.ruleTable.findMatches(root, ['C2']):
+            self.redundantLoop = True
 
     def checkForWithConstant(self, root, constThreshold = 1):
         """Designed as a counter for C4 - Arbitrary number of for loop execution 
@@ -440,318 +295,74 @@ class VisitorMC3(ast.NodeVisitor):
            overwritten.
            
            Checks the whole tree if a for loop has its iteration variable reassigned
-           within its body. It recursively checks iteration variables used in inner
-           for loops.
+           within its body, including the iteration variables of every outer loop
+           and the ones unpacked from nested tuples/lists e.g. for (i, (j, k)) in (...).
+           prevIterVars holds iteration variables that are already active at root.
+           The tree is visited once, keeping the iteration variables of the loops
+           being visited on a stack, so the cost does not grow with nesting depth.
             
            Rationale: the redefinition of for iteration variables may lead to bugs
            that are difficult to debug. This function will flag out if this is 
            happening in the code.
         """
-        def getVarIter(node):
-            """Helper function that checks a the target field of a for loop and 
-            returns all its iteration variables. This will not work with nested
-            tuples as iteration variables e.g. for (i, (j, k)) in (...).
-            """
-            varIter = []
+        stack = [(root, frozenset(prevIterVars))]
 
-            if isinstance(node.target, ast.Name):
-                varIter.append(node.target.id)
+        while stack:
+            node, iterVars = stack.pop()
 
-            if isinstance(node.target, ast.Tuple) or isinstance(node.target, ast.List):
-                for item in node.target.elts:
-                    if isinstance(item, ast.Name):
-                        varIter.append(item.id)
-                
-            return varIter
-        
-        def getVarIterR(node, varIter):
-            """TO DO: IMPLEMENT A RECURSIVE METHOD THAT CHECKS NESTED TUPLE/LISTS"""
-            if isinstance(node, ast.For) and isinstance(node.target, ast.Name):
-                varIter.append(node.target.id)
-                return varIter
-            
-            if isinstance(node, ast.For) and (isinstance(node.target, ast.Tuple) or isinstance(node.target, ast.List)):
-                for item in node.target.elts:
-                    return getVarIterR(item, varIter)
-            
-            if isinstance(node, ast.Name):
-                varIter.append(node.id)
-                return varIter
-            
-            if isinstance(node.target, ast.Tuple) or isinstance(node.target, ast.List):
-                for item in node.elts:
-                    return getVarIterR(item, varIter)
-        
-        def checkAssigns(self, prevIterVars, varIter, item):
-            """Helper function that iterates over an Assign Node in a for loop body 
-               and checks if a iteration variable was overwritten.
-            """
-            for asg in item.targets:
-                if isinstance(asg, ast.Name): #direct assignments e.g. i = (...)
-                    for var in prevIterVars + varIter:
-                        if asg.id == var:
-                            self.forVariableOverwritten = True
-
-                if isinstance(asg, ast.Tuple): #unpacking e.g. i, j = (...)
-                    for name in asg.elts:
-                        if isinstance(name, ast.Subscript): #ignores Subscripts e.g. list[0] = (...)
-                            continue
-
-                        for var in prevIterVars + varIter:
-                            if name.id == var:
+            if len(iterVars) > 0:
+                if isinstance(node, ast.Assign):
+                    for asg in node.targets:
+                        for name in boundNames(asg):
+                            if name in iterVars:
                                 self.forVariableOverwritten = True
 
-        for node in ast.walk(root):
-            if isinstance(node, ast.For):
-
-                varIter = getVarIter(node)
-
-                for item in node.body:
-                    for stm in ast.walk(item):
-                        if isinstance(stm, ast.For): #checks nested for loops
-                            self.checkForOverwritten(stm, prevIterVars + varIter)
+                if isinstance(node, ast.AugAssign): #augmented assigns e.g. i += 1
+                    if isinstance(node.target, ast.Name) and node.target.id in iterVars:
+                        self.forVariableOverwritten = True
 
-                        if isinstance(stm, ast.Assign):
-                            checkAssigns(self, prevIterVars, varIter, stm)
-
-                        if isinstance(stm, ast.AugAssign): #augmented assigns e.g. i += 1
-                            if isinstance(stm.target, ast.Subscript): #ignores Subscripts e.g. list[0] = (...)
-                                continue
-
-                            for var in varIter:
-                                if stm.target.id == var:
-                                    self.forVariableOverwritten = True
+            if isinstance(node, ast.For):
+                bodyVars = iterVars.union(boundNames(node.target))
+                stack.extend((item, bodyVars) for item in node.body)
+                stack.extend((item, iterVars) for item in [node.target, node.iter] + node.orelse)
+            else:
+                stack.extend((child, iterVars) for child in ast.iter_child_nodes(node))
 
     def checkVarOutsideFuncScope(self, root):
         """Designed as a counter for D4 - Function accessing variables from outer 
            scope.
            
            Checks the whole tree if an user declared function uses variables that
-           are not present in the said function's scope.
-
-           Currently only works with:
-
-           - Function Calls:
-                + Simple variable names in called function arguments e.g. print(a)
-            - Assignments:
-                + Simple RHS name assignments e.g. (...) = a
-                + Simple variable names in RHS called function assignments 
-                  e.g (...) = round(a, 2)
-                + Simple Subscripts in LHS and RHS e.g. a[0] = (...), (...) = b[0][0] 
-            - AugAssignments:
-                + Simple LHS and RHS names in augmented assignments e.g. a += b
-            - Conditionals:
-                + Simple If statements that use a single Compare node e.g. if a == b
-                + Simple While statements that use a single Compare node e.g. while a >= b
-            - Loops:
-                + Simple For statements in which the Iter field is either an ast.Name or
-                  ast.Call e.g. for (...) in range(a):, for (...) in b:
-            
+           are not present in the said function's scope. Builds a SymbolTable in
+           a single traversal and resolves every name used in each function, in
+           any kind of expression (attributes, subscripts, slices, comprehensions,
+           lambdas, nested functions, f-strings, etc.). Flags a function that:
+
+           - uses a module-level variable that is neither a parameter nor a local
+             e.g. print(a), a.append(1), a[1:2], [x for x in a];
+           - declares a global e.g. global a;
+           - uses a variable of an enclosing function (a free variable);
+           - assigns a local variable with the name of a module-level variable.
+
+           Module-level functions, classes and imports are not variables, so
+           calling helper functions or modules is fine. Lambdas and
+           comprehensions are checked as part of the function they are in. In
+           project mode, the variables of the other modules of the submission
+           are module-level variables too, whether imported by name (from
+           config import total) or used through their module (config.total).
+           
            Rationale: if an user declared function uses variables that are not
            passed as arguments nor declared in its body, those variables are from
            outer scope and this should be avoided.
         """
-        def getGlobalVars(root):
-            globalVars = []
-            for node in ast.iter_child_nodes(root):
-                if not isinstance(node, ast.FunctionDef):
-                    for chd in ast.walk(node):
-                        if isinstance(chd, ast.Assign):
-                            for item in chd.targets:
-                                if isinstance(item, ast.Name) and item.id not in globalVars:
-                                    globalVars.append(item.id)
+        table = buildSymbolTable(root, self.imports)
 
-                                if isinstance(item, ast.Tuple):
-                                    for elem in item.elts:
-                                        if isinstance(elem, ast.Name) and elem.id not in globalVars:
-                                            globalVars.append(elem.id)
+        #Classes are not expected in the context of MC³
+        if table.hasClasses():
+            return
 
-            return globalVars
-
-        
-        def getLocalVars(funcNode, globalVars):
-            localVars = []
-
-            for arg in funcNode.args.args:
-                if arg.arg not in localVars:
-                    localVars.append(arg.arg)
-
-            for stm in funcNode.body:
-                if isinstance(stm, ast.Assign):
-                    for item in stm.targets:
-                        if isinstance(item, ast.Name) and item.id not in localVars:
-                            localVars.append(item.id)
-                            if item.id in globalVars:
-                                self.varOutsideFuncScope = True
-                        
-                        if isinstance(item, ast.Tuple):
-                            for elem in item.elts:
-                                if isinstance(elem, ast.Name) and elem.id not in localVars:
-                                    localVars.append(elem.id)
-                                    if elem.id in globalVars:
-                                        self.varOutsideFuncScope = True
-            
-            return localVars
-
-        def iterateSubscript(node, localVars, globalVars):
-
-            while not isinstance(node, ast.Name):
-
-                if isinstance(node, ast.Attribute):
-                    #Not covering Attributes of variables e.g. var.property
-                    break
-                
-                if isinstance(node, ast.ListComp):
-                    #Not covering List Comprehensions as Subscripts
-                    break
-
-                if isinstance(node, ast.Call):
-                    #Checks if the value of a Subscript is a Function Call e.g. foo(x)[0]
-                    for arg in node.args:
-                        if isinstance(arg, ast.Name):
-                            if arg.id in globalVars and arg.id not in localVars:
-                                self.varOutsideFuncScope = True
-                    break
-
-                if isinstance(node, ast.Tuple):
-                    #Checks if the value of a Subscript is a Tuple e.g. (a, b, c)[0]
-                    for item in node.elts:
-                        if isinstance(item, ast.Name):
-                            if item.id in globalVars and item.id not in localVars:
-                                self.varOutsideFuncScope = True
-                    break
-                            
-
-                if isinstance(node, ast.Subscript):
-                    #Checks simple indexes e.g. <var>[<var>] = (...)
-                    if isinstance(node.slice, ast.Index):
-                        if isinstance(node.slice.value, ast.Name):
-                            if node.slice.value.id in globalVars and node.slice.value.id not in localVars:
-                                self.varOutsideFuncScope = True
-
-                        node = node.value
-                    else: #Not covering Slice and ExtSlice e.g. a[1:2] or a[1:2, 3]
-                        break
-            
-            if isinstance(node, ast.Name):
-                if node.id in globalVars and node.id not in localVars:
-                    self.varOutsideFuncScope = True
-
-        def testFunctionCall(stm, localVars, globalVars):
-            if isinstance(stm, ast.Expr):
-                if isinstance(stm.value, ast.Call):
-
-                    #Attributes's values e.g. <var>.append((...))
-                    if isinstance(stm.value.func, ast.Attribute):
-                        if isinstance(stm.value.func.value, ast.Name):
-                            if stm.value.func.value.id in globalVars and stm.value.func.value.id not in localVars:
-                                self.varOutsideFuncScope = True
-
-                    #FunctionCall's arguments e.g. print(<var>), (...).append(<var>)
-                    for arg in stm.value.args:
-                        if isinstance(arg, ast.Name):
-                            if arg.id in globalVars and arg.id not in localVars:
-                                self.varOutsideFuncScope = True
-
-        
-        def testAssign(stm, localVars, globalVars):
-            if isinstance(stm, ast.Assign):
-
-                #Assign's LHS e.g. <var> = (...)
-                for item in stm.targets:
-
-                    if isinstance(item, ast.Subscript):
-                        iterateSubscript(item, localVars, globalVars)
-
-                    if isinstance(item, ast.Name):
-                        if item.id in globalVars and item.id not in localVars:
-                            self.varOutsideFuncScope = True
-                    
-                    if isinstance(item, ast.Tuple):
-                        for elem in item.elts:
-                            if isinstance(elem, ast.Name) and elem.id in globalVars and elem.id not in localVars:
-                                self.varOutsideFuncScope = True
-
-                #Assign's RHS e.g. (...) = <var>
-                if isinstance(stm.value, ast.Subscript):
-                    iterateSubscript(stm.value, localVars, globalVars)
-
-                if isinstance(stm.value, ast.Name):
-                    if stm.value.id in globalVars and stm.value.id not in localVars:
-                        self.varOutsideFuncScope = True
-                
-                if isinstance(stm.value, ast.Tuple):
-                    for elem in stm.value.elts:
-                        if isinstance(elem, ast.Name) and elem.id in globalVars and elem.id not in localVars:
-                            self.varOutsideFuncScope = True
-                
-                if isinstance(stm.value, ast.Call):
-                    for arg in stm.value.args:
-                        if isinstance(arg, ast.Name):
-                            if arg.id in globalVars and arg.id not in localVars:
-                                self.varOutsideFuncScope = True
-
-        def testAugAssign(stm, localVars, globalVars):
-            if isinstance(stm, ast.AugAssign):
-                if isinstance(stm.target, ast.Name):
-                    if stm.target.id in globalVars and stm.target.id not in localVars:
-                        self.varOutsideFuncScope = True
-
-                if isinstance(stm.value, ast.Name):
-                    if stm.value.id in globalVars and stm.value.id not in localVars:
-                        self.varOutsideFuncScope = True
-
-        def testConditionals(stm, localVars, globalVars):
-            if isinstance(stm, ast.If) or isinstance(stm, ast.While):
-                if isinstance(stm.test, ast.Compare):
-                    if isinstance(stm.test.left, ast.Name):
-                        if stm.test.left.id in globalVars and stm.test.left.id not in localVars:
-                            self.varOutsideFuncScope = True
-                    
-                    if isinstance(stm.test.left, ast.Subscript):
-                        iterateSubscript(stm.test.left, localVars, globalVars)
-                        
-                    for item in stm.test.comparators:
-                        if isinstance(item, ast.Name):
-                            if item.id in globalVars and item.id not in localVars:
-                                self.varOutsideFuncScope = True
-
-                        if isinstance(item, ast.Subscript):
-                            iterateSubscript(item, localVars, globalVars)
-        
-        def testFor(stm, localVars, globalVars):
-            if isinstance(stm, ast.For):
-                if isinstance(stm.iter, ast.Name):
-                    if stm.iter.id in globalVars and stm.iter.id not in localVars:
-                        self.varOutsideFuncScope = True
-
-                if isinstance(stm.iter, ast.Call):
-                    #FunctionCall's arguments e.g. print(<var>), (...).append(<var>)
-                    for arg in stm.iter.args:
-                        if isinstance(arg, ast.Name):
-                            if arg.id in globalVars and arg.id not in localVars:
-                                self.varOutsideFuncScope = True
-
-
-        for node in ast.walk(root):
-            #Classes are not expected in the context of MC³, this should avoid errors
-            if isinstance(node, ast.ClassDef):
-                return 
-
-        globalVars = getGlobalVars(root)
-
-        for node in ast.walk(root):
-            if isinstance(node, ast.FunctionDef):
-              
-                localVars = getLocalVars(node, globalVars)
-                
-                for item in node.body:
-                    for stm in ast.walk(item):
-                        testFunctionCall(stm, localVars, globalVars)
-                        testAssign(stm, localVars, globalVars)
-                        testAugAssign(stm, localVars, globalVars)
-                        testConditionals(stm, localVars, globalVars)
-                        testFor(stm, localVars, globalVars)
+        if len(table.outerScopeAccesses()) > 0:
+            self.varOutsideFuncScope = True
 
     def checkListOverusage(self, root, numListTheshold = 0):
         """Designed as a counter for E2 - Redundant or unnecessary use of lists.
@@ -930,13 +541,9 @@ class VisitorMC3(ast.NodeVisitor):
            if they ought to have any meaning.
         """
 
-        for node in ast.walk(root):
-            if isinstance(node, ast.Expr):
-                if isinstance(node.value, ast.Constant):
-
-                    #Ignores block comments parsed as empty string constants
-                    if not isinstance(node.value.value, str):
-                        self.noEffectStatement = True
+        #Ignores block comments parsed as string constants
+        if self.ruleTable.findMatches(root, ['H1']):
+            self.noEffectStatement = True
 
     def getA4(self, root):
         '''A4 - Redefinition of built-in.'''
@@ -1008,4 +615,533 @@ class VisitorMC3(ast.NodeVisitor):
     def getH1(self, root):
         '''H1 - Statement with no effect.'''
         self.checkNoEffectStatement(root)
-        return self.noEffectStatement
\ No newline at end of file
+        return self.noEffectStatement
+
+    def analyze(self, root, constThreshold = 1, numListsThreshold = 0,
+                varLenThreshold = 0, funcLenThreshold = 0, totalNamesThreshold = 100,
+                detectors = None, firstHit = False):
+        """Detects all MC³ in a single traversal of the tree.
+
+           Uses the ast.NodeVisitor machinery: each visit_* handler below feeds
+           every detector interested in that node type, so the tree is walked
+           once instead of once (or more) per getter. The rules of BUILTIN_RULES
+           and of the visitor's own rules are matched against every node on the
+           way, looked up by node type. Returns a dict mapping each code in
+           MC3_CODES to the value the matching getter would return (A4 keeps
+           its (flag, variables, functions, arguments) tuple), followed by
+           whether the codes of the visitor's own rules were found.
+
+           Unlike the getters, results do not accumulate across calls: each call
+           starts from a clean state. Starred/attribute targets and non-numeric
+           range() constants, which make some getters raise, are skipped.
+
+           detectors, if given, are the only codes that can be present (see
+           prefilter.relevantDetectors): the others are reported as absent
+           and the work done only for them, such as the scope analysis of D4,
+           is skipped.
+
+           With firstHit, each detector stops looking as soon as it fires, and
+           the traversal ends once every detector in detectors has fired, so
+           the verdicts are the same but A4 only reports the names found
+           until then. D4 and G4 need the whole tree and never end it early.
+        """
+        self.resetTraversal(detectors, firstHit, constThreshold, numListsThreshold)
+        try:
+            if len(self.pending) > 0:
+                self.visit(root)
+        except TraversalSettled:
+            pass
+
+        report = self.buildReport(root, constThreshold, numListsThreshold, varLenThreshold,
+                                  funcLenThreshold, totalNamesThreshold, detectors)
+        if detectors is not None:
+            for code in MC3_CODES + self.ruleCodes:
+                if code not in detectors:
+                    report[code] = (False, [], [], []) if code == 'A4' else False
+
+        return report
+
+    def findOccurrences(self, root, constThreshold = 1, numListsThreshold = 0,
+                        varLenThreshold = 0, funcLenThreshold = 0, totalNamesThreshold = 100,
+                        detectors = None):
+        """All-occurrences mode of analyze: returns a Finding for every place
+           where a detected MC³ occurs, sorted by line and column. Loops, ifs,
+           statements and assignments are reported where they start; D4 at
+           the functions touching outer variables, G4 at the first
+           declaration of each name that is too short, and E2 at every list
+           declared.
+        """
+        self.resetTraversal(detectors, constThreshold=constThreshold, findings=True)
+        self.visit(root)
+
+        report = self.buildReport(root, constThreshold, numListsThreshold, varLenThreshold,
+                                  funcLenThreshold, totalNamesThreshold, detectors)
+
+        if report['D4']:
+            functions = set(funcName for funcName, _, _ in self.symbols.outerScopeAccesses())
+            self.findings.extend(Finding('D4', scope.node.lineno, scope.node.col_offset)
+                                 for scope in self.symbols.scopes
+                                 if scope.kind == 'function' and scope.node.name in functions)
+
+        if report['G4']:
+            for names, nameThreshold in [(self.varNames, varLenThreshold),
+                                         (self.funcNames, funcLenThreshold)]:
+                if hasNonSignificantNames(names, {}, nameThreshold, 0, totalNamesThreshold):
+                    self.findings.extend(Finding('G4', node.lineno, node.col_offset)
+                                         for name, node in names.items()
+                                         if len(name) <= nameThreshold)
+
+        if report['G5']:
+            self.findings.extend(Finding('G5', node.lineno, node.col_offset)
+                                 for node in misplacedDeclarations(root))
+
+        detected = set(code for code in MC3_CODES + self.ruleCodes
+                       if (detectors is None or code in detectors) and
+                          (report[code][0] if code == 'A4' else report[code]))
+
+        codes = MC3_CODES + self.ruleCodes
+        return sorted(set(finding for finding in self.findings if finding.code in detected),
+                      key=lambda finding: (finding.line, finding.col,
+                                           codes.index(finding.code)))
+
+    def resetTraversal(self, detectors = None, firstHit = False, constThreshold = 1,
+                       numListsThreshold = 0, findings = False):
+        """Clears the state gathered by the visit_* handlers. pending holds the
+           detectors the handlers still look for; with firstHit, they retire
+           as they fire (see analyze), which needs the constants of C4 and E2.
+        """
+        self.depth = 0
+        self.order = 0      # nodes visited below the root, which orders the A4 entries
+
+        #G5 only looks at the root's children, after the traversal
+        self.pending = set(MC3_CODES + self.ruleCodes if detectors is None else detectors) - {'G5'}
+        self.firstHit = firstHit
+        self.constThreshold = constThreshold
+        self.numListsThreshold = numListsThreshold
+        self.findings = [] if findings else None
+
+        self.builtinVarEntries = []
+        self.builtinFuncEntries = []
+        self.builtinArgEntries = []
+
+        self.hits = set()
+
+        self.rangeConstants = []
+        self.iterVars = []
+        self.iterVarsMarks = []
+
+        self.symbols = SymbolTable(imports=self.imports) \
+                       if detectors is None or 'D4' in detectors else NullSymbolTable()
+
+        self.numLists = 0
+        self.varNames = {}
+        self.funcNames = {}
+
+        self.conditions = ConditionTable()
+        self.elifs = set()
+
+    def buildReport(self, root, constThreshold, numListsThreshold, varLenThreshold,
+                    funcLenThreshold, totalNamesThreshold, detectors = None):
+        """Turns the state gathered during the traversal into the final report.
+        """
+        verdicts = self.fixedVerdicts(root, detectors)
+        verdicts.update(self.thresholdVerdicts(constThreshold, numListsThreshold, varLenThreshold,
+                                               funcLenThreshold, totalNamesThreshold))
+
+        return {code: verdicts[code] for code in MC3_CODES + self.ruleCodes}
+
+    def fixedVerdicts(self, root, detectors = None):
+        """The verdicts that do not depend on the instructor's constants, i.e.
+           all but C4, E2 and G4.
+        """
+        def orderedNames(entries):
+            """ast.walk is breadth-first, which is the same as sorting the depth-first
+               visit by (depth, visit order). Keeps the first occurrence of each name.
+            """
+            names = []
+            for _, name in sorted(entries, key=lambda entry: entry[0]):
+                if name not in names:
+                    names.append(name)
+
+            return names
+
+        varsAsBuiltin = orderedNames(self.builtinVarEntries)
+        funcsAsBuiltin = orderedNames(self.builtinFuncEntries)
+        argsAsBuiltin = orderedNames(self.builtinArgEntries)
+        builtinRedefinition = len(varsAsBuiltin) + len(funcsAsBuiltin) + len(argsAsBuiltin) > 0
+
+        varOutsideFuncScope = not self.symbols.hasClasses() and \
+                              len(self.symbols.outerScopeAccesses()) > 0
+
+        return {'A4': (builtinRedefinition, varsAsBuiltin, funcsAsBuiltin, argsAsBuiltin),
+                'B6': 'B6' in self.hits,
+                'B8': 'B8' in self.hits,
+                'B9': 'B9' in self.hits,
+                'B12': 'B12' in self.hits,
+                'C1': 'C1' in self.hits,
+                'C2': 'C2' in self.hits,
+                'C8': 'C8' in self.hits,
+                'D4': varOutsideFuncScope,
+                'G5': (detectors is None or 'G5' in detectors) and \
+                      self.hasArbitraryDeclarations(root),
+                'H1': 'H1' in self.hits,
+                **{code: code in self.hits for code in self.ruleCodes}}
+
+    def thresholdVerdicts(self, constThreshold = 1, numListsThreshold = 0, varLenThreshold = 0,
+                          funcLenThreshold = 0, totalNamesThreshold = 100):
+        """The verdicts of C4, E2 and G4 for the given constants. Cheap: they
+           only compare the numbers gathered during the traversal.
+        """
+        forWithConstant = False
+        for value in self.rangeConstants:
+            if value >= constThreshold:
+                forWithConstant = True
+
+        listOverusage = self.numLists > 0 and self.numLists >= numListsThreshold
+
+        nonSignificantNames = self.hasNonSignificantNames(varLenThreshold, funcLenThreshold,
+                                                          totalNamesThreshold)
+
+        return {'C4': forWithConstant, 'E2': listOverusage, 'G4': nonSignificantNames}
+
+    def hasNonSignificantNames(self, varLenThreshold, funcLenThreshold, totalNamesThreshold):
+        """G4 from the names gathered during the traversal.
+        """
+        return hasNonSignificantNames(self.varNames, self.funcNames, varLenThreshold,
+                                      funcLenThreshold, totalNamesThreshold)
+
+    def hasArbitraryDeclarations(self, root):
+        """G5 only looks at the direct children of the root, so no walk is needed.
+        """
+        return len(misplacedDeclarations(root)) > 0
+
+    def fire(self, code, node, settles = True):
+        """Records that code occurs at node. With firstHit, the detector retires
+           (if settles, i.e. this occurrence decides its verdict), and the
+           traversal ends when none is left.
+        """
+        self.hits.add(code)
+
+        if self.findings is not None:
+            self.findings.append(Finding(code, node.lineno, node.col_offset))
+
+        elif self.firstHit and settles:
+            self.pending.discard(code)
+            if len(self.pending) == 0:
+                raise TraversalSettled()
+
+    def visitChildren(self, node, enterBody = None, exitBody = None):
+        """Visits the children of a node in ast.iter_child_nodes order.
+
+           Checks the runs of consecutive If statements of each block on the
+           way (B12) and lets the caller run enterBody/exitBody around the
+           "body" field, which is how loop and function scopes are tracked.
+        """
+        self.depth += 1
+
+        for field, value in ast.iter_fields(node):
+            if field == 'body' and enterBody is not None:
+                enterBody()
+
+            run = None
+            for child in (value if isinstance(value, list) else (value,)):
+                if not isinstance(child, ast.AST):
+                    continue
+
+                if 'B12' in self.pending:
+                    run = self.detectEqualIfs(child, run)
+
+                self.matchRules(child)
+
+                self.order += 1
+                self.visit(child)
+
+            if field == 'body' and exitBody is not None:
+                exitBody()
+
+        self.depth -= 1
+
+    def detectEqualIfs(self, node, run):
+        """B12: extends the run of consecutive If statements of a block with
+           node, its next child. Returns the new run.
+        """
+        equalIfs, run = nextIfRun(self.conditions, run, node)
+        if equalIfs:
+            self.fire('B12', node)
+
+        return run
+
+    def matchRules(self, node):
+        """Fires the codes of the rules matching a node, which the caller is
+           about to visit.
+        """
+        for code, pattern in self.ruleTable.dispatch.get(type(node), ()):
+            if code in self.pending and pattern.match(node):
+                self.fire(code, node)
+
+    def generic_visit(self, node):
+        self.visitChildren(node)
+
+    def visit_Assign(self, node):
+        targetNames = []
+
+        for tgt in node.targets:
+            if isinstance(tgt, ast.Name):
+                targetNames.append(tgt.id)
+
+            if isinstance(tgt, ast.Tuple):
+                for item in tgt.elts:
+                    if isinstance(item, ast.Name):
+                        targetNames.append(item.id)
+
+        if 'A4' in self.pending:
+            self.detectBuiltinNames(node, targetNames)
+
+        for name in targetNames:
+            self.varNames.setdefault(name, node)
+
+        if len(self.iterVars) > 0 and 'C8' in self.pending:
+            self.detectIterVarAssigned(node, node.targets)
+
+        if 'E2' in self.pending:
+            self.detectListDeclaration(node)
+
+        self.visitChildren(node)
+
+    def detectBuiltinNames(self, node, names):
+        """A4: the variables of an assignment named after a builtin.
+        """
+        key = (self.depth, self.order)
+
+        for name in names:
+            if name in LIST_OF_BUILTINS:
+                self.builtinVarEntries.append((key, name))
+                self.fire('A4', node)
+
+    def detectIterVarAssigned(self, node, targets):
+        """C8: an assignment to the variable of a for loop inside its body.
+        """
+        for tgt in targets:
+            for name in boundNames(tgt):
+                if name in self.iterVars:
+                    self.fire('C8', node)
+
+    def detectListDeclaration(self, node):
+        """E2: counts the lists declared, which settles E2 once there are
+           as many as the threshold.
+        """
+        if isinstance(node.value, (ast.List, ast.ListComp)):
+            self.numLists += 1
+            self.fire('E2', node, self.numLists >= max(self.numListsThreshold, 1))
+
+    def visit_AugAssign(self, node):
+        if len(self.iterVars) > 0 and 'C8' in self.pending:
+            self.detectIterVarAssigned(node, [node.target])
+
+        self.symbols.record(node)
+        self.visitChildren(node)
+
+    def visit_FunctionDef(self, node):
+        if 'A4' in self.pending:
+            self.detectBuiltinDefinition(node)
+
+        self.funcNames.setdefault(node.name, node)
+
+        self.visitScope(node)
+
+    def detectBuiltinDefinition(self, node):
+        """A4: a function or one of its arguments named after a builtin.
+        """
+        key = (self.depth, self.order)
+
+        if node.name in LIST_OF_BUILTINS:
+            self.builtinFuncEntries.append((key, node.name))
+            self.fire('A4', node)
+
+        for arguments in ast.iter_child_nodes(node):
+            for arg in ast.iter_child_nodes(arguments):
+                if isinstance(arg, ast.arg) and arg.arg in LIST_OF_BUILTINS:
+                    self.builtinArgEntries.append((key, arg.arg))
+                    self.fire('A4', arg)
+
+    def visitImport(self, node):
+        """Project mode: the names imported from the other modules of the
+           submission, for A4 and D4.
+        """
+        if self.imports is not None:
+            if 'A4' in self.pending:
+                self.detectBuiltinImports(node)
+
+            self.symbols.record(node)
+
+        self.visitChildren(node)
+
+    def detectBuiltinImports(self, node):
+        """A4: the variables and functions named after a builtin that an
+           import brings from the other modules of the submission.
+        """
+        key = (self.depth, self.order)
+        entries = {'variable': self.builtinVarEntries, 'function': self.builtinFuncEntries}
+
+        for imported in self.imports.get(node, ()):
+            if imported.kind in entries and imported.name in LIST_OF_BUILTINS:
+                entries[imported.kind].append((key, imported.name))
+                self.fire('A4', node)
+
+    visit_Import = visit_ImportFrom = visitImport
+
+    def visit_Attribute(self, node):
+        #Project mode: module.variable of an imported module (D4)
+        if self.imports:
+            self.symbols.record(node)
+
+        self.visitChildren(node)
+
+    def visit_AsyncFunctionDef(self, node):
+        self.visitScope(node)
+
+    def visit_Lambda(self, node):
+        self.visitScope(node)
+
+    def visit_ClassDef(self, node):
+        self.visitScope(node)
+
+    def visitScope(self, node):
+        """Visits a function, lambda or class with its body inside its own scope
+           in the symbol table (D4).
+        """
+        self.symbols.record(node)
+        self.visitChildren(node, lambda: self.symbols.enterScope(node), self.symbols.exitScope)
+
+    def visitComprehension(self, node):
+        self.depth += 1
+        outer, inner = scopedBody(node)
+
+        #scopedBody skips the first generator, whose parts are split in two
+        self.matchRules(node.generators[0])
+        for child in outer:
+            self.matchRules(child)
+            self.order += 1
+            self.visit(child)
+
+        self.symbols.enterScope(node)
+        for child in inner:
+            self.matchRules(child)
+            self.order += 1
+            self.visit(child)
+        self.symbols.exitScope()
+
+        self.depth -= 1
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = visitComprehension
+
+    def visit_Name(self, node):
+        self.symbols.record(node)
+
+    def recordAndVisit(self, node):
+        self.symbols.record(node)
+        self.visitChildren(node)
+
+    visit_NamedExpr = visit_Global = visit_Nonlocal = visit_alias = recordAndVisit
+    visit_ExceptHandler = visit_MatchAs = visit_MatchStar = visit_MatchMapping = recordAndVisit
+
+    def visit_For(self, node):
+        if 'C4' in self.pending:
+            self.detectRangeConstant(node)
+
+        #C8: the iteration variables are active while the body is visited
+        varIter = boundNames(node.target)
+
+        def enterBody():
+            self.iterVarsMarks.append(len(self.iterVars))
+            self.iterVars.extend(varIter)
+
+        def exitBody():
+            del self.iterVars[self.iterVarsMarks.pop():]
+
+        self.visitChildren(node, enterBody, exitBody)
+
+    def detectRangeConstant(self, node):
+        """C4: the constant of a for loop over range(constant).
+        """
+        if isinstance(node.iter, ast.Call):
+            if isinstance(node.iter.func, ast.Name) and node.iter.func.id == "range":
+                if len(node.iter.args) == 1 and isinstance(node.iter.args[0], ast.Constant):
+                    value = node.iter.args[0].value
+
+                    if isinstance(value, (int, float)):
+                        self.rangeConstants.append(value)
+                        if value >= self.constThreshold:
+                            self.fire('C4', node)
+
+    def visit_While(self, node):
+        if 'C1' in self.pending:
+            self.detectWhileOpposites(node)
+
+        self.visitChildren(node)
+
+    def detectWhileOpposites(self, node):
+        """C1: the ifs of a while body testing the opposite of its condition.
+        """
+        for item in oppositeIfs(self.conditions, node):
+            self.fire('C1', item)
+
+    def visit_If(self, node):
+        #An elif chain is checked as a whole from its first If
+        if 'B9' in self.pending and node not in self.elifs:
+            self.detectElifRetests(node)
+
+        self.visitChildren(node)
+
+    def detectElifRetests(self, node):
+        """B9: the branches of the elif chain starting at node that retest
+           the condition of an earlier one.
+        """
+        chain = elifChain(node)
+        self.elifs.update(chain[1:])
+
+        for chd in chainRetests(self.conditions, chain):
+            self.fire('B9', chd)
+
+
+def misplacedDeclarations(root):
+    """G5: the statements among the first N children of the root (leaving
+       docstrings out) that are not function definitions, N being the number
+       of functions defined at module level.
+    """
+    children = [node for node in ast.iter_child_nodes(root)
+                if not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+                        and isinstance(node.value.value, str))]
+    numFunc = sum(1 for node in children if isinstance(node, ast.FunctionDef))
+
+    return [node for node in children[:numFunc] if not isinstance(node, ast.FunctionDef)]
+
+def boundNames(target):
+    """Names bound by an assignment or for loop target, including the ones in
+       nested tuples/lists and starred items e.g. (i, (j, *k)). Subscripts and
+       attributes e.g. list[0] or obj.attr bind no name.
+    """
+    if isinstance(target, ast.Name):
+        return [target.id]
+
+    if isinstance(target, ast.Starred):
+        return boundNames(target.value)
+
+    if isinstance(target, (ast.Tuple, ast.List)):
+        return [name for item in target.elts for name in boundNames(item)]
+
+    return []
+
+def hasNonSignificantNames(varNames, funcNames, varLenThreshold, funcLenThreshold,
+                           totalNamesThreshold):
+    """G4 verdict from the distinct names of declared variables and functions.
+    """
+    def nonSignificant(names, nameThreshold):
+        if len(names) == 0:
+            return False
+
+        totalNonSignificant = sum(1 for name in names if len(name) <= nameThreshold)
+        return totalNonSignificant >= len(names)*totalNamesThreshold/100
+
+    return nonSignificant(varNames, varLenThreshold) or \
+           nonSignificant(funcNames, funcLenThreshold)
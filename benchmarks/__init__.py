@@ -0,0 +1,3 @@
+"""Performance benchmarks for MC4. Run them from the repository root, e.g.
+   python -m benchmarks.scaling
+"""
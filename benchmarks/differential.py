@@ -0,0 +1,432 @@
+"""Differential harness between the legacy getters and a newer engine.
+
+    python -m benchmarks.differential [files, directories or globs]
+    python -m benchmarks.differential submissions/ --engine incremental --generated 10
+
+Runs every VisitorMC3.getXX getter (each on a fresh VisitorMC3, as a
+caller wanting a single MC³ would do) and an engine side by side over a
+corpus: the given files (the testCode*.py files by default) plus
+--generated synthetic programs of each shape (see benchmarks.programs).
+For each detector it reports the files where the engine's verdict differs
+from the getter's, both when the engine looks for every MC³ and when it
+looks for that one alone, and the time taken by the getter and by the
+engine for that detector alone over the whole corpus. Each disagreement
+comes with a reproducer: the file, reduced by deleting statements and
+unwrapping compound statements for as long as the getter and the engine
+still disagree on it.
+
+The engines are:
+
+    fused        VisitorMC3.analyze, the single-pass engine
+    firstHit     VisitorMC3.analyze with firstHit (A4 names not compared)
+    occurrences  VisitorMC3.findOccurrences (verdicts only)
+    incremental  IncrementalAnalyzer, cold (times the whole analysis only)
+    flat         the vectorized detectors of FlatAST.py (requires NumPy)
+
+Besides MC3_CODES, the engines that take rules (all but incremental and
+flat) are compared on the codes of RULES, which are not built into
+VisitorMC3 and mostly match inside comprehensions, with
+RuleTable.findMatches standing for their getter.
+
+Files a getter raises on are counted apart, not as disagreements. The
+exit status is 1 if there is any disagreement.
+"""
+import argparse
+import ast
+import json
+import sys
+import time
+
+from IncrementalAnalyzer import IncrementalAnalyzer
+from PatternRules import Rule, compileRules
+from VisitorMC3 import MC3_CODES, VisitorMC3
+from mc4 import addThresholdArguments, expandInputs, thresholdsFromArgs
+from benchmarks.programs import SHAPES, generatePrograms
+
+#Rules outside BUILTIN_RULES: calls and comparisons as found in the elements,
+#iterables and conditions of comprehensions (see benchmarks.programs)
+RULES = (Rule('X1', "Call(func=Name(id='sorted' | 'round' | 'eval'))"),
+         Rule('X2', "Compare(left=Call)"))
+
+RULE_CODES = [rule.code for rule in RULES]
+
+def legacyVerdict(tree, code, thresholds):
+    """What VisitorMC3.getXX returns for a tree, on a fresh visitor, or for
+       the codes of RULES, whether RuleTable.findMatches finds them.
+    """
+    if code in RULE_CODES:
+        return len(compileRules(RULES).findMatches(tree, [code])) > 0
+
+    constThreshold, numListsThreshold, varLenThreshold, funcLenThreshold, \
+        totalNamesThreshold = thresholds
+    visitor = VisitorMC3()
+
+    if code == 'C4':
+        return visitor.getC4(tree, constThreshold)
+    if code == 'E2':
+        return visitor.getE2(tree, numListsThreshold)
+    if code == 'G4':
+        return visitor.getG4(tree, varLenThreshold, funcLenThreshold, totalNamesThreshold)
+
+    return getattr(visitor, f"get{code}")(tree)
+
+class Submission:
+    """A source of the corpus, parsed once.
+    """
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+        self.tree = ast.parse(source)
+
+class FusedEngine:
+    """An engine returns, for each submission, a dict from code to verdict
+       shaped like the ones of VisitorMC3.analyze, or None if it failed on
+       that submission. With detectors, it only has to look for those.
+    """
+    name = 'fused'
+    codes = MC3_CODES + RULE_CODES
+    comparesNames = True    # whether the engine reports the names found by A4
+    restricts = True        # whether the engine can look for some detectors only
+
+    def __init__(self, thresholds):
+        self.thresholds = thresholds
+
+    def verdicts(self, submission, detectors):
+        return VisitorMC3(RULES).analyze(submission.tree, *self.thresholds, detectors=detectors)
+
+    def run(self, submissions, detectors = None):
+        results = []
+        for submission in submissions:
+            try:
+                results.append(self.verdicts(submission, detectors))
+            except Exception:
+                results.append(None)
+        return results
+
+class FirstHitEngine(FusedEngine):
+    name = 'firstHit'
+    comparesNames = False
+
+    def verdicts(self, submission, detectors):
+        return VisitorMC3(RULES).analyze(submission.tree, *self.thresholds,
+                                         detectors=detectors, firstHit=True)
+
+class OccurrencesEngine(FusedEngine):
+    name = 'occurrences'
+    comparesNames = False
+
+    def verdicts(self, submission, detectors):
+        found = set(finding.code for finding in
+                    VisitorMC3(RULES).findOccurrences(submission.tree, *self.thresholds,
+                                                      detectors=detectors))
+        return {code: code in found for code in detectors or self.codes}
+
+class IncrementalEngine(FusedEngine):
+    """Analyzes every submission with its own IncrementalAnalyzer, so nothing
+       is reused between submissions.
+    """
+    name = 'incremental'
+    codes = MC3_CODES
+    restricts = False
+
+    def verdicts(self, submission, detectors):
+        report = IncrementalAnalyzer(*self.thresholds).analyzeSource(submission.source)
+        verdicts = {code: getattr(report, code) for code in MC3_CODES}
+        verdicts['A4'] = (report.A4, list(report.builtinVariables),
+                          list(report.builtinFunctions), list(report.builtinArguments))
+        return verdicts
+
+class FlatEngine:
+    """Flattens all the submissions into one FlatAST, then runs each
+       vectorized detector over all of them at once.
+    """
+    name = 'flat'
+    codes = ['B6', 'C2', 'C4', 'E2', 'H1']
+    comparesNames = False
+    restricts = True
+
+    def __init__(self, thresholds):
+        import FlatAST
+
+        constThreshold, numListsThreshold = thresholds[:2]
+        self.fromTrees = FlatAST.FlatAST.fromTrees
+        self.detectors = {'B6': FlatAST.detectB6,
+                          'C2': FlatAST.detectC2,
+                          'C4': lambda flat: FlatAST.detectC4(flat, constThreshold),
+                          'E2': lambda flat: FlatAST.detectE2(flat, numListsThreshold),
+                          'H1': FlatAST.detectH1}
+
+    def run(self, submissions, detectors = None):
+        flat = self.fromTrees([submission.tree for submission in submissions])
+        columns = {code: self.detectors[code](flat) for code in detectors or self.codes}
+        return [{code: bool(column[index]) for code, column in columns.items()}
+                for index in range(len(submissions))]
+
+ENGINES = {engine.name: engine for engine in [FusedEngine, FirstHitEngine, OccurrencesEngine,
+                                              IncrementalEngine, FlatEngine]}
+
+def sameVerdict(legacy, verdict, comparesNames):
+    """Compares a getter's result with an engine's, quirks included. For A4,
+       the names are compared too if the engine reports them.
+    """
+    if not isinstance(legacy, tuple):
+        return legacy == verdict
+
+    if not isinstance(verdict, tuple):
+        return legacy[0] == verdict
+    if not comparesNames:
+        return legacy[0] == verdict[0]
+
+    return legacy[0] == verdict[0] and \
+           [list(names) for names in legacy[1:]] == [list(names) for names in verdict[1:]]
+
+def disagrees(engine, code, thresholds, source, detectors = None):
+    """Whether the getter of code and the engine disagree on a source. Sources
+       that do not parse, or that the getter or the engine fail on, do not.
+    """
+    try:
+        submission = Submission('reproducer', source)
+        legacy = legacyVerdict(submission.tree, code, thresholds)
+    except Exception:
+        return False
+
+    verdicts = engine.run([submission], detectors)[0]
+    return verdicts is not None and not sameVerdict(legacy, verdicts[code],
+                                                    engine.comparesNames)
+
+def statementLists(node):
+    """Every non-empty list of statements in a tree, outermost first.
+    """
+    for field, value in ast.iter_fields(node):
+        if isinstance(value, list):
+            if value and isinstance(value[0], ast.stmt):
+                yield value
+            for item in value:
+                if isinstance(item, ast.AST):
+                    yield from statementLists(item)
+        elif isinstance(value, ast.AST):
+            yield from statementLists(value)
+
+def tryEdit(tree, statements, start, end, replacement, stillFails):
+    """Replaces statements[start:end] in the tree (by a pass if that would
+       empty the block) and keeps the change if stillFails holds for the
+       resulting source; otherwise undoes it.
+    """
+    removed = statements[start:end]
+    if not replacement and end - start == len(statements):
+        if len(statements) == 1 and isinstance(statements[0], ast.Pass):
+            return False
+        replacement = [ast.Pass()]
+
+    statements[start:end] = replacement
+    if stillFails(ast.unparse(tree)):
+        return True
+
+    statements[start:start + len(replacement)] = removed
+    return False
+
+def reduceOnce(tree, stillFails, budget):
+    """Applies the first accepted edit: deleting a chunk of a statement list
+       (the whole list, then halves, quarters... down to single statements),
+       or replacing a compound statement by its body. Returns whether an
+       edit was accepted, and the number of candidates tried.
+    """
+    tries = 0
+    for statements in list(statementLists(tree)):
+        size = len(statements)
+        while size >= 1:
+            for start in range(0, len(statements), size):
+                if tries >= budget:
+                    return False, tries
+                tries += 1
+                if tryEdit(tree, statements, start, start + size, [], stillFails):
+                    return True, tries
+            size //= 2
+
+        for index, statement in enumerate(statements):
+            body = getattr(statement, 'body', None)
+            if isinstance(body, list) and body and isinstance(body[0], ast.stmt):
+                if tries >= budget:
+                    return False, tries
+                tries += 1
+                if tryEdit(tree, statements, index, index + 1, list(body), stillFails):
+                    return True, tries
+
+    return False, tries
+
+def minimize(source, stillFails, maxTries = 500):
+    """Reduces a source for as long as stillFails(reduced source) holds, trying
+       at most maxTries candidates. Returns the reduced source, unparsed.
+    """
+    tree = ast.parse(source)
+    while maxTries > 0:
+        reduced, tries = reduceOnce(tree, stillFails, maxTries)
+        maxTries -= tries
+        if not reduced:
+            break
+
+    return ast.unparse(tree)
+
+def readCorpus(inputs, generated, seed):
+    """Submissions of the files given and of generated programs, and the
+       (name, error) of the files that could not be read or parsed.
+    """
+    submissions, skipped = [], []
+
+    for path in expandInputs(inputs):
+        try:
+            with open(path, 'rb') as file:
+                submissions.append(Submission(path, file.read().decode('utf-8')))
+        except (OSError, UnicodeDecodeError, SyntaxError, ValueError, RecursionError,
+                MemoryError) as e:
+            skipped.append((path, f"{type(e).__name__}: {e}"))
+
+    for shape in SHAPES:
+        for index, source in enumerate(generatePrograms(shape, generated, seed)):
+            submissions.append(Submission(f"<{shape} {index}>", source))
+
+    return submissions, skipped
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+def runLegacy(submissions, code, thresholds):
+    """Verdicts of the getter of code for every submission (None where it
+       raised), and the time it took.
+    """
+    def run():
+        verdicts = []
+        for submission in submissions:
+            try:
+                verdicts.append(legacyVerdict(submission.tree, code, thresholds))
+            except Exception:
+                verdicts.append(None)
+        return verdicts
+
+    return timed(run)
+
+def compareEngine(engine, submissions, thresholds, maxReproducers, maxTries):
+    """Runs the getters and the engine over the corpus and returns the
+       results of the comparison, as saved by --json.
+    """
+    fullVerdicts, fullSeconds = timed(lambda: engine.run(submissions))
+
+    detectors = {}
+    for code in engine.codes:
+        legacy, legacySeconds = runLegacy(submissions, code, thresholds)
+
+        restricted, engineSeconds = None, None
+        if engine.restricts:
+            restricted, engineSeconds = timed(lambda: engine.run(submissions, [code]))
+
+        disagreements = []
+        for index, (submission, expected) in enumerate(zip(submissions, legacy)):
+            if expected is None:
+                continue
+
+            modes = [(None, fullVerdicts[index])]
+            if restricted is not None:
+                modes.append(([code], restricted[index]))
+
+            for mode, verdicts in modes:
+                if verdicts is not None and \
+                   not sameVerdict(expected, verdicts[code], engine.comparesNames):
+                    disagreements.append({'name': submission.name,
+                                          'detectors': mode,
+                                          'legacy': expected,
+                                          'engine': verdicts[code]})
+                    break
+
+        for disagreement in disagreements[:maxReproducers]:
+            source = next(submission.source for submission in submissions
+                          if submission.name == disagreement['name'])
+            mode = disagreement['detectors']
+            disagreement['reproducer'] = minimize(
+                source, lambda candidate: disagrees(engine, code, thresholds, candidate, mode),
+                maxTries)
+
+        detectors[code] = {'legacyErrors': legacy.count(None),
+                           'engineErrors': sum(verdicts is None for verdicts in fullVerdicts),
+                           'disagreements': disagreements,
+                           'legacySeconds': legacySeconds,
+                           'engineSeconds': engineSeconds}
+
+    return {'engine': engine.name,
+            'files': len(submissions),
+            'thresholds': list(thresholds),
+            'detectors': detectors,
+            'legacySeconds': sum(result['legacySeconds'] for result in detectors.values()),
+            'engineSeconds': fullSeconds}
+
+def speedup(legacySeconds, engineSeconds):
+    if engineSeconds is None:
+        return f"{'-':>8}"
+    return f"{legacySeconds/max(engineSeconds, 1e-9):>7.1f}x"
+
+def reportLines(results):
+    lines = [f"{results['engine']} against the getters on {results['files']} files",
+             f"  {'code':<5} {'disagree':>8} {'errors':>7} {'getter ms':>10} "
+             f"{'engine ms':>10} {'speedup':>8}"]
+
+    for code, result in results['detectors'].items():
+        engineMs = '-' if result['engineSeconds'] is None else \
+                   f"{result['engineSeconds']*1000:.2f}"
+        lines.append(f"  {code:<5} {len(result['disagreements']):>8} "
+                     f"{result['legacyErrors']:>7} {result['legacySeconds']*1000:>10.2f} "
+                     f"{engineMs:>10} {speedup(result['legacySeconds'], result['engineSeconds'])}")
+
+    lines.append(f"  {'all':<5} {'':>8} {'':>7} {results['legacySeconds']*1000:>10.2f} "
+                 f"{results['engineSeconds']*1000:>10.2f} "
+                 f"{speedup(results['legacySeconds'], results['engineSeconds'])}")
+
+    for code, result in results['detectors'].items():
+        for disagreement in result['disagreements']:
+            mode = 'alone' if disagreement['detectors'] else 'with all detectors'
+            lines += ['', f"{code} on {disagreement['name']} ({mode}): getter "
+                          f"{disagreement['legacy']!r}, engine {disagreement['engine']!r}"]
+            if 'reproducer' in disagreement:
+                lines += ['    ' + line for line in disagreement['reproducer'].splitlines()]
+
+    return lines
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Compares the legacy getters with an MC4 '
+                                                 'engine over a corpus.')
+    parser.add_argument('inputs', nargs='*', default=['testCode*.py'],
+                        help='files, directories or glob patterns (default: testCode*.py)')
+    parser.add_argument('--engine', choices=list(ENGINES), default='fused')
+    parser.add_argument('--generated', type=int, default=0, metavar='N',
+                        help='also compare on N generated programs per shape (default: 0)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-reproducers', type=int, default=3, metavar='N',
+                        help='disagreements minimized per detector (default: 3)')
+    parser.add_argument('--max-tries', type=int, default=500, metavar='N',
+                        help='candidates tried when minimizing a reproducer (default: 500)')
+    parser.add_argument('--json', metavar='FILE', help='write the results to FILE as JSON')
+    addThresholdArguments(parser)
+    args = parser.parse_args(argv)
+
+    thresholds = thresholdsFromArgs(args)
+    submissions, skipped = readCorpus(args.inputs, args.generated, args.seed)
+    if len(submissions) == 0:
+        parser.error('no files to compare on')
+
+    results = compareEngine(ENGINES[args.engine](thresholds), submissions, thresholds,
+                            args.max_reproducers, args.max_tries)
+    results['skipped'] = skipped
+
+    for line in reportLines(results):
+        print(line)
+    for name, error in skipped:
+        print(f"skipped {name}: {error}", file=sys.stderr)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    return int(any(result['disagreements'] for result in results['detectors'].values()))
+
+if __name__ == '__main__':
+    sys.exit(main())
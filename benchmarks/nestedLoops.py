@@ -0,0 +1,62 @@
+"""Stress benchmark for C8 on deeply nested for loops.
+
+    python -m benchmarks.nestedLoops [--max-depth 10] [--branching 2]
+
+Generates programs where every loop body has a few assignments and
+`branching` inner loops, down to each depth, and times getC8 and the
+single-pass analyze() on them. Both should grow linearly with the size
+of the tree, not with the nesting depth.
+"""
+import argparse
+import ast
+import time
+
+from VisitorMC3 import VisitorMC3
+
+def nestedLoopsSource(depth, branching = 2, statements = 3):
+    """Source code of depth nested for loops with branching inner loops per
+       level. Iteration variables are only read, so C8 is never triggered and
+       the whole tree has to be searched.
+    """
+    lines = []
+
+    def emit(level, indent):
+        pad = '    '*indent
+        lines.append(f"{pad}for i{level}, (j{level}, k{level}) in enumerate(data{level}):")
+        for number in range(statements):
+            lines.append(f"{pad}    total{number} = i{level} + j{level} * k{level}")
+        lines.append(f"{pad}    count{level} += total0")
+
+        if level + 1 < depth:
+            for _ in range(branching):
+                emit(level + 1, indent + 1)
+
+    emit(0, 0)
+    return '\n'.join(lines) + '\n'
+
+def timeCall(function, repeat = 3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-depth', type=int, default=10)
+    parser.add_argument('--branching', type=int, default=2)
+    args = parser.parse_args(argv)
+
+    print(f"{'depth':>5} {'nodes':>8} {'getC8 ms':>9} {'analyze ms':>11} {'getC8 us/node':>14}")
+    for depth in range(1, args.max_depth + 1):
+        tree = ast.parse(nestedLoopsSource(depth, args.branching))
+        nodes = sum(1 for _ in ast.walk(tree))
+
+        c8 = timeCall(lambda: VisitorMC3().getC8(tree))
+        analyze = timeCall(lambda: VisitorMC3().analyze(tree))
+        print(f"{depth:>5} {nodes:>8} {c8*1000:>9.2f} {analyze*1000:>11.2f} "
+              f"{c8*1e6/nodes:>14.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Synthetic CS1-style programs for benchmarking MC4.
+
+    python -m benchmarks.programs --shape elifChains --seed 3
+
+ProgramGenerator writes programs that look like introductory course
+submissions (input()/print(), lists, a comprehension, range() loops,
+while loops, if/elif chains, small helper functions, global variables)
+with a controlled size and shape. The same seed always gives the same
+program, so timings can be compared across runs and machines. A few MC³
+(built-in redefinitions, while True loops, retested conditions,
+overwritten iteration variables, statements with no effect...) are
+sprinkled in at random so detectors do not always take their "nothing
+found" path.
+"""
+import argparse
+import random
+
+#Parameters of ProgramGenerator for each named shape
+SHAPES = {
+    'small': dict(functions=3, elifChain=3, loopDepth=2, assignments=20),
+    'elifChains': dict(functions=10, elifChain=60, loopDepth=2, assignments=100),
+    'deepLoops': dict(functions=5, elifChain=4, loopDepth=12, assignments=100),
+    'manyFunctions': dict(functions=300, elifChain=4, loopDepth=3, assignments=300),
+    'manyAssignments': dict(functions=10, elifChain=4, loopDepth=2, assignments=5000),
+}
+
+NAMES = ['total', 'count', 'value', 'number', 'grade', 'average', 'result', 'amount', 'age',
+         'price', 'score', 'index', 'limit', 'option', 'answer', 'n', 'x', 'y', 'a', 'b']
+
+BUILTIN_NAMES = ['sum', 'max', 'min', 'list', 'input', 'len']
+
+class ProgramGenerator:
+    """Generates one program. functions is the number of helper functions,
+       elifChain the number of branches of the longest if/elif chain,
+       loopDepth the deepest for/while nesting and assignments the number of
+       assignment statements spread over the module and the functions.
+    """
+    def __init__(self, seed = 0, functions = 10, elifChain = 5, loopDepth = 3,
+                 assignments = 100, mc3Rate = 0.05):
+        self.random = random.Random(seed)
+        self.functions = functions
+        self.elifChain = elifChain
+        self.loopDepth = loopDepth
+        self.assignments = assignments
+        self.mc3Rate = mc3Rate
+        self.lines = []
+
+    def emit(self, indent, line):
+        self.lines.append('    '*indent + line)
+
+    def mc3(self):
+        return self.random.random() < self.mc3Rate
+
+    def name(self):
+        name = self.random.choice(NAMES)
+        if self.mc3():
+            return self.random.choice(BUILTIN_NAMES)
+        return name + str(self.random.randrange(10))
+
+    def expression(self, names):
+        a, b = self.random.choice(names), self.random.choice(names)
+        return self.random.choice([f"{a} + {b}", f"{a} * 2", f"{a} - {b} // 3",
+                                   f"({a} + {b}) / 2", f"{a} % 10", str(self.random.randrange(100))])
+
+    def condition(self, names):
+        return f"{self.random.choice(names)} {self.random.choice(['<', '>', '==', '!=', '>='])} " \
+               f"{self.random.randrange(100)}"
+
+    def emitAssignments(self, indent, names, count):
+        for _ in range(count):
+            target = self.name()
+            self.emit(indent, f"{target} = {self.expression(names)}")
+            names.append(target)
+
+            if self.mc3():
+                self.emit(indent, self.random.choice(['True', '0', f"{target} == 1"]))
+
+    def emitElifChain(self, indent, names, branches):
+        variable = self.random.choice(names)
+        self.emit(indent, f"if {variable} < 0:")
+        self.emit(indent + 1, f"print('negative', {variable})")
+
+        for number in range(1, branches):
+            if self.mc3():
+                self.emit(indent, f"elif {variable} < 0:")
+            else:
+                self.emit(indent, f"elif {variable} == {number}:")
+            self.emit(indent + 1, f"{self.name()} = {self.expression(names)}")
+
+        self.emit(indent, "else:")
+        self.emit(indent + 1, f"print({variable})")
+
+    def emitLoopNest(self, indent, names, depth):
+        if depth == 0:
+            self.emitAssignments(indent, names, 2)
+            return
+
+        if self.random.random() < 0.7:
+            variable = f"i{depth}"
+            limit = 9999 if self.mc3() else self.random.choice(names)
+            self.emit(indent, f"for {variable} in range({limit}):")
+            self.emit(indent + 1, f"{self.name()} = {variable} * 2")
+            if self.mc3():
+                self.emit(indent + 1, f"{variable} += 1")
+            self.emitLoopNest(indent + 1, names + [variable], depth - 1)
+        else:
+            variable = self.random.choice(names)
+            if self.mc3():
+                self.emit(indent, "while True:")
+            else:
+                self.emit(indent, f"while {variable} > 0:")
+            self.emit(indent + 1, f"{variable} = {variable} - 1")
+            self.emitLoopNest(indent + 1, names, depth - 1)
+            self.emit(indent + 1, f"if {self.condition(names)}:")
+            self.emit(indent + 2, "break")
+
+    def emitFunction(self, number, names, assignments):
+        parameters = [f"{self.random.choice(NAMES)}{number}_{index}"
+                      for index in range(self.random.randint(1, 3))]
+        self.emit(0, f"def compute_{self.random.choice(NAMES)}_{number}({', '.join(parameters)}):")
+
+        local = list(parameters)
+        if self.mc3():
+            local.append(self.random.choice(names))
+        self.emitAssignments(1, local, assignments)
+
+        shape = self.random.random()
+        if shape < 0.3:
+            self.emitElifChain(1, local, self.random.randint(2, max(2, self.elifChain // 4)))
+        elif shape < 0.6:
+            self.emitLoopNest(1, local, self.random.randint(1, max(1, self.loopDepth // 2)))
+        else:
+            self.emit(1, f"if {self.condition(local)}:")
+            self.emit(2, f"return {self.expression(local)}")
+            if self.mc3():
+                self.emit(1, f"if {self.condition(local)}:")
+                self.emit(2, f"return {self.expression(local)}")
+
+        self.emit(1, f"return {self.random.choice(local)}")
+        self.emit(0, "")
+
+    def generate(self):
+        """Returns the source code of the program.
+        """
+        self.lines = []
+        names = []
+
+        self.emit(0, '"""Exercise solution."""')
+        for _ in range(3):
+            name = self.name()
+            self.emit(0, f"{name} = int(input())")
+            names.append(name)
+        self.emit(0, f"values = [{', '.join(names)}]")
+        names.append('values')
+        self.emit(0, "")
+
+        perBlock = self.assignments // (self.functions + 4)
+        for number in range(self.functions):
+            self.emitFunction(number, names, max(1, perBlock))
+
+        self.emitAssignments(0, names, max(1, self.assignments - perBlock*self.functions))
+        self.emitElifChain(0, names, self.elifChain)
+        self.emitLoopNest(0, names, self.loopDepth)
+
+        for _ in range(3):
+            self.emit(0, f"print({self.random.choice(names)})")
+        self.emit(0, "print([round(value / 2) for value in sorted(values) if abs(value) > 1])")
+
+        return '\n'.join(self.lines) + '\n'
+
+def generatePrograms(shape, count, seed = 0):
+    """count programs of a named shape (see SHAPES), with seeds seed,
+       seed + 1, ...
+    """
+    return [ProgramGenerator(seed + index, **SHAPES[shape]).generate() for index in range(count)]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Prints a synthetic CS1 program.')
+    parser.add_argument('--shape', choices=sorted(SHAPES), default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print(generatePrograms(args.shape, 1, args.seed)[0], end='')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Compares thread and process scaling of AnalyzerMC3.
+
+    python -m benchmarks.scaling [files, directories or globs] [--repeat N]
+
+Sources are read into memory first, so only parsing and detection are
+timed. Without inputs, the testCode*.py files are used. On a regular
+CPython build threads are expected to stay flat because of the GIL; on a
+free-threaded build (3.13t+) they should scale like processes.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from AnalyzerMC3 import AnalyzerMC3
+from mc4 import DEFAULT_THRESHOLDS, expandInputs
+
+ANALYZER = AnalyzerMC3(*DEFAULT_THRESHOLDS)
+
+def analyzeSource(source):
+    return ANALYZER.analyzeSource(source).detected()
+
+def timeRun(poolClass, workers, sources):
+    start = time.perf_counter()
+    with poolClass(max_workers=workers) as executor:
+        for _ in executor.map(analyzeSource, sources, chunksize=32):
+            pass
+    return time.perf_counter() - start
+
+def workerCounts():
+    counts, workers = [], 1
+    while workers < (os.cpu_count() or 1):
+        counts.append(workers)
+        workers *= 2
+    return counts + [os.cpu_count() or 1]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='*', default=['testCode*.py'])
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='times each input is analyzed (default: 200)')
+    args = parser.parse_args(argv)
+
+    sources = []
+    for path in expandInputs(args.inputs):
+        with open(path, 'rb') as file:
+            sources.append(file.read())
+    sources = sources*args.repeat
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f"{len(sources)} sources, Python {sys.version.split()[0]}, "
+          f"GIL {'enabled' if gil else 'disabled'}")
+    print(f"{'workers':>7} {'threads files/s':>16} {'processes files/s':>18}")
+
+    for workers in workerCounts():
+        threads = len(sources)/timeRun(ThreadPoolExecutor, workers, sources)
+        processes = len(sources)/timeRun(ProcessPoolExecutor, workers, sources)
+        print(f"{workers:>7} {threads:>16.0f} {processes:>18.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Benchmark suite over synthetic CS1 programs (see benchmarks.programs).
+
+    python -m benchmarks.suite [--shapes small deepLoops] [--count 20]
+    python -m benchmarks.suite --save baseline.json
+    python -m benchmarks.suite --compare baseline.json [--tolerance 0.25]
+
+For each program shape, times parsing, every getXX detector on its own
+(each on a fresh VisitorMC3, like a caller wanting a single MC³ would do),
+the single-pass analyze() and the whole pipeline (parse + analyze, as done
+by mc4.py for each file). Results are the best of --repeat runs, reported
+as files per second and nanoseconds per AST node.
+
+--save writes the results to a JSON baseline; --compare prints the ratio
+to a saved baseline for each measure and exits with status 1 if any got
+slower than the tolerance allows, so regressions show up in numbers.
+"""
+import argparse
+import ast
+import json
+import platform
+import sys
+import time
+
+from AnalyzerMC3 import AnalyzerMC3
+from VisitorMC3 import VisitorMC3
+from mc4 import DEFAULT_THRESHOLDS
+from benchmarks.programs import SHAPES, generatePrograms
+
+CONST, NUM_LISTS, VAR_LEN, FUNC_LEN, TOTAL_NAMES = DEFAULT_THRESHOLDS
+
+GETTERS = {
+    'A4': lambda visitor, tree: visitor.getA4(tree),
+    'B6': lambda visitor, tree: visitor.getB6(tree),
+    'B8': lambda visitor, tree: visitor.getB8(tree),
+    'B9': lambda visitor, tree: visitor.getB9(tree),
+    'B12': lambda visitor, tree: visitor.getB12(tree),
+    'C1': lambda visitor, tree: visitor.getC1(tree),
+    'C2': lambda visitor, tree: visitor.getC2(tree),
+    'C4': lambda visitor, tree: visitor.getC4(tree, CONST),
+    'C8': lambda visitor, tree: visitor.getC8(tree),
+    'D4': lambda visitor, tree: visitor.getD4(tree),
+    'E2': lambda visitor, tree: visitor.getE2(tree, NUM_LISTS),
+    'G4': lambda visitor, tree: visitor.getG4(tree, VAR_LEN, FUNC_LEN, TOTAL_NAMES),
+    'G5': lambda visitor, tree: visitor.getG5(tree),
+    'H1': lambda visitor, tree: visitor.getH1(tree),
+}
+
+ANALYZER = AnalyzerMC3(*DEFAULT_THRESHOLDS)
+
+def bestTime(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def benchmarkShape(shape, count, repeat, seed = 0):
+    """Returns {'files', 'nodes', 'seconds': {measure: best time over all the
+       programs}} for count programs of a shape.
+    """
+    sources = generatePrograms(shape, count, seed)
+    trees = [ast.parse(source) for source in sources]
+    nodes = sum(1 for tree in trees for _ in ast.walk(tree))
+
+    def runGetter(getter):
+        for tree in trees:
+            getter(VisitorMC3(), tree)
+
+    def runAnalyze():
+        for tree in trees:
+            VisitorMC3().analyze(tree, *DEFAULT_THRESHOLDS)
+
+    def runPipeline():
+        for source in sources:
+            ANALYZER.analyzeSource(source)
+
+    seconds = {'parse': bestTime(lambda: [ast.parse(source) for source in sources], repeat)}
+    for code, getter in GETTERS.items():
+        seconds[f"get{code}"] = bestTime(lambda: runGetter(getter), repeat)
+    seconds['allGetters'] = sum(seconds[f"get{code}"] for code in GETTERS)
+    seconds['analyze'] = bestTime(runAnalyze, repeat)
+    seconds['pipeline'] = bestTime(runPipeline, repeat)
+
+    return {'files': count, 'nodes': nodes, 'seconds': seconds}
+
+def runSuite(shapes, count, repeat, seed = 0):
+    return {'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'count': count,
+            'seed': seed,
+            'shapes': {shape: benchmarkShape(shape, count, repeat, seed) for shape in shapes}}
+
+def reportLines(results):
+    lines = [f"Python {results['python']} on {results['platform']}, "
+             f"{results['count']} programs per shape"]
+
+    for shape, result in results['shapes'].items():
+        lines.append('')
+        lines.append(f"{shape}: {result['files']} files, {result['nodes']} nodes")
+        lines.append(f"  {'measure':<12} {'ms':>10} {'files/s':>10} {'ns/node':>10}")
+        for measure, seconds in result['seconds'].items():
+            lines.append(f"  {measure:<12} {seconds*1000:>10.2f} "
+                         f"{result['files']/seconds:>10.0f} {seconds*1e9/result['nodes']:>10.0f}")
+
+    return lines
+
+def compareLines(results, baseline, tolerance):
+    """Returns (lines, regressions) comparing the per-node cost of each
+       measure with a baseline. A ratio above 1 + tolerance is a regression.
+    """
+    lines, regressions = [], []
+
+    for shape, result in results['shapes'].items():
+        if shape not in baseline['shapes']:
+            continue
+
+        previous = baseline['shapes'][shape]
+        lines.append(f"{shape} (current/baseline):")
+        for measure, seconds in result['seconds'].items():
+            if measure not in previous['seconds']:
+                continue
+
+            ratio = (seconds/result['nodes'])/(previous['seconds'][measure]/previous['nodes'])
+            regressed = ratio > 1 + tolerance
+            if regressed:
+                regressions.append((shape, measure, ratio))
+            lines.append(f"  {measure:<12} {ratio:>6.2f}x{'  REGRESSION' if regressed else ''}")
+
+    return lines, regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Times MC4 detectors on synthetic CS1 programs.')
+    parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES), default=list(SHAPES))
+    parser.add_argument('--count', type=int, default=20,
+                        help='programs generated per shape (default: 20)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measure, the best one is kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='JSON', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON', help='compare with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown allowed by --compare before failing (default: 0.25)')
+    args = parser.parse_args(argv)
+
+    results = runSuite(args.shapes, args.count, args.repeat, args.seed)
+    for line in reportLines(results):
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+        lines, regressions = compareLines(results, baseline, args.tolerance)
+        print('')
+        for line in lines:
+            print(line)
+
+        if regressions:
+            print(f"\n{len(regressions)} measures slower than the baseline by more than "
+                  f"{args.tolerance:.0%}")
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""Cohort-level prevalence and co-occurrence of the MC³.
+
+Each submission's 14 flags are packed into a bitmask (bit i set if
+MC3_CODES[i] was detected), and a CohortStats counts how many submissions
+have each of the 2^14 masks. Prevalence counts and the 14x14 co-occurrence
+matrix (how many submissions have both MC³ i and j; the diagonal is the
+prevalence) are computed from these counts with NumPy:
+
+    python cohortStats.py submissions/ -o cohort.npz
+    python cohortStats.py --merge week1.npz week2.npz -o term.npz
+    python cohortStats.py --jsonl results.jsonl
+
+Counts are plain sums, so partial statistics (from separate workers,
+shards or runs) merge in any order and grouping into the same result, and
+a cohort of any size is aggregated in one streaming pass. --jsonl reads
+the output of mc4.py --format jsonl instead of analyzing anything.
+Requires NumPy.
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from VisitorMC3 import MC3_CODES
+from mc4 import DEFAULT_THRESHOLDS, addThresholdArguments, expandInputs, iterAnalyze, \
+                thresholdsFromArgs
+
+NUM_MASKS = 2**len(MC3_CODES)
+
+# MASK_BITS[mask, i] is 1 if MC3_CODES[i] is in mask
+MASK_BITS = ((np.arange(NUM_MASKS)[:, None] >> np.arange(len(MC3_CODES))[None, :]) & 1) \
+            .astype(np.int64)
+
+def flagMask(codes):
+    """Bitmask of a list of MC³ codes, e.g. the detected() of a ReportMC3.
+       Codes outside MC3_CODES, such as those of custom rules, are ignored.
+    """
+    mask = 0
+    for code in codes:
+        if code in MC3_CODES:
+            mask |= 1 << MC3_CODES.index(code)
+    return mask
+
+def maskCodes(mask):
+    """The MC³ codes of a bitmask, in MC3_CODES order.
+    """
+    return [code for i, code in enumerate(MC3_CODES) if mask >> i & 1]
+
+class CohortStats:
+    def __init__(self, thresholds = DEFAULT_THRESHOLDS):
+        self.thresholds = tuple(thresholds)
+        self.maskCounts = np.zeros(NUM_MASKS, dtype=np.int64)
+        self.errors = 0
+
+    @property
+    def submissions(self):
+        """Number of submissions analyzed, leaving out the ones with errors.
+        """
+        return int(self.maskCounts.sum())
+
+    def add(self, codes):
+        self.maskCounts[flagMask(codes)] += 1
+
+    def addMasks(self, masks):
+        """Counts a whole array of bitmasks at once.
+        """
+        self.maskCounts += np.bincount(np.asarray(masks, dtype=np.int64), minlength=NUM_MASKS)
+
+    def addError(self):
+        self.errors += 1
+
+    def merge(self, other):
+        """Adds another CohortStats into this one. Both must have been computed
+           with the same constants.
+        """
+        if other.thresholds != self.thresholds:
+            raise ValueError(f"cannot merge statistics computed with different constants: "
+                             f"{self.thresholds} and {other.thresholds}")
+
+        self.maskCounts += other.maskCounts
+        self.errors += other.errors
+        return self
+
+    def prevalence(self):
+        """Number of submissions where each MC³ was detected, in MC3_CODES order.
+        """
+        return self.maskCounts @ MASK_BITS
+
+    def cooccurrence(self):
+        """14x14 matrix of the number of submissions where both MC³ were
+           detected.
+        """
+        return MASK_BITS.T @ (self.maskCounts[:, None]*MASK_BITS)
+
+    def commonCombinations(self, limit = 10):
+        """The most frequent sets of MC³ detected together, as (codes, count).
+        """
+        masks = np.argsort(-self.maskCounts, kind='stable')[:limit]
+        return [(maskCodes(int(mask)), int(self.maskCounts[mask])) for mask in masks
+                if self.maskCounts[mask] > 0]
+
+    def save(self, path):
+        np.savez_compressed(path, maskCounts=self.maskCounts, errors=self.errors,
+                            thresholds=np.array(self.thresholds, dtype=np.float64),
+                            codes=np.array(MC3_CODES))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if list(data['codes']) != MC3_CODES:
+                raise ValueError(f"{path} was computed for other MC³ codes")
+
+            stats = cls(tuple(value.item() for value in data['thresholds']))
+            stats.maskCounts = data['maskCounts'].astype(np.int64)
+            stats.errors = int(data['errors'])
+        return stats
+
+def analyzeCohort(paths, thresholds = DEFAULT_THRESHOLDS, jobs = None, batchSize = 65536):
+    """Analyzes every path and returns their CohortStats. Bitmasks are counted
+       in batches as results stream in.
+    """
+    stats = CohortStats(thresholds)
+    masks = []
+    for path, codes, error in iterAnalyze(paths, thresholds, jobs):
+        if error is not None:
+            stats.addError()
+            continue
+
+        masks.append(flagMask(codes))
+        if len(masks) >= batchSize:
+            stats.addMasks(masks)
+            masks = []
+
+    stats.addMasks(masks)
+    return stats
+
+def readJsonl(file, thresholds = DEFAULT_THRESHOLDS):
+    """CohortStats of the results written by mc4.py --format jsonl.
+    """
+    stats = CohortStats(thresholds)
+    for line in file:
+        if not line.strip():
+            continue
+
+        result = json.loads(line)
+        if result['error'] is not None:
+            stats.addError()
+        else:
+            stats.add(result['codes'])
+    return stats
+
+def cohortReport(stats):
+    """Prevalence, co-occurrence and most common combinations as printable lines.
+    """
+    total = stats.submissions
+    lines = [f"{total} submissions ({stats.errors} not analyzed)", "", "Prevalence"]
+
+    for code, count in zip(MC3_CODES, stats.prevalence()):
+        lines.append(f"  {code:>4} {count:>9} {count/max(total, 1):8.2%}")
+
+    lines += ["", "Co-occurrence", "     " + ''.join(f"{code:>8}" for code in MC3_CODES)]
+    for code, row in zip(MC3_CODES, stats.cooccurrence()):
+        lines.append(f"  {code:>3}" + ''.join(f"{count:>8}" for count in row))
+
+    lines += ["", "Most common combinations"]
+    for codes, count in stats.commonCombinations():
+        lines.append(f"  {count:>9}  {' '.join(codes) or '(none)'}")
+
+    return lines
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Prevalence and co-occurrence of the MC³ '
+                                                 'in a cohort.')
+    parser.add_argument('inputs', nargs='*',
+                        help='files, directories or glob patterns to analyze')
+    parser.add_argument('--merge', nargs='+', metavar='NPZ', default=[],
+                        help='statistics saved by earlier runs to merge in')
+    parser.add_argument('--jsonl', metavar='FILE',
+                        help='read results from mc4.py --format jsonl ("-" for stdin)')
+    parser.add_argument('-o', '--output', help='save the statistics to this .npz file')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: one per CPU)')
+    addThresholdArguments(parser)
+    args = parser.parse_args(argv)
+
+    thresholds = thresholdsFromArgs(args)
+    parts = [CohortStats.load(path) for path in args.merge]
+
+    if args.inputs:
+        parts.append(analyzeCohort(expandInputs(args.inputs), thresholds, args.jobs))
+
+    if args.jsonl == '-':
+        parts.append(readJsonl(sys.stdin, thresholds))
+    elif args.jsonl:
+        with open(args.jsonl, encoding='utf-8') as file:
+            parts.append(readJsonl(file, thresholds))
+
+    if len(parts) == 0:
+        parser.error('nothing to aggregate: give inputs, --merge or --jsonl')
+
+    stats = parts[0]
+    for part in parts[1:]:
+        stats.merge(part)
+
+    if args.output:
+        stats.save(args.output)
+
+    for line in cohortReport(stats):
+        print(line)
+
+if __name__ == '__main__':
+    main()
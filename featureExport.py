@@ -0,0 +1,220 @@
+"""Per-submission feature matrix export.
+
+Writes one row per submission with the 14 MC³ flags and the numeric
+evidence behind them, to CSV and/or a NumPy .npz file:
+
+    python featureExport.py submissions/ -o features.npz -o features.csv
+
+Rows are produced by a process pool and written in batches, so the corpus
+never has to sit in memory. In the .npz file every column of
+FEATURE_COLUMNS is a 1-D array; text columns (path, error, builtinNames)
+are stored as <name>_data (UTF-8 bytes of all rows, concatenated) and
+<name>_offsets (where each row starts and ends in <name>_data).
+Requires NumPy for the .npz output.
+"""
+import argparse
+import ast
+import csv
+import os
+import shutil
+import tempfile
+import zipfile
+
+from AnalyzerMC3 import AnalyzerMC3
+from VisitorMC3 import MC3_CODES
+from mc4 import DEFAULT_THRESHOLDS, WORKER_CRASHED, addThresholdArguments, expandInputs, \
+                mapWorker, thresholdsFromArgs
+
+FEATURE_COLUMNS = [('path', 'text'), ('error', 'text')] + \
+                  [(code, 'flag') for code in MC3_CODES] + \
+                  [('builtinNames', 'text'),
+                   ('numBuiltinNames', 'int'),
+                   ('numLists', 'int'),
+                   ('maxRangeConstant', 'float'),
+                   ('numVarNames', 'int'),
+                   ('minVarNameLength', 'float'),
+                   ('meanVarNameLength', 'float'),
+                   ('maxVarNameLength', 'float'),
+                   ('numFuncNames', 'int'),
+                   ('minFuncNameLength', 'float'),
+                   ('meanFuncNameLength', 'float'),
+                   ('maxFuncNameLength', 'float')]
+
+def lengthStats(lengths):
+    if len(lengths) == 0:
+        return [len(lengths), float('nan'), float('nan'), float('nan')]
+
+    return [len(lengths), min(lengths), sum(lengths)/len(lengths), max(lengths)]
+
+def featureRow(path, thresholds = DEFAULT_THRESHOLDS):
+    """Worker entry point. Returns the values of FEATURE_COLUMNS for a file.
+       Files that cannot be analyzed get their error and empty features.
+    """
+    try:
+        with open(path, 'rb') as file:
+            tree = ast.parse(file.read())
+
+        report, metrics = AnalyzerMC3(*thresholds).analyzeWithMetrics(tree)
+
+    #MemoryError from ast.parse and bugs of the detectors included, as in mc4.py
+    except Exception as e:
+        return errorRow(path, f"{type(e).__name__}: {e}")
+
+    builtinNames = list(dict.fromkeys(report.builtinVariables + report.builtinFunctions +
+                                      report.builtinArguments))
+
+    return [path, ''] + [getattr(report, code) for code in MC3_CODES] + \
+           [';'.join(builtinNames), len(builtinNames), metrics.numLists,
+            metrics.maxRangeFloat()] + \
+           lengthStats(metrics.varNameLengths) + lengthStats(metrics.funcNameLengths)
+
+def errorRow(path, error):
+    return [path, error] + [False]*len(MC3_CODES) + ['', 0, 0, float('nan')] + \
+           lengthStats(()) + lengthStats(())
+
+def featureWorker(path, thresholds, dedup):
+    """featureRow with the (path, thresholds, dedup) signature of the workers
+       of mc4.mapWorker.
+    """
+    return featureRow(path, thresholds)
+
+class CsvFeatureWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in FEATURE_COLUMNS])
+
+    def writeBatch(self, rows):
+        self.writer.writerows([[int(value) if kind == 'flag' else value
+                                for value, (_, kind) in zip(row, FEATURE_COLUMNS)]
+                               for row in rows])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class NpzFeatureWriter:
+    """Streams columns to raw temporary files, one per array, and packs them
+       into the .npz archive on close.
+    """
+    def __init__(self, path):
+        import numpy as np
+        self.np = np
+
+        self.path = path
+        self.numRows = 0
+        self.tempDir = tempfile.mkdtemp(prefix='mc4-features-')
+        self.dtypes = {'flag': np.dtype(np.bool_), 'int': np.dtype(np.int64),
+                       'float': np.dtype(np.float64)}
+        self.columns = {}
+        for name, kind in FEATURE_COLUMNS:
+            if kind == 'text':
+                self.openColumn(f"{name}_data", np.dtype(np.uint8))
+                self.openColumn(f"{name}_offsets", np.dtype(np.int64))
+                self.append(f"{name}_offsets", np.zeros(1, dtype=np.int64))
+            else:
+                self.openColumn(name, self.dtypes[kind])
+
+        self.textEnds = {name: 0 for name, kind in FEATURE_COLUMNS if kind == 'text'}
+
+    def openColumn(self, name, dtype):
+        """Each column is [raw file, dtype, number of elements written].
+        """
+        self.columns[name] = [open(os.path.join(self.tempDir, name), 'wb'), dtype, 0]
+
+    def append(self, name, array):
+        column = self.columns[name]
+        column[0].write(array.astype(column[1], copy=False).tobytes())
+        column[2] += len(array)
+
+    def writeBatch(self, rows):
+        np = self.np
+
+        for index, (name, kind) in enumerate(FEATURE_COLUMNS):
+            values = [row[index] for row in rows]
+
+            if kind == 'text':
+                encoded = [value.encode('utf-8', 'surrogateescape') for value in values]
+                ends = np.cumsum([len(item) for item in encoded], dtype=np.int64)
+                self.append(f"{name}_data", np.frombuffer(b''.join(encoded), dtype=np.uint8))
+                self.append(f"{name}_offsets", ends + self.textEnds[name])
+                if len(ends) > 0:
+                    self.textEnds[name] += int(ends[-1])
+            else:
+                self.append(name, np.array(values, dtype=self.dtypes[kind]))
+
+        self.numRows += len(rows)
+
+    def close(self):
+        np = self.np
+
+        try:
+            with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                for name, (file, dtype, length) in self.columns.items():
+                    file.close()
+
+                    header = {'descr': np.lib.format.dtype_to_descr(dtype),
+                              'fortran_order': False, 'shape': (length,)}
+                    with archive.open(f"{name}.npy", 'w', force_zip64=True) as member:
+                        np.lib.format.write_array_header_2_0(member, header)
+                        with open(os.path.join(self.tempDir, name), 'rb') as raw:
+                            shutil.copyfileobj(raw, member)
+        finally:
+            shutil.rmtree(self.tempDir, ignore_errors=True)
+
+def openWriter(path):
+    if path.endswith('.npz'):
+        return NpzFeatureWriter(path)
+
+    if path.endswith('.csv'):
+        return CsvFeatureWriter(path)
+
+    raise ValueError(f"unsupported output format: {path} (use .npz or .csv)")
+
+def exportFeatures(paths, outputs, thresholds = DEFAULT_THRESHOLDS, jobs = None,
+                   batchSize = 10000):
+    """Analyzes every path and writes its feature row to each output file.
+       paths can be lazy: they are handed to the workers a few chunks at a
+       time (see mc4.mapWorker). Returns the number of rows written.
+    """
+    writers = [openWriter(output) for output in outputs]
+    numRows = 0
+    try:
+        batch = []
+        for row in mapWorker(featureWorker, paths, thresholds, jobs, 64, None, False,
+                             crashed=lambda path: errorRow(path, WORKER_CRASHED)):
+            batch.append(row)
+            if len(batch) >= batchSize:
+                for writer in writers:
+                    writer.writeBatch(batch)
+                numRows += len(batch)
+                batch = []
+
+        if len(batch) > 0:
+            for writer in writers:
+                writer.writeBatch(batch)
+            numRows += len(batch)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    return numRows
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Export one row of MC³ flags and evidence '
+                                                 'per submission.')
+    parser.add_argument('inputs', nargs='+', help='files, directories or glob patterns')
+    parser.add_argument('-o', '--output', action='append', required=True,
+                        help='.npz or .csv file to write (can be repeated)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='rows written at a time (default: 10000)')
+    addThresholdArguments(parser)
+    args = parser.parse_args(argv)
+
+    exportFeatures(expandInputs(args.inputs), args.output, thresholdsFromArgs(args),
+                   args.jobs, args.batch_size)
+
+if __name__ == '__main__':
+    main()
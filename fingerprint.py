@@ -0,0 +1,103 @@
+"""Normalized-AST fingerprints used to analyze equivalent submissions once.
+
+Two submissions get the same fingerprint when their parsed trees are equal
+once locations and docstrings are dropped, so whitespace, comments and
+docstrings do not matter. With renameIdentifiers, user identifiers are
+also replaced by their order of appearance (alpha-renaming), so programs
+that only differ in variable/function names match as well.
+
+Renaming keeps every built-in name as is, so A4 and the range() checks of
+C2/C4 are unaffected, and every other detector except G4 only compares
+names with each other. G4 depends on the actual names, so the fingerprint
+also returns the declared variable and function names for it to be
+evaluated per submission (see hasNonSignificantNames).
+"""
+import ast
+import builtins
+import hashlib
+
+from VisitorMC3 import LIST_OF_BUILTINS
+
+KEPT_NAMES = frozenset(dir(builtins)) | frozenset(LIST_OF_BUILTINS)
+
+IDENTIFIER_FIELDS = frozenset(['id', 'arg', 'name', 'asname', 'attr', 'names', 'module',
+                               'rest', 'kwd_attrs'])
+
+DOCSTRING_OWNERS = (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+def isDocstring(node):
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and \
+           isinstance(node.value.value, str)
+
+def fingerprint(tree, renameIdentifiers = False):
+    """Returns (digest, declared variable names, declared function names) for
+       a parsed tree. The tree is not modified.
+    """
+    renamed = {}
+    varNames = {}
+    funcNames = {}
+    digest = hashlib.blake2b(digest_size=16)
+    parts = []
+
+    def identifier(name):
+        if not renameIdentifiers or name in KEPT_NAMES:
+            return name
+
+        if name not in renamed:
+            renamed[name] = f"_{len(renamed)}"
+        return renamed[name]
+
+    def dump(node):
+        parts.append(type(node).__name__)
+        parts.append('(')
+
+        if isinstance(node, ast.Assign):
+            for tgt in node.targets:
+                for item in (tgt.elts if isinstance(tgt, ast.Tuple) else [tgt]):
+                    if isinstance(item, ast.Name):
+                        varNames[item.id] = None
+
+        if isinstance(node, ast.FunctionDef):
+            funcNames[node.name] = None
+
+        for field, value in ast.iter_fields(node):
+            if field == 'type_comment':
+                continue
+
+            if field == 'body' and isinstance(node, DOCSTRING_OWNERS) and \
+               len(value) > 0 and isDocstring(value[0]):
+                value = value[1:]
+
+            if isinstance(value, list):
+                parts.append('[')
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        dump(item)
+                    elif field in IDENTIFIER_FIELDS and isinstance(item, str):
+                        parts.append(identifier(item))
+                    else:
+                        parts.append(repr(item))
+                    parts.append(',')
+                parts.append(']')
+
+            elif isinstance(value, ast.AST):
+                dump(value)
+
+            elif field in IDENTIFIER_FIELDS and isinstance(value, str):
+                parts.append(identifier(value))
+
+            else:
+                parts.append(repr(value))
+
+            parts.append(',')
+
+        parts.append(')')
+
+        if len(parts) > 4096:
+            digest.update(''.join(parts).encode('utf-8', 'surrogatepass'))
+            parts.clear()
+
+    dump(tree)
+    digest.update(''.join(parts).encode('utf-8', 'surrogatepass'))
+
+    return digest.digest(), list(varNames), list(funcNames)
@@ -0,0 +1,610 @@
+"""Command-line batch analyzer for MC4.
+
+Runs every MC³ detection over many submissions at once, e.g.
+
+    python mc4.py submissions/ "archive/2023/**/*.py" -o results.txt
+
+Directories are searched recursively for .py files and globs are expanded
+(with ** support). Parsing and detection happen in a pool of worker
+processes, which only send back the detected MC³ names for each file.
+One line is written per file: its path, a tab, and the detected MC³
+separated by spaces (or "error: <reason>" if it could not be analyzed).
+
+With --shard K/N, only the K-th of N deterministic shards of the inputs is
+analyzed, and --partial writes its results to a file that sharding.py
+merges with the other shards' (see sharding.py).
+
+With --projects, each input directory is one submission made of several
+modules, analyzed as a whole so that A4 and D4 see the names its modules
+import from each other (see ProjectAnalyzer.py). One line is still written
+per module.
+"""
+import argparse
+import ast
+import functools
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from AnalyzerMC3 import AnalyzerMC3
+from ResultCache import ResultCache, cacheKey
+from Telemetry import Telemetry
+from VisitorMC3 import MC3_CODES, hasNonSignificantNames
+from fingerprint import fingerprint
+from PatternRules import readRules
+from ProjectAnalyzer import ProjectAnalyzer
+from prefilter import relevantDetectors
+from sharding import PartialWriter, parseShard, selectShard
+
+# Default constants, same as exampleUsage.py
+
+C4_MAX_ALLOWED_RANGEITER = 50       # Maximum allowed constant within range() declarations
+E2_MAX_ALLOWED_LISTS = 5            # Maximum allowed declared lists
+G4_MIN_VAR_CHRS = 4                 # Minimum required characters in variable names
+G4_MIN_FNC_CHRS = 8                 # Minimum required characters in function names
+G4_MAX_ALLOWED_NONSIGNIFICANT = 70  # Maximum allowed non-significant names
+
+DEFAULT_THRESHOLDS = (C4_MAX_ALLOWED_RANGEITER, E2_MAX_ALLOWED_LISTS, G4_MIN_VAR_CHRS,
+                      G4_MIN_FNC_CHRS, G4_MAX_ALLOWED_NONSIGNIFICANT)
+
+# Error reported for the files whose analysis kills the worker process
+WORKER_CRASHED = 'the worker process crashed'
+
+def expandInputs(inputs):
+    """Yields the .py files named by a list of files, directories and globs.
+       Directories are walked recursively in sorted order.
+    """
+    for item in inputs:
+        if os.path.isdir(item):
+            for dirpath, dirnames, filenames in os.walk(item):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.endswith('.py'):
+                        yield os.path.join(dirpath, name)
+
+        elif os.path.isfile(item):
+            yield item
+
+        else:
+            for path in sorted(glob.glob(item, recursive=True)):
+                if os.path.isfile(path):
+                    yield path
+
+def expandProjects(inputs):
+    """Yields the projects named by a list of directories, files and globs:
+       each directory (or single .py file) is a project.
+    """
+    for item in inputs:
+        if os.path.exists(item):
+            yield item
+            continue
+
+        for path in sorted(glob.glob(item, recursive=True)):
+            if os.path.isdir(path) or path.endswith('.py'):
+                yield path
+
+def analyzeSource(source, thresholds = DEFAULT_THRESHOLDS, prefilter = False, rules = (),
+                  telemetry = None):
+    """Parses a source (str or bytes) and returns the detected MC³ names,
+       followed by the codes of the rules found (see PatternRules.py). With
+       prefilter, sources are scanned first (see prefilter.py). The analysis
+       is instrumented into telemetry, if given.
+    """
+    analyzer = AnalyzerMC3(*thresholds, rules=rules, telemetry=telemetry)
+    return analyzer.analyzeSource(source, prefilter).detected()
+
+# Results of the equivalence classes already analyzed by this (worker) process
+SHARED_RESULTS = {}
+SHARED_RESULTS_LIMIT = 100000
+
+def analyzeTreeShared(tree, thresholds, renameIdentifiers, rules = (), telemetry = None):
+    """Analyzes a tree once per normalized-AST fingerprint (see fingerprint.py).
+       With renameIdentifiers, G4 is left out of the shared result and
+       evaluated from the submission's own names.
+
+       Rules can match the identifiers and docstrings the fingerprint leaves
+       out, so with rules only trees that are equal field for field share
+       their result.
+    """
+    if rules:
+        renameIdentifiers = False
+        digest = hashlib.blake2b(ast.dump(tree).encode('utf-8', 'surrogatepass'),
+                                 digest_size=16).digest()
+    else:
+        digest, varNames, funcNames = fingerprint(tree, renameIdentifiers)
+    key = (digest, renameIdentifiers, thresholds, rules)
+
+    codes = SHARED_RESULTS.get(key)
+    if codes is None:
+        analyzer = AnalyzerMC3(*thresholds, rules=rules, telemetry=telemetry)
+        codes = analyzer.analyze(tree).detected()
+        if renameIdentifiers and 'G4' in codes:
+            codes.remove('G4')
+
+        if len(SHARED_RESULTS) >= SHARED_RESULTS_LIMIT:
+            SHARED_RESULTS.clear()
+        SHARED_RESULTS[key] = codes
+
+    if renameIdentifiers and hasNonSignificantNames(varNames, funcNames, *thresholds[2:]):
+        return [code for code in MC3_CODES if code in codes or code == 'G4'] + \
+               [code for code in codes if code not in MC3_CODES]
+
+    return list(codes)
+
+def analyzeSubmission(source, thresholds = DEFAULT_THRESHOLDS, dedup = None, prefilter = False,
+                      rules = (), telemetry = None):
+    """Returns (detected MC³ names, error message) for a source (str or
+       bytes). Any failure is reported back instead of raised, so one broken
+       submission does not stop the batch. With dedup set to 'ast' or
+       'renamed', equivalent submissions share a single analysis. With
+       prefilter, sources where no MC³ can be present are not even parsed.
+       rules are run along with the MC³ detectors (see PatternRules.py).
+       The analyses are instrumented into telemetry, if given.
+    """
+    try:
+        if prefilter and len(rules) == 0 and len(relevantDetectors(source)) == 0:
+            return [], None
+
+        if dedup in ('ast', 'renamed'):
+            return analyzeTreeShared(ast.parse(source), thresholds, dedup == 'renamed',
+                                     rules, telemetry), None
+
+        return analyzeSource(source, thresholds, prefilter, rules, telemetry), None
+
+    #Besides invalid sources, ast.parse raises MemoryError on deeply nested
+    #expressions, and the detectors may have bugs
+    except Exception as e:
+        return [], f"{type(e).__name__}: {e}"
+
+def analyzeFile(path, thresholds = DEFAULT_THRESHOLDS, dedup = None, prefilter = False,
+                rules = (), telemetry = None):
+    """Worker entry point. Returns (path, detected MC³ names, error message),
+       see analyzeSubmission.
+    """
+    try:
+        with open(path, 'rb') as file:
+            source = file.read()
+    except (OSError, ValueError) as e:
+        return path, [], f"{type(e).__name__}: {e}"
+
+    codes, error = analyzeSubmission(source, thresholds, dedup, prefilter, rules, telemetry)
+    return path, codes, error
+
+# Project analyzers of this (worker) process and thread, by constants and
+# rules: modules shared by several projects are only analyzed once by each
+PROJECT_ANALYZERS = {}
+
+def analyzeProject(path, thresholds = DEFAULT_THRESHOLDS, dedup = None, rules = ()):
+    """Worker entry point with --projects. Returns (path, detected MC³
+       names, error message) for every module of a project (see
+       ProjectAnalyzer.py).
+    """
+    key = (thresholds, rules, threading.get_ident())
+    analyzer = PROJECT_ANALYZERS.get(key)
+    if analyzer is None:
+        analyzer = PROJECT_ANALYZERS[key] = ProjectAnalyzer(*thresholds, rules=rules)
+
+    try:
+        results = analyzer.analyzePath(path)
+    except Exception as e:
+        return [(path, [], f"{type(e).__name__}: {e}")]
+
+    return [(modulePath, report.detected() if report is not None else [], error)
+            for modulePath, report, error in results]
+
+def profileFile(path, thresholds = DEFAULT_THRESHOLDS, dedup = None, prefilter = False,
+                rules = ()):
+    """Worker entry point when telemetry is on. Returns the analyzeFile result
+       plus a Telemetry with the file's latency and the time each detector
+       spent in that same analysis (see Telemetry.instrument).
+    """
+    probe = Telemetry(slowFileSeconds=0.0, slowFileLimit=1)
+
+    start = time.perf_counter()
+    path, codes, error = analyzeFile(path, thresholds, dedup, prefilter, rules, probe)
+    seconds = time.perf_counter() - start
+
+    probe.observeFile(path, seconds)
+    return path, codes, error, probe
+
+def analyzeFiles(paths, thresholds = DEFAULT_THRESHOLDS, jobs = None, chunksize = 64,
+                 cache = None, dedup = None, threads = False, telemetry = None,
+                 prefilter = False, rules = ()):
+    """Yields analyzeFile results for every path, in order. Uses a process
+       pool (or a thread pool, with threads) unless jobs is 1.
+
+       With a ResultCache or any dedup mode, files are hashed first: files
+       with identical contents are analyzed once and only cache misses are
+       sent to the workers. With a Telemetry, the files analyzed by the
+       workers are profiled into it (see profileFile).
+    """
+    if cache is None and dedup is None:
+        yield from analyzePaths(paths, thresholds, jobs, chunksize, dedup, threads, telemetry,
+                                prefilter, rules=rules)
+        return
+
+    paths = list(paths)
+    keys, known, pending, misses = [], {}, set(), []
+    for path in paths:
+        try:
+            with open(path, 'rb') as file:
+                key = cacheKey(file.read(), thresholds, prefilter, rules)
+        except OSError:
+            key = None
+
+        keys.append(key)
+        if key is None:
+            misses.append(path)
+            continue
+
+        if key in known or key in pending:
+            continue
+
+        codes = cache.get(key) if cache is not None else None
+        if codes is not None:
+            known[key] = (codes, None)
+        else:
+            pending.add(key)
+            misses.append(path)
+
+    results = analyzePaths(misses, thresholds, jobs, chunksize, dedup, threads, telemetry,
+                           prefilter, rules=rules)
+    for path, key in zip(paths, keys):
+        if key in known:
+            codes, error = known[key]
+            yield path, list(codes), error
+            continue
+
+        path, codes, error = next(results)
+        if key is not None:
+            known[key] = (codes, error)
+            if error is None and cache is not None:
+                cache.put(key, codes)
+        yield path, codes, error
+
+def iterAnalyze(paths, thresholds = DEFAULT_THRESHOLDS, jobs = None, chunksize = 16,
+                dedup = None, threads = False, telemetry = None, prefilter = False, rules = ()):
+    """Yields (path, detected MC³ names, error message) for every path as soon
+       as it is analyzed, in completion order. paths can be any iterable,
+       including a lazy one such as expandInputs(...): it is consumed as the
+       workers need more files and only a few chunks are pending at a time,
+       so memory stays flat however large the corpus is.
+
+       With dedup, equivalent submissions are only shared within each
+       worker; use analyzeFiles for corpus-wide deduplication and caching.
+    """
+    yield from analyzePaths(paths, thresholds, jobs, chunksize, dedup, threads, telemetry,
+                            prefilter, ordered=False, rules=rules)
+
+def analyzePaths(paths, thresholds, jobs, chunksize, dedup = None, threads = False,
+                 telemetry = None, prefilter = False, ordered = True, rules = ()):
+    worker = analyzeFile if telemetry is None else profileFile
+    if prefilter:
+        worker = functools.partial(worker, prefilter=True)
+    if rules:
+        worker = functools.partial(worker, rules=rules)
+
+    if telemetry is None:
+        crashed = lambda path: (path, [], WORKER_CRASHED)
+    else:
+        crashed = lambda path: (path, [], WORKER_CRASHED, Telemetry())
+
+    for result in mapWorker(worker, paths, thresholds, jobs, chunksize, dedup, threads, ordered,
+                            crashed):
+        if telemetry is not None:
+            telemetry.merge(result[3])
+            result = result[:3]
+        yield result
+
+def analyzeProjects(paths, thresholds = DEFAULT_THRESHOLDS, jobs = None, threads = False,
+                    ordered = True, rules = ()):
+    """Yields analyzeFile-like results for every module of every project,
+       a worker analyzing one whole project at a time.
+    """
+    worker = functools.partial(analyzeProject, rules=rules) if rules else analyzeProject
+    for results in mapWorker(worker, paths, thresholds, jobs, 1, None, threads, ordered,
+                             lambda path: [(path, [], WORKER_CRASHED)]):
+        yield from results
+
+def analyzeChunk(worker, paths, thresholds, dedup):
+    return [worker(path, thresholds, dedup) for path in paths]
+
+def analyzeAlone(worker, paths, thresholds, dedup, crashed):
+    """analyzeChunk for the paths of a chunk whose worker process died, each
+       in a process of its own, so that only the files that crash it again
+       get crashed(path) as their result.
+    """
+    results = []
+    executor = ProcessPoolExecutor(max_workers=1)
+    try:
+        for path in paths:
+            try:
+                results += executor.submit(analyzeChunk, worker, [path], thresholds,
+                                           dedup).result()
+            except BrokenProcessPool:
+                results.append(crashed(path))
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=1)
+    finally:
+        executor.shutdown()
+
+    return results
+
+def iterChunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+def mapWorker(worker, paths, thresholds, jobs, chunksize, dedup, threads, ordered = True,
+              crashed = None):
+    """Yields worker(path, thresholds, dedup) for every path, in the order of
+       paths or, without ordered, as results come in. Paths are sent to the
+       pool in chunks and at most two chunks per worker are pending at any
+       time (a bounded queue), so paths are read lazily and finished results
+       do not pile up.
+
+       A worker process that dies (e.g. killed for its memory) breaks the
+       process pool and every chunk in it: the pool is started anew and
+       these chunks are analyzed again one file at a time (see
+       analyzeAlone), crashed(path) being the result of the files that
+       crash their process again. Without crashed, BrokenProcessPool is
+       raised.
+    """
+    if jobs == 1:
+        for path in paths:
+            yield worker(path, thresholds, dedup)
+        return
+
+    maxPending = 2*(jobs or os.cpu_count() or 1)
+    pending = []    # (future, chunk, executor)
+    poolClass = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    executor = poolClass(max_workers=jobs)
+
+    def restart(broken):
+        nonlocal executor
+        if broken is executor:
+            executor.shutdown(wait=False)
+            executor = poolClass(max_workers=jobs)
+
+    def submit(chunk):
+        try:
+            future = executor.submit(analyzeChunk, worker, chunk, thresholds, dedup)
+        except BrokenProcessPool:
+            if crashed is None:
+                raise
+            restart(executor)
+            future = executor.submit(analyzeChunk, worker, chunk, thresholds, dedup)
+        pending.append((future, chunk, executor))
+
+    def results(future, chunk, pool):
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            if crashed is None:
+                raise
+
+        #The other chunks of the broken pool are retried as they come
+        restart(pool)
+        return analyzeAlone(worker, chunk, thresholds, dedup, crashed)
+
+    def collect():
+        if ordered:
+            done = [pending.pop(0)]
+        else:
+            futures = wait([item[0] for item in pending], return_when=FIRST_COMPLETED).done
+            done = [item for item in pending if item[0] in futures]
+            pending[:] = [item for item in pending if item[0] not in futures]
+
+        for item in done:
+            yield from results(*item)
+
+    try:
+        for chunk in iterChunks(paths, chunksize):
+            submit(chunk)
+            if len(pending) >= maxPending:
+                yield from collect()
+
+        while len(pending) > 0:
+            yield from collect()
+    finally:
+        executor.shutdown()
+
+def formatResult(path, codes, error):
+    if error is not None:
+        return f"{path}\terror: {error}"
+
+    return f"{path}\t{' '.join(codes)}"
+
+def formatJsonResult(path, codes, error):
+    """One JSON Lines record: {"path": ..., "codes": [...], "error": null}.
+    """
+    return json.dumps({'path': path, 'codes': codes, 'error': error}, ensure_ascii=False)
+
+class ResultWriter:
+    """Writes one result per line (text or JSON Lines) and flushes every
+       flushEvery results, so consumers can read the file while the batch
+       is still running.
+    """
+    def __init__(self, file, format = 'text', flushEvery = 64):
+        self.file = file
+        self.format = formatJsonResult if format == 'jsonl' else formatResult
+        self.flushEvery = flushEvery
+        self.unflushed = 0
+
+    def write(self, path, codes, error):
+        print(self.format(path, codes, error), file=self.file)
+
+        self.unflushed += 1
+        if self.unflushed >= self.flushEvery:
+            self.file.flush()
+            self.unflushed = 0
+
+    def flush(self):
+        self.file.flush()
+        self.unflushed = 0
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog='mc4',
+                                     description='Detect Misconceptions in Correct Code (MC³) '
+                                                 'in Python submissions.')
+    parser.add_argument('inputs', nargs='+', help='files, directories or glob patterns')
+    parser.add_argument('-o', '--output', help='write results to this file instead of stdout')
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                        help='one "path<TAB>codes" line per file (text) or one JSON object '
+                             'per line (jsonl)')
+    parser.add_argument('--unordered', action='store_true',
+                        help='write each result as soon as it is ready instead of in input '
+                             'order (not with --cache or --dedup source)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--threads', action='store_true',
+                        help='use worker threads instead of processes '
+                             '(scales on free-threaded Python builds)')
+    parser.add_argument('--chunksize', type=int, default=64,
+                        help='files sent to a worker at a time (default: 64)')
+    parser.add_argument('--cache', help='SQLite file where results are cached between runs')
+    parser.add_argument('--cache-size', type=int, default=1000000,
+                        help='maximum number of cached results (default: 1000000)')
+    parser.add_argument('--dedup', choices=['source', 'ast', 'renamed'],
+                        help='analyze equivalent submissions once: identical files (source), '
+                             'plus equal ASTs ignoring formatting, comments and docstrings '
+                             '(ast), plus equal ASTs up to variable/function names (renamed)')
+    parser.add_argument('--telemetry', metavar='FILE',
+                        help='time every detector and write the timings, latency histograms '
+                             'and slowest files to FILE, as JSON (.json) or as a Prometheus '
+                             'textfile (any other name); slows the batch down a little')
+    parser.add_argument('--prefilter', action='store_true',
+                        help='scan each file for the keywords every MC³ needs and only run '
+                             'the detectors that can fire; files where none can are not '
+                             'parsed (nor checked for syntax errors)')
+    parser.add_argument('--slow-file-seconds', type=float, default=1.0,
+                        help='files taking at least this long are logged by --telemetry '
+                             '(default: 1.0)')
+    parser.add_argument('--rules', metavar='FILE',
+                        help='also detect the rules in FILE, one "CODE pattern" per line '
+                             '(see PatternRules.py); their codes are written after the MC³')
+    parser.add_argument('--shard', type=parseShard, metavar='K/N',
+                        help='only analyze shard K (from 0) of N of the inputs, for runs '
+                             'split over several machines')
+    parser.add_argument('--shard-by', choices=['path', 'content'], default='path',
+                        help='assign files to shards by a hash of their path or of their '
+                             'content (default: path)')
+    parser.add_argument('--partial', metavar='FILE',
+                        help='also write the results and totals of this shard to FILE, to be '
+                             'merged with the other shards by sharding.py (not with --unordered)')
+    parser.add_argument('--projects', action='store_true',
+                        help='each input directory is a submission of several modules, '
+                             'analyzed together so that A4 and D4 see their imports '
+                             '(see ProjectAnalyzer.py); not with --cache, --dedup, '
+                             '--prefilter, --telemetry, --shard or --partial')
+    addThresholdArguments(parser)
+    return parser
+
+def addThresholdArguments(parser):
+    """Adds an option for each constant that requires the instructor's expertise.
+    """
+    parser.add_argument('--c4-max-range', type=int, default=C4_MAX_ALLOWED_RANGEITER,
+                        help='C4: maximum allowed constant within range()')
+    parser.add_argument('--e2-max-lists', type=int, default=E2_MAX_ALLOWED_LISTS,
+                        help='E2: maximum allowed declared lists')
+    parser.add_argument('--g4-min-var', type=int, default=G4_MIN_VAR_CHRS,
+                        help='G4: minimum characters in variable names')
+    parser.add_argument('--g4-min-func', type=int, default=G4_MIN_FNC_CHRS,
+                        help='G4: minimum characters in function names')
+    parser.add_argument('--g4-max-nonsignificant', type=float,
+                        default=G4_MAX_ALLOWED_NONSIGNIFICANT,
+                        help='G4: maximum allowed percentage of non-significant names')
+
+def thresholdsFromArgs(args):
+    return (args.c4_max_range, args.e2_max_lists, args.g4_min_var,
+            args.g4_min_func, args.g4_max_nonsignificant)
+
+def main(argv = None):
+    parser = buildParser()
+    args = parser.parse_args(argv)
+    if args.unordered and (args.cache or args.dedup == 'source'):
+        parser.error('--unordered cannot be used with --cache or --dedup source')
+    if args.unordered and args.partial:
+        parser.error('--unordered cannot be used with --partial')
+    if args.projects and (args.cache or args.dedup or args.prefilter or args.telemetry or
+                          args.shard or args.partial):
+        parser.error('--projects cannot be used with --cache, --dedup, --prefilter, '
+                     '--telemetry, --shard or --partial')
+
+    paths = expandInputs(args.inputs)
+    thresholds = thresholdsFromArgs(args)
+
+    rules = ()
+    if args.rules:
+        try:
+            with open(args.rules, encoding='utf-8') as file:
+                rules = readRules(file)
+        except (OSError, ValueError) as e:
+            parser.error(f"--rules {args.rules}: {e}")
+
+    #Results come in input order, so the position of each one among all the
+    #inputs is the oldest one not written yet
+    shard, shards = args.shard or (0, 1)
+    positions = deque()
+    if shards > 1 or args.partial:
+        paths = selectShard(paths, shard, shards, args.shard_by, positions)
+
+    cache = ResultCache(args.cache, args.cache_size) if args.cache else None
+    telemetry = Telemetry(args.slow_file_seconds) if args.telemetry else None
+    output = open(args.output, 'w') if args.output else sys.stdout
+    partial = None
+    try:
+        if args.partial:
+            partial = PartialWriter(args.partial, shard, shards, args.shard_by, args.inputs,
+                                    thresholds, {'dedup': args.dedup,
+                                                 'prefilter': args.prefilter,
+                                                 'rules': [list(rule) for rule in rules]})
+
+        if args.projects:
+            results = analyzeProjects(expandProjects(args.inputs), thresholds, args.jobs,
+                                      args.threads, not args.unordered, rules)
+        elif args.unordered:
+            results = iterAnalyze(paths, thresholds, args.jobs, args.chunksize, args.dedup,
+                                  args.threads, telemetry, args.prefilter, rules)
+        else:
+            results = analyzeFiles(paths, thresholds, args.jobs, args.chunksize, cache,
+                                   args.dedup, args.threads, telemetry, args.prefilter, rules)
+
+        writer = ResultWriter(output, args.format)
+        for path, codes, error in results:
+            writer.write(path, codes, error)
+            if partial is not None:
+                partial.write(positions.popleft(), path, codes, error)
+        writer.flush()
+
+        if partial is not None:
+            partial.close()
+            partial = None
+
+        if telemetry is not None:
+            telemetry.write(args.telemetry)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if cache is not None:
+            cache.close()
+        if partial is not None:
+            partial.abort()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
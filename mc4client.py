@@ -0,0 +1,117 @@
+"""Thin client for the mc4d daemon.
+
+Only imports the standard modules it needs, so a call costs an interpreter
+start plus a round trip to the warm daemon instead of loading the
+detectors:
+
+    python mc4client.py --socket /tmp/mc4.sock submission.py other.py
+    python mc4client.py --socket /tmp/mc4.sock - < submission.py
+
+Prints one "path<TAB>codes" line per file, like mc4.py ("-" reads the
+source from stdin). From Python, an MC4Client keeps its connection open
+between calls:
+
+    with MC4Client('/tmp/mc4.sock') as client:
+        client.analyzeSource(source)    # {'codes': [...], 'error': None}
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+
+class MC4Client:
+    def __init__(self, socketPath, timeout = None):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.settimeout(timeout)
+        self.connection.connect(socketPath)
+        self.file = self.connection.makefile('rwb')
+        self.nextId = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.connection.close()
+
+    def call(self, method, **params):
+        """Sends a request and waits for its result. Raises RuntimeError with
+           the daemon's message on a JSON-RPC error.
+        """
+        self.nextId += 1
+        request = {'jsonrpc': '2.0', 'id': self.nextId, 'method': method, 'params': params}
+        self.file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.file.flush()
+
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('mc4d closed the connection')
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(f"mc4d: {response['error']['message']}")
+        return response['result']
+
+    def analyzeSource(self, source):
+        """source is a str, or bytes decoded as Python does (coding cookie).
+        """
+        if isinstance(source, bytes):
+            import io, tokenize
+            encoding, _ = tokenize.detect_encoding(io.BytesIO(source).readline)
+            source = source.decode(encoding)
+        return self.call('analyzeSource', source=source)
+
+    def analyzePath(self, path):
+        return self.call('analyzePath', path=os.path.abspath(path))
+
+    def analyzeBatch(self, paths):
+        return self.call('analyzeBatch', paths=[os.path.abspath(path) for path in paths])['results']
+
+    def status(self):
+        return self.call('status')
+
+    def shutdown(self):
+        return self.call('shutdown')
+
+def formatResult(path, codes, error):
+    if error is not None:
+        return f"{path}\terror: {error}"
+
+    return f"{path}\t{' '.join(codes)}"
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog='mc4client',
+                                     description='Analyze submissions with a running mc4d.')
+    parser.add_argument('--socket', required=True, help='Unix socket of the daemon')
+    parser.add_argument('--status', action='store_true', help="print the daemon's status")
+    parser.add_argument('--shutdown', action='store_true', help='stop the daemon')
+    parser.add_argument('files', nargs='*', help='files to analyze ("-" for stdin)')
+    args = parser.parse_args(argv)
+
+    with MC4Client(args.socket) as client:
+        if args.status:
+            print(json.dumps(client.status(), indent=2))
+
+        paths = [path for path in args.files if path != '-']
+        if '-' in args.files:
+            result = client.analyzeSource(sys.stdin.buffer.read())
+            print(formatResult('-', result['codes'], result['error']))
+
+        if len(paths) == 1:
+            result = client.analyzePath(paths[0])
+            print(formatResult(paths[0], result['codes'], result['error']))
+        elif len(paths) > 1:
+            for path, result in zip(paths, client.analyzeBatch(paths)):
+                print(formatResult(path, result['codes'], result['error']))
+
+        if args.shutdown:
+            client.shutdown()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,484 @@
+"""Long-running MC4 analysis daemon with a JSON-RPC interface.
+
+Starting a Python interpreter and importing the detectors costs much more
+than analyzing a typical submission. mc4d does it once: it keeps a warm
+pool of workers configured with the instructor's constants and answers
+JSON-RPC 2.0 requests, one JSON object per line, on a Unix socket
+
+    python mc4d.py --socket /tmp/mc4.sock --c4-max-range 100
+
+or on its standard input and output (--stdio), e.g. as a subprocess of
+an autograder. mc4client.py is a thin client for the socket. Methods:
+
+    analyzeSource  {"source": "..."}            -> {"codes": [...], "error": null}
+    analyzePath    {"path": "/abs/file.py"}      -> {"path": ..., "codes": [...], "error": null}
+    analyzeBatch   {"paths": [...]} or {"sources": [...]}
+                                                 -> {"results": [...]} in the same order
+    status         {}                            -> configuration and load
+    shutdown       {}                            -> stops once pending requests are answered
+
+Paths are read by the daemon, relative to its own working directory.
+Files and sources that cannot be analyzed get an "error" message, like in
+mc4.py, including those that crash their worker process (the pool is then
+started anew); malformed requests get a JSON-RPC error, and requests the
+daemon fails on an internal error.
+
+Requests of a connection are served concurrently and answered as they
+finish, so responses may come out of order (match them by id). Backpressure
+is applied at two levels: at most --max-requests requests are in progress
+at a time, beyond which the daemon stops reading from its clients, and at
+most two chunks per worker are queued in the pool.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import inspect
+import itertools
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from mc4 import WORKER_CRASHED, addThresholdArguments, analyzeAlone, analyzeChunk, analyzeFile, \
+                analyzeSubmission, iterChunks, thresholdsFromArgs
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+def warmUp(thresholds):
+    """Runs a tiny analysis, so that a worker has imported and exercised the
+       detectors before the first request arrives.
+    """
+    return analyzeSubmission('x = 1\n', thresholds)
+
+class AnalysisDaemon:
+    def __init__(self, thresholds, jobs = None, threads = False, chunksize = 16, dedup = None,
+                 prefilter = False, maxRequests = 64, maxRequestBytes = 2**24):
+        self.thresholds = thresholds
+        self.jobs = jobs or os.cpu_count() or 1
+        self.threads = threads
+        self.chunksize = chunksize
+        self.dedup = dedup
+        self.prefilter = prefilter
+        self.maxRequests = maxRequests
+        self.maxRequestBytes = maxRequestBytes
+
+        self.executor = None
+        self.requestSlots = None
+        self.jobSlots = None
+        self.stopped = None
+        self.readers = set()
+
+        self.started = time.time()
+        self.served = 0
+        self.failed = 0
+        self.inFlight = 0
+        self.queuedJobs = 0
+
+        self.methods = {'analyzeSource': self.analyzeSource,
+                        'analyzePath': self.analyzePath,
+                        'analyzeBatch': self.analyzeBatch,
+                        'status': self.status,
+                        'shutdown': self.shutdown}
+
+    def worker(self, base):
+        return functools.partial(base, prefilter=True) if self.prefilter else base
+
+    # Lifecycle
+
+    async def start(self):
+        """Starts the pool and warms every worker up.
+        """
+        self.requestSlots = asyncio.Semaphore(self.maxRequests)
+        self.jobSlots = asyncio.Semaphore(2*self.jobs)
+        self.stopped = asyncio.Event()
+
+        self.executor = self.newPool()
+
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, warmUp, self.thresholds)
+                               for _ in range(self.jobs)])
+
+    def newPool(self):
+        poolClass = ThreadPoolExecutor if self.threads else ProcessPoolExecutor
+        return poolClass(max_workers=self.jobs)
+
+    def restartPool(self, broken):
+        """Replaces a pool broken by a worker process that died, unless that
+           was already done for another of its chunks.
+        """
+        if broken is self.executor:
+            print('mc4d: a worker process died, restarting the pool', file=sys.stderr)
+            broken.shutdown(wait=False)
+            self.executor = self.newPool()
+
+    def stop(self):
+        """Stops reading new requests; the pending ones are still answered.
+        """
+        self.stopped.set()
+        for reader in self.readers:
+            reader.feed_eof()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    async def serveUnixSocket(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+
+        server = await asyncio.start_unix_server(self.handleConnection, path=path,
+                                                 limit=self.maxRequestBytes)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+
+        print(f"mc4d: listening on {path} with {self.jobs} workers", file=sys.stderr)
+        try:
+            await self.stopped.wait()
+            server.close()
+            await server.wait_closed()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    async def serveStdio(self):
+        await self.handleConnection(StdinReader(asyncio.get_running_loop(), self.maxRequests,
+                                                self.maxRequestBytes),
+                                    StdoutWriter())
+
+    # Connections
+
+    async def handleConnection(self, reader, writer):
+        """Reads one request per line and serves each in its own task. A slot
+           is taken before reading each request, so when the daemon is busy it
+           stops reading and clients block on their writes.
+        """
+        self.readers.add(reader)
+        writeLock = asyncio.Lock()
+        tasks = set()
+
+        try:
+            while not self.stopped.is_set():
+                await self.requestSlots.acquire()
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    #Longer than maxRequestBytes: the rest of the line cannot be skipped
+                    self.requestSlots.release()
+                    await self.send(writer, writeLock,
+                                    errorResponse(None, INVALID_REQUEST, 'request too large'))
+                    break
+                except ConnectionError:
+                    self.requestSlots.release()
+                    break
+
+                if not line:
+                    self.requestSlots.release()
+                    break
+
+                if not line.strip():
+                    self.requestSlots.release()
+                    continue
+
+                task = asyncio.create_task(self.serveLine(line, writer, writeLock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            self.readers.discard(reader)
+            writer.close()
+
+    async def serveLine(self, line, writer, writeLock):
+        self.inFlight += 1
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = errorResponse(None, PARSE_ERROR, f"parse error: {e}")
+            else:
+                if isinstance(request, list) and len(request) > 0:
+                    responses = await asyncio.gather(*[self.dispatch(item) for item in request])
+                    response = [item for item in responses if item is not None] or None
+                else:
+                    response = await self.dispatch(request)
+
+            if response is not None:
+                await self.send(writer, writeLock, response)
+        finally:
+            self.inFlight -= 1
+            self.requestSlots.release()
+
+    async def send(self, writer, writeLock, response):
+        data = json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n'
+        async with writeLock:
+            try:
+                writer.write(data)
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    async def dispatch(self, request):
+        """Runs a single JSON-RPC request. Returns its response, or None for
+           notifications (requests without an id).
+        """
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or \
+           not isinstance(request.get('method'), str):
+            self.failed += 1
+            return errorResponse(request.get('id') if isinstance(request, dict) else None,
+                                 INVALID_REQUEST, 'invalid request')
+
+        requestId = request.get('id')
+        try:
+            method = self.methods.get(request['method'])
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, f"method not found: {request['method']}")
+
+            params = request.get('params', {})
+            if not isinstance(params, dict):
+                raise RpcError(INVALID_PARAMS, 'params must be an object')
+
+            try:
+                inspect.signature(method).bind(**params)
+            except TypeError as e:
+                raise RpcError(INVALID_PARAMS, f"invalid params: {e}")
+
+            result = await method(**params)
+            response = {'jsonrpc': '2.0', 'id': requestId, 'result': result}
+            self.served += 1
+        except RpcError as e:
+            response = errorResponse(requestId, e.code, e.message)
+            self.failed += 1
+        except Exception as e:
+            print(f"mc4d: {request['method']} failed: {type(e).__name__}: {e}", file=sys.stderr)
+            response = errorResponse(requestId, INTERNAL_ERROR,
+                                     f"internal error: {type(e).__name__}: {e}")
+            self.failed += 1
+
+        return response if 'id' in request else None
+
+    # Analysis
+
+    async def runChunk(self, worker, chunk, crashed):
+        """Runs analyzeChunk in the pool. The caller must hold a job slot,
+           which is released when the chunk is done. If a worker process dies,
+           the chunk is analyzed again one item per process (see
+           mc4.analyzeAlone), crashed(item) being the result of the items
+           that crash their process again.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            try:
+                return await loop.run_in_executor(executor, analyzeChunk, worker, chunk,
+                                                  self.thresholds, self.dedup)
+            except BrokenProcessPool:
+                self.restartPool(executor)
+
+            return await loop.run_in_executor(None, analyzeAlone, worker, chunk, self.thresholds,
+                                              self.dedup, crashed)
+        finally:
+            self.queuedJobs -= 1
+            self.jobSlots.release()
+
+    async def analyzeMany(self, worker, items, crashed):
+        """Analyzes items in chunks, submitting a chunk only when the pool has a
+           free slot. Returns the results in the order of items.
+        """
+        tasks = []
+        for chunk in iterChunks(items, self.chunksize):
+            await self.jobSlots.acquire()
+            self.queuedJobs += 1
+            tasks.append(asyncio.create_task(self.runChunk(worker, chunk, crashed)))
+
+        #Every chunk is waited for, so that none fails unnoticed
+        chunks = await asyncio.gather(*tasks, return_exceptions=True)
+        for chunk in chunks:
+            if isinstance(chunk, BaseException):
+                raise chunk
+
+        return [result for chunk in chunks for result in chunk]
+
+    async def analyzeSource(self, source):
+        if not isinstance(source, str):
+            raise RpcError(INVALID_PARAMS, 'source must be a string')
+
+        [(codes, error)] = await self.analyzeMany(self.worker(sourceWorker), [source],
+                                                  crashedSource)
+        return {'codes': codes, 'error': error}
+
+    async def analyzePath(self, path):
+        if not isinstance(path, str):
+            raise RpcError(INVALID_PARAMS, 'path must be a string')
+
+        [(path, codes, error)] = await self.analyzeMany(self.worker(analyzeFile), [path],
+                                                        crashedPath)
+        return {'path': path, 'codes': codes, 'error': error}
+
+    async def analyzeBatch(self, paths = None, sources = None):
+        if (paths is None) == (sources is None):
+            raise RpcError(INVALID_PARAMS, 'give either paths or sources')
+
+        items = paths if paths is not None else sources
+        if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+            raise RpcError(INVALID_PARAMS, 'paths and sources must be lists of strings')
+
+        if paths is not None:
+            results = await self.analyzeMany(self.worker(analyzeFile), paths, crashedPath)
+            return {'results': [{'path': path, 'codes': codes, 'error': error}
+                                for path, codes, error in results]}
+
+        results = await self.analyzeMany(self.worker(sourceWorker), sources, crashedSource)
+        return {'results': [{'codes': codes, 'error': error} for codes, error in results]}
+
+    async def status(self):
+        return {'pid': os.getpid(),
+                'uptime': time.time() - self.started,
+                'workers': self.jobs,
+                'threads': self.threads,
+                'thresholds': list(self.thresholds),
+                'dedup': self.dedup,
+                'prefilter': self.prefilter,
+                'served': self.served,
+                'failed': self.failed,
+                'inFlight': self.inFlight,
+                'queuedJobs': self.queuedJobs,
+                'maxRequests': self.maxRequests}
+
+    async def shutdown(self):
+        self.stop()
+        return True
+
+class StdinReader:
+    """Stands in for the StreamReader of a connection on stdin, which the event
+       loop cannot watch when it is a regular file. Lines are read by a thread
+       into a bounded queue, so stdin is only read as fast as it is served.
+    """
+    def __init__(self, loop, maxLines, maxLineBytes):
+        self.lines = asyncio.Queue(maxLines)
+        self.maxLineBytes = maxLineBytes
+        self.eof = False
+        self.stopped = False
+        threading.Thread(target=self.readLines, args=(loop,), daemon=True).start()
+
+    def readLines(self, loop):
+        #The empty line marks the end of stdin, after the lines still queued
+        try:
+            for line in itertools.chain(sys.stdin.buffer, [b'']):
+                asyncio.run_coroutine_threadsafe(self.lines.put(line), loop).result()
+        except (RuntimeError, concurrent.futures.CancelledError):
+            #The daemon stopped without reading the rest and its loop is closed
+            pass
+
+    def feed_eof(self):
+        """Called by stop(): no more lines are returned, queued or not.
+        """
+        self.stopped = True
+        if self.lines.empty():
+            self.lines.put_nowait(b'')
+
+    async def readline(self):
+        if self.eof or self.stopped:
+            return b''
+
+        line = await self.lines.get()
+        if line == b'':
+            self.eof = True
+        elif len(line) > self.maxLineBytes:
+            raise ValueError('line too long')
+        return line
+
+class StdoutWriter:
+    """Stands in for the StreamWriter of a connection on stdout, which may not
+       be a pipe either. Responses are small, so they are written directly.
+    """
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        sys.stdout.buffer.flush()
+
+def sourceWorker(source, thresholds, dedup, prefilter = False):
+    """analyzeSubmission with the (item, thresholds, dedup) signature of the
+       analyzeChunk workers.
+    """
+    return analyzeSubmission(source, thresholds, dedup, prefilter)
+
+def crashedSource(source):
+    return [], WORKER_CRASHED
+
+def crashedPath(path):
+    return path, [], WORKER_CRASHED
+
+def errorResponse(requestId, code, message):
+    return {'jsonrpc': '2.0', 'id': requestId, 'error': {'code': code, 'message': message}}
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog='mc4d',
+                                     description='Serve MC³ detection over JSON-RPC from a '
+                                                 'warm pool of workers.')
+    endpoint = parser.add_mutually_exclusive_group(required=True)
+    endpoint.add_argument('--socket', help='listen on this Unix socket')
+    endpoint.add_argument('--stdio', action='store_true',
+                          help='serve a single client on stdin/stdout')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--threads', action='store_true',
+                        help='use worker threads instead of processes')
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help='files or sources of a batch sent to a worker at a time '
+                             '(default: 16)')
+    parser.add_argument('--dedup', choices=['ast', 'renamed'],
+                        help='share the analysis of equivalent submissions within each worker '
+                             '(see mc4.py)')
+    parser.add_argument('--prefilter', action='store_true',
+                        help='only run the detectors whose keywords appear (see mc4.py)')
+    parser.add_argument('--max-requests', type=int, default=64,
+                        help='requests in progress beyond which clients are not read from '
+                             '(default: 64)')
+    parser.add_argument('--max-request-bytes', type=int, default=2**24,
+                        help='longest accepted request line (default: 16 MiB)')
+    addThresholdArguments(parser)
+    return parser
+
+async def serve(daemon, args):
+    await daemon.start()
+    try:
+        if args.stdio:
+            await daemon.serveStdio()
+        else:
+            await daemon.serveUnixSocket(args.socket)
+    finally:
+        daemon.close()
+
+def main(argv = None):
+    args = buildParser().parse_args(argv)
+    daemon = AnalysisDaemon(thresholdsFromArgs(args), args.jobs, args.threads, args.chunksize,
+                            args.dedup, args.prefilter, args.max_requests,
+                            args.max_request_bytes)
+    asyncio.run(serve(daemon, args))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""Durable job queue in front of the MC4 analyzer, for deadline bursts.
+
+    python mc4queue.py --db queue.db enqueue submissions/alice/hw3.py
+    python mc4queue.py --db queue.db work -j 8 --metrics queue.prom
+    python mc4queue.py --db queue.db status
+    python mc4queue.py --db queue.db results --latest -o results.txt
+
+enqueue adds files (directories and globs are expanded like in mc4.py) to
+the queue kept in a SQLite database (see JobQueue.py) and returns at once,
+so it can be called by the submission system for every upload. Each
+student's latest submission is analyzed first and reruns last; a student
+is the directory holding the file unless --student is given.
+
+work feeds a pool of -j worker processes from the queue, one file at a
+time, until it is stopped (SIGINT or SIGTERM: the jobs in progress are
+finished first) or, with --drain, until the queue is empty. Files that
+make a detector raise or crash its worker process are retried, then moved
+to the dead letters; a runner that dies leaves its jobs to be picked up by
+another once their lease expires. Every --report-every seconds, work logs
+the queue depth and latency to stderr and, with --metrics, writes them as
+a Prometheus textfile. Several runners can share a queue.
+
+status prints the queue depth and latency, results writes the results like
+mc4.py, dead lists the dead letters, retry queues them again and purge
+deletes old finished jobs.
+"""
+import argparse
+import ast
+import functools
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from AnalyzerMC3 import AnalyzerMC3
+from JobQueue import JobQueue
+from PatternRules import readRules
+from mc4 import ResultWriter, addThresholdArguments, expandInputs, thresholdsFromArgs
+from prefilter import relevantDetectors
+
+def ignoreInterrupts():
+    """Worker initializer: a Ctrl+C stops the runner, which lets the workers
+       finish their jobs instead of dying with them.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def fileWorker(path, thresholds, prefilter = False, rules = ()):
+    """mc4.analyzeFile for the queue: the files that cannot be read or parsed
+       get their error as their result, but anything the detectors raise is
+       raised, so that the job is retried and then moved to the dead letters.
+    """
+    try:
+        with open(path, 'rb') as file:
+            source = file.read()
+    except (OSError, ValueError) as e:
+        return path, [], f"{type(e).__name__}: {e}"
+
+    detectors = None
+    if prefilter:
+        detectors = relevantDetectors(source) | set(rule.code for rule in rules)
+        if len(detectors) == 0:
+            return path, [], None
+
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError, RecursionError, MemoryError) as e:
+        return path, [], f"{type(e).__name__}: {e}"
+
+    return path, AnalyzerMC3(*thresholds, rules=rules).analyze(tree, detectors).detected(), None
+
+class QueueRunner:
+    def __init__(self, queue, worker, jobs = None, lease = 300.0, pollSeconds = 0.5):
+        self.queue = queue
+        self.worker = worker
+        self.jobs = jobs or os.cpu_count() or 1
+        self.lease = lease
+        self.pollSeconds = pollSeconds
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.running = {}       # future -> Job
+        self.stopping = False
+        self.completed = 0
+        self.failed = 0
+
+    def stop(self):
+        """Stops claiming jobs; run() returns once the running ones are done.
+        """
+        self.stopping = True
+
+    def run(self, drain = False, reportEvery = None, report = None):
+        """Runs jobs until stopped or, with drain, until no job is queued.
+           report(stats) is called every reportEvery seconds and at the end.
+        """
+        executor = ProcessPoolExecutor(self.jobs, initializer=ignoreInterrupts)
+        lastRenewal = lastReport = time.monotonic()
+        try:
+            while True:
+                self.queue.recover()
+
+                for job in self.claim():
+                    self.running[executor.submit(self.worker, job.path)] = job
+
+                if len(self.running) == 0:
+                    if self.stopping or (drain and self.queue.depth() == 0):
+                        break
+                    time.sleep(self.pollSeconds)
+                else:
+                    done, _ = wait(list(self.running), timeout=self.pollSeconds,
+                                   return_when=FIRST_COMPLETED)
+                    if any([self.finish(future) for future in done]):
+                        #Every job of a broken pool fails; the pool is started anew
+                        for future in list(self.running):
+                            self.finish(future)
+                        executor.shutdown(wait=False)
+                        executor = ProcessPoolExecutor(self.jobs, initializer=ignoreInterrupts)
+
+                if time.monotonic() - lastRenewal >= self.lease/3:
+                    self.queue.renew([job.id for job in self.running.values()], self.lease)
+                    lastRenewal = time.monotonic()
+
+                if reportEvery is not None and time.monotonic() - lastReport >= reportEvery:
+                    report(self.queue.stats())
+                    lastReport = time.monotonic()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if report is not None:
+            report(self.queue.stats())
+
+    def claim(self):
+        """Claims jobs for the free workers. A job that failed before runs
+           alone once the running ones are done: a crash of the pool is then
+           its own, and other jobs are not retried for it.
+        """
+        free = self.jobs - len(self.running)
+        if self.stopping or free == 0 or \
+           any(job.attempts > 1 for job in self.running.values()):
+            return []
+
+        if self.queue.hasRetries():
+            if len(self.running) > 0:
+                return []
+            return self.queue.claim(1, self.name, self.lease, retried=True)
+
+        return self.queue.claim(free, self.name, self.lease, retried=False)
+
+    def finish(self, future):
+        """Stores the outcome of a finished job. Returns whether its worker
+           process crashed, which breaks the whole pool.
+        """
+        job = self.running.pop(future)
+        crashed = False
+        try:
+            _, codes, error = future.result()
+        except BrokenProcessPool:
+            crashed = True
+            error = 'the worker process crashed'
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            self.queue.complete(job.id, codes, error)
+            self.completed += 1
+            return False
+
+        self.failed += 1
+        state = self.queue.fail(job.id, error)
+        print(f"mc4queue: {job.path} failed (attempt {job.attempts}): {error}; "
+              f"{'retrying' if state == 'queued' else 'moved to the dead letters'}",
+              file=sys.stderr)
+        return crashed
+
+def formatSeconds(seconds):
+    return '-' if seconds is None else f"{seconds:.2f}s"
+
+def statusLine(stats):
+    states, queued = stats['states'], stats['queued']
+    wait, latency = stats['waitSeconds'], stats['latencySeconds']
+    return (f"queued {states['queued']} ("
+            f"{', '.join(f'{name} {count}' for name, count in queued.items())}, "
+            f"{stats['delayed']} delayed), running {states['running']}, done {states['done']}, "
+            f"dead {states['dead']}; oldest queued {formatSeconds(stats['oldestQueuedSeconds'])}; "
+            f"last {stats['window']:.0f}s: {stats['finished']} done, "
+            f"wait p50 {formatSeconds(wait['0.5'])} p95 {formatSeconds(wait['0.95'])}, "
+            f"latency p50 {formatSeconds(latency['0.5'])} p95 {formatSeconds(latency['0.95'])}")
+
+def prometheusText(stats):
+    lines = []
+
+    def metric(name, help, samples):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            if value is not None:
+                lines.append(f"{name}{labels} {value}")
+
+    metric('mc4_queue_jobs', 'Jobs in the queue, by state.',
+           [(f'{{state="{state}"}}', count) for state, count in stats['states'].items()])
+    metric('mc4_queue_queued_jobs', 'Queued jobs, by priority.',
+           [(f'{{priority="{priority}"}}', count) for priority, count in stats['queued'].items()])
+    metric('mc4_queue_delayed_jobs', 'Queued jobs waiting for a retry delay.',
+           [('', stats['delayed'])])
+    metric('mc4_queue_oldest_queued_seconds', 'Age of the oldest queued job.',
+           [('', stats['oldestQueuedSeconds'])])
+    metric('mc4_queue_finished_per_second', 'Jobs done per second over the window.',
+           [('', stats['perSecond'])])
+    metric('mc4_queue_wait_seconds', 'Estimated quantiles of the time from enqueuing to '
+                                     'start, over the window.',
+           [(f'{{quantile="{q}"}}', value) for q, value in stats['waitSeconds'].items()])
+    metric('mc4_queue_latency_seconds', 'Estimated quantiles of the time from enqueuing to '
+                                        'result, over the window.',
+           [(f'{{quantile="{q}"}}', value) for q, value in stats['latencySeconds'].items()])
+
+    return '\n'.join(lines) + '\n'
+
+def writeAtomically(path, content):
+    """Replaces a file at once, as the textfile collector requires.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tempPath = tempfile.mkstemp(dir=directory, prefix='.mc4-queue-')
+    try:
+        with os.fdopen(handle, 'w') as file:
+            file.write(content)
+        os.replace(tempPath, path)
+    except BaseException:
+        os.unlink(tempPath)
+        raise
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog='mc4queue',
+                                     description='Durable, prioritized queue of MC4 analyses.')
+    parser.add_argument('--db', required=True, help='SQLite file holding the queue')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help='tries before a failing job goes to the dead letters (default: 3)')
+    parser.add_argument('--retry-delay', type=float, default=5.0,
+                        help='seconds before the first retry, doubled at each one (default: 5)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='queue files for analysis')
+    enqueue.add_argument('inputs', nargs='+', help='files, directories or glob patterns')
+    enqueue.add_argument('--student', help='student of all the files (default: the name of '
+                                           'the directory holding each file)')
+    enqueue.add_argument('--rerun', action='store_true',
+                         help='queue as reruns, analyzed after every submission')
+
+    work = commands.add_parser('work', help='analyze queued files')
+    work.add_argument('-j', '--jobs', type=int, default=None,
+                      help='number of worker processes (default: one per CPU)')
+    work.add_argument('--drain', action='store_true', help='stop once the queue is empty')
+    work.add_argument('--lease', type=float, default=300.0,
+                      help='seconds after which the jobs of a runner that stopped renewing '
+                           'them are queued again (default: 300)')
+    work.add_argument('--poll', type=float, default=0.5,
+                      help='seconds between checks of an empty queue (default: 0.5)')
+    work.add_argument('--report-every', type=float, default=30.0,
+                      help='seconds between reports of the queue depth and latency '
+                           '(default: 30)')
+    work.add_argument('--metrics', metavar='FILE',
+                      help='also write the reports to FILE as a Prometheus textfile')
+    work.add_argument('--prefilter', action='store_true',
+                      help='only run the detectors whose keywords appear (see mc4.py)')
+    work.add_argument('--rules', metavar='FILE',
+                      help='also detect the rules in FILE (see mc4.py)')
+    addThresholdArguments(work)
+
+    status = commands.add_parser('status', help='show the queue depth and latency')
+    status.add_argument('--window', type=float, default=300.0,
+                        help='seconds of finished jobs the latencies are computed over '
+                             '(default: 300)')
+    status.add_argument('--json', action='store_true', help='print the status as JSON')
+
+    results = commands.add_parser('results', help='write the results of the done jobs')
+    results.add_argument('-o', '--output', help='write results to this file instead of stdout')
+    results.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                         help='same as mc4.py --format')
+    results.add_argument('--latest', action='store_true',
+                         help="only each student's latest submission")
+
+    commands.add_parser('dead', help='list the dead letters')
+
+    retry = commands.add_parser('retry', help='queue dead letters again')
+    retry.add_argument('ids', nargs='*', type=int, help='job ids (default: all dead letters)')
+
+    purge = commands.add_parser('purge', help='delete old finished jobs')
+    purge.add_argument('--older-than', type=float, required=True, metavar='SECONDS',
+                       help='delete the jobs finished more than SECONDS ago')
+
+    return parser
+
+def work(queue, args, parser):
+    rules = ()
+    if args.rules:
+        try:
+            with open(args.rules, encoding='utf-8') as file:
+                rules = readRules(file)
+        except (OSError, ValueError) as e:
+            parser.error(f"--rules {args.rules}: {e}")
+
+    worker = functools.partial(fileWorker, thresholds=thresholdsFromArgs(args),
+                               prefilter=args.prefilter, rules=rules)
+    runner = QueueRunner(queue, worker, args.jobs, args.lease, args.poll)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: runner.stop())
+
+    def report(stats):
+        print(f"mc4queue: {statusLine(stats)}", file=sys.stderr)
+        if args.metrics:
+            writeAtomically(args.metrics, prometheusText(stats))
+
+    print(f"mc4queue: runner {runner.name} with {runner.jobs} workers", file=sys.stderr)
+    runner.run(args.drain, args.report_every, report)
+    print(f"mc4queue: {runner.completed} jobs done, {runner.failed} failed attempts",
+          file=sys.stderr)
+
+def main(argv = None):
+    parser = buildParser()
+    args = parser.parse_args(argv)
+
+    with JobQueue(args.db, args.max_attempts, args.retry_delay) as queue:
+        if args.command == 'enqueue':
+            ids = queue.enqueueMany(((path, args.student, None)
+                                     for path in expandInputs(args.inputs)), args.rerun)
+            print(f"mc4queue: {len(ids)} files queued", file=sys.stderr)
+
+        elif args.command == 'work':
+            work(queue, args, parser)
+
+        elif args.command == 'status':
+            stats = queue.stats(args.window)
+            print(json.dumps(stats, indent=2) if args.json else statusLine(stats))
+
+        elif args.command == 'results':
+            output = open(args.output, 'w') if args.output else sys.stdout
+            try:
+                writer = ResultWriter(output, args.format)
+                for path, codes, error in queue.results(args.latest):
+                    writer.write(path, codes, error)
+                writer.flush()
+            finally:
+                if output is not sys.stdout:
+                    output.close()
+
+        elif args.command == 'dead':
+            for jobId, path, student, attempts, error in queue.deadJobs():
+                print(f"{jobId}\t{path}\t{student}\t{attempts} attempts\t{error}")
+
+        elif args.command == 'retry':
+            count = queue.retryDead(args.ids or None)
+            print(f"mc4queue: {count} jobs queued again", file=sys.stderr)
+
+        elif args.command == 'purge':
+            count = queue.purge(time.time() - args.older_than)
+            print(f"mc4queue: {count} jobs deleted", file=sys.stderr)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Lexical prefilter that tells which MC³ can possibly be present in a source.
+
+Most detectors need a given keyword or symbol to have anything to look at:
+a while loop for B6 and C1, a for loop for C4 and C8, an if statement for
+B8, B9 and B12, a def for D4 and G5, a list display for E2, and so on.
+relevantDetectors scans the raw bytes for these needles (much faster than
+tokenizing, and a fraction of the cost of ast.parse) and returns the codes
+whose needles appear. Matches inside strings or comments are kept, so the
+result can only err on the side of running a detector for nothing, never
+of missing an MC³.
+
+Files where no detector is relevant do not need to be parsed at all. Note
+that such files are then not checked for syntax errors either.
+"""
+import re
+
+from VisitorMC3 import LIST_OF_BUILTINS, MC3_CODES
+
+# Gap between two tokens: spaces, line continuations and comments
+GAP = rb'(?:[ \t\f\r\n\\]|#[^\n]*)*'
+
+def wordsPattern(words):
+    """Regular expression matching any of the words, as a prefix tree: Python's
+       re tries the branches of a plain alternation one after the other.
+    """
+    branches = {}
+    for word in words:
+        branches.setdefault(word[:1], []).append(word[1:])
+
+    alternatives = []
+    for first, rests in sorted(branches.items()):
+        optional = '' in rests
+        rests = [rest for rest in rests if rest != '']
+        if len(rests) == 0:
+            alternatives.append(re.escape(first))
+        else:
+            alternatives.append(re.escape(first) + '(?:' + wordsPattern(rests) + ')' +
+                                ('?' if optional else ''))
+
+    return '|'.join(alternatives)
+
+BUILTIN_NAMES = wordsPattern(LIST_OF_BUILTINS).encode()
+
+# A needle is present if its substring is (None always is) and its regular
+# expression, if any, matches: substring tests are much cheaper than any
+# search, so they rule most needles out first
+NEEDLES = {
+    'while': (b'while', rb'\bwhile\b'),
+    'for': (b'for', rb'\bfor\b'),
+    'if': (b'if', rb'\bif\b'),
+    'def': (b'def', rb'\bdef\b'),
+    'list': (b'[', None),
+    #An assignment, not a comparison or an augmented assignment
+    'assign': (b'=', rb'(?<![=<>!:+\-*/%&|^@])=(?!=)'),
+    #A built-in bound by an assignment (also in a tuple) or as a parameter
+    'builtinBound': (None, rb'\b(?:' + BUILTIN_NAMES + rb')' + GAP + rb'[=,):]'),
+    'builtinDef': (b'def', rb'\bdef' + GAP + rb'(?:' + BUILTIN_NAMES + rb')\b'),
+    'number': (None, rb'[0-9]'),
+    'ellipsis': (b'...', None),
+    'True': (b'True', None),
+    'False': (b'False', None),
+    'None': (b'None', None),
+    'bytes': (None, rb'[bB][rR]?[\'"]|[rR][bB][\'"]'),
+}
+
+# Needles of which at least one must be present for each detector to fire
+KEYWORDS = {
+    'A4': ['builtinBound', 'builtinDef'],
+    'B6': ['while'],
+    'B8': ['if'],
+    'B9': ['if'],
+    'B12': ['if'],
+    'C1': ['while'],
+    'C2': ['for', 'while'],
+    'C4': ['for'],
+    'C8': ['for'],
+    'D4': ['def'],
+    'E2': ['list'],
+    'G4': ['assign', 'def'],
+    'G5': ['def'],
+    'H1': ['number', 'ellipsis', 'True', 'False', 'None', 'bytes'],
+}
+
+PATTERNS = {name: (substring, re.compile(pattern) if pattern is not None else None)
+            for name, (substring, pattern) in NEEDLES.items()}
+
+def relevantDetectors(source):
+    """Returns the frozenset of MC³ codes that may be present in a source
+       (str or bytes). The other ones are certainly absent.
+    """
+    if isinstance(source, str):
+        source = source.encode('utf-8', 'surrogatepass')
+
+    found = {}
+    relevant = set()
+    for code in MC3_CODES:
+        for name in KEYWORDS[code]:
+            present = found.get(name)
+            if present is None:
+                substring, pattern = PATTERNS[name]
+                present = (substring is None or substring in source) and \
+                          (pattern is None or pattern.search(source) is not None)
+                found[name] = present
+
+            if present:
+                relevant.add(code)
+                break
+
+    #Non-ASCII identifiers are NFKC-normalized by the parser, so a built-in
+    #name could be spelled with other characters
+    if not source.isascii():
+        relevant.add('A4')
+
+    return frozenset(relevant)
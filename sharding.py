@@ -0,0 +1,275 @@
+"""Sharded corpus runs of mc4.py, coordinated through a shared filesystem.
+
+A corpus is split into N shards deterministically, by a hash of each
+path (as listed by mc4.py's inputs, so every node must see the same
+paths) or of each file's content. Each node analyzes one shard and writes
+a partial file, then this script merges the partials into the final
+results, in the order an unsharded run would have written them:
+
+    node 1$ python mc4.py /shared/submissions --shard 0/3 --partial /shared/run/0.part
+    node 2$ python mc4.py /shared/submissions --shard 1/3 --partial /shared/run/1.part
+    node 3$ python mc4.py /shared/submissions --shard 2/3 --partial /shared/run/2.part
+    python sharding.py /shared/run/*.part -o results.txt --summary summary.json
+
+A partial is a JSON Lines file describing itself: a header with the
+shard, the inputs, the constants and the detector version, one line per
+result (with its position in the whole corpus), and a summary with the
+number of files and errors and the number of files per combination of
+detected MC³ (see cohortStats.py). It is written under a temporary name
+and renamed once complete, so a partial that exists is finished. The
+merge checks that every shard is there exactly once and that all of them
+come from the same run configuration.
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+from VisitorMC3 import DETECTOR_VERSION, MC3_CODES
+
+PARTIAL_FORMAT = 1
+
+# Header fields that must be equal in the partials of a run
+RUN_FIELDS = ['shards', 'shardBy', 'inputs', 'thresholds', 'detectorVersion', 'options']
+
+def parseShard(text):
+    """Parses "K/N" (shard K of N, counting from 0) for argparse.
+    """
+    try:
+        shard, shards = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N, got {text!r}")
+
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError(f"shard must be between 0 and {shards - 1}")
+
+    return shard, shards
+
+def shardOf(path, shards, shardBy = 'path'):
+    """The shard (0 to shards - 1) of a file, from a hash of its path or of
+       its content. Unreadable files are sharded by path, so exactly one
+       shard reports their error.
+    """
+    data = None
+    if shardBy == 'content':
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except (OSError, ValueError):
+            pass
+
+    if data is None:
+        data = os.path.normpath(path).encode('utf-8', 'surrogateescape')
+
+    digest = hashlib.blake2b(data, digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+def selectShard(paths, shard, shards, shardBy = 'path', positions = None):
+    """Yields the paths of a shard. If given, positions (e.g. a deque) gets
+       the position of each yielded path among all paths.
+    """
+    for position, path in enumerate(paths):
+        if shardOf(path, shards, shardBy) == shard:
+            if positions is not None:
+                positions.append(position)
+            yield path
+
+class PartialWriter:
+    def __init__(self, path, shard, shards, shardBy, inputs, thresholds, options = None):
+        self.path = path
+        self.files = 0
+        self.errors = 0
+        self.maskCounts = {}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, self.tempPath = tempfile.mkstemp(dir=directory, prefix='.mc4-partial-')
+        self.file = os.fdopen(handle, 'w', encoding='utf-8')
+
+        self.writeLine({'partial': PARTIAL_FORMAT, 'shard': shard, 'shards': shards,
+                        'shardBy': shardBy, 'inputs': list(inputs),
+                        'thresholds': list(thresholds), 'detectorVersion': DETECTOR_VERSION,
+                        'codes': MC3_CODES, 'options': options or {},
+                        'host': socket.gethostname(), 'started': time.time()})
+
+    def writeLine(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def write(self, position, path, codes, error):
+        self.writeLine({'position': position, 'path': path, 'codes': codes, 'error': error})
+
+        self.files += 1
+        if error is not None:
+            self.errors += 1
+        else:
+            mask = sum(1 << MC3_CODES.index(code) for code in codes if code in MC3_CODES)
+            self.maskCounts[mask] = self.maskCounts.get(mask, 0) + 1
+
+    def close(self):
+        """Writes the summary and publishes the partial under its final name.
+        """
+        self.writeLine({'summary': {'files': self.files, 'errors': self.errors,
+                                    'maskCounts': {str(mask): count for mask, count
+                                                   in sorted(self.maskCounts.items())},
+                                    'finished': time.time()}})
+        self.file.close()
+
+        #mkstemp creates the file readable by its owner only
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self.tempPath, 0o666 & ~umask)
+        os.replace(self.tempPath, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.unlink(self.tempPath)
+
+def readHeader(path):
+    with open(path, encoding='utf-8') as file:
+        header = json.loads(file.readline())
+
+    if header.get('partial') != PARTIAL_FORMAT:
+        raise ValueError(f"{path} is not an MC4 partial file")
+    return header
+
+def readResults(path):
+    """Yields (position, path, codes, error) for each result of a partial, and
+       raises ValueError if it has no summary (it was not finished).
+    """
+    with open(path, encoding='utf-8') as file:
+        file.readline()
+        for line in file:
+            record = json.loads(line)
+            if 'summary' in record:
+                return
+            yield record['position'], record['path'], record['codes'], record['error']
+
+    raise ValueError(f"{path} is incomplete: it has no summary")
+
+def readSummary(path):
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            pass
+
+    record = json.loads(line)
+    if 'summary' not in record:
+        raise ValueError(f"{path} is incomplete: it has no summary")
+    return record['summary']
+
+def checkPartials(paths):
+    """Checks that partials make up a whole run: the same configuration and
+       every shard exactly once. Returns their headers, in shard order.
+    """
+    headers = [readHeader(path) for path in paths]
+    if len(headers) == 0:
+        raise ValueError('no partial files given')
+
+    first = headers[0]
+    for path, header in zip(paths, headers):
+        for field in RUN_FIELDS:
+            if header[field] != first[field]:
+                raise ValueError(f"{path} comes from another run: its {field} is "
+                                 f"{header[field]!r} instead of {first[field]!r}")
+
+    shards = {}
+    for path, header in zip(paths, headers):
+        if header['shard'] in shards:
+            raise ValueError(f"shard {header['shard']} is in both "
+                             f"{shards[header['shard']]} and {path}")
+        shards[header['shard']] = path
+
+    missing = [shard for shard in range(first['shards']) if shard not in shards]
+    if missing:
+        raise ValueError(f"missing shards: {', '.join(map(str, missing))} "
+                         f"of {first['shards']}")
+
+    return [readHeader(shards[shard]) for shard in range(first['shards'])], \
+           [shards[shard] for shard in range(first['shards'])]
+
+def mergeResults(paths):
+    """Yields (path, codes, error) from all partials, in corpus order.
+    """
+    for _, path, codes, error in heapq.merge(*[readResults(path) for path in paths],
+                                             key=lambda result: result[0]):
+        yield path, codes, error
+
+def mergeSummaries(headers, paths):
+    """Summary of the whole run: totals, prevalence of each MC³ and the
+       number of files per combination of detected MC³.
+    """
+    files, errors, maskCounts = 0, 0, {}
+    for path in paths:
+        summary = readSummary(path)
+        files += summary['files']
+        errors += summary['errors']
+        for mask, count in summary['maskCounts'].items():
+            maskCounts[int(mask)] = maskCounts.get(int(mask), 0) + count
+
+    prevalence = {code: sum(count for mask, count in maskCounts.items() if mask >> i & 1)
+                  for i, code in enumerate(MC3_CODES)}
+
+    first = headers[0]
+    return {'files': files, 'errors': errors, 'prevalence': prevalence,
+            'maskCounts': {str(mask): count for mask, count in sorted(maskCounts.items())},
+            'shards': first['shards'], 'shardBy': first['shardBy'], 'inputs': first['inputs'],
+            'thresholds': first['thresholds'], 'detectorVersion': first['detectorVersion'],
+            'options': first['options'],
+            'hosts': [header['host'] for header in headers],
+            'started': min(header['started'] for header in headers)}
+
+def main(argv = None):
+    from mc4 import ResultWriter
+
+    parser = argparse.ArgumentParser(prog='sharding',
+                                     description='Merge the partial files of a sharded mc4 '
+                                                 'run into its final results.')
+    parser.add_argument('partials', nargs='+', help='partial files, one per shard')
+    parser.add_argument('-o', '--output', help='write results to this file instead of stdout')
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                        help='same as mc4.py --format')
+    parser.add_argument('--summary', metavar='FILE',
+                        help='write the totals and prevalence of the run to FILE as JSON')
+    parser.add_argument('--stats', metavar='NPZ',
+                        help='save the run as cohortStats.py statistics (requires NumPy)')
+    args = parser.parse_args(argv)
+
+    try:
+        headers, paths = checkPartials(args.partials)
+        summary = mergeSummaries(headers, paths)
+    except (OSError, ValueError) as e:
+        print(f"sharding: {e}", file=sys.stderr)
+        return 1
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        writer = ResultWriter(output, args.format)
+        for path, codes, error in mergeResults(paths):
+            writer.write(path, codes, error)
+        writer.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.summary:
+        with open(args.summary, 'w') as file:
+            json.dump(summary, file, indent=2)
+
+    if args.stats:
+        from cohortStats import CohortStats
+
+        stats = CohortStats(summary['thresholds'])
+        stats.errors = summary['errors']
+        for mask, count in summary['maskCounts'].items():
+            stats.maskCounts[int(mask)] += count
+        stats.save(args.stats)
+
+    print(f"{summary['files']} files ({summary['errors']} errors) from "
+          f"{summary['shards']} shards", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
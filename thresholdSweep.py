@@ -0,0 +1,163 @@
+"""Threshold sweeps for C4, E2 and G4 over a whole corpus.
+
+The metrics behind these detectors (see MetricsMC3) are extracted once per
+submission and stored as NumPy arrays in a MetricsTable. Flag rates for a
+whole grid of thresholds are then computed with array operations, without
+parsing or walking any tree again:
+
+    python thresholdSweep.py submissions/ --c4 10 50 100 --e2 1 3 5 \
+        --g4-var 2 3 4 --g4-func 4 8 --g4-percent 50 70 90
+
+Verdicts match VisitorMC3.getC4, getE2 and getG4 for every threshold.
+Requires NumPy.
+"""
+import argparse
+import ast
+
+import numpy as np
+
+from AnalyzerMC3 import AnalyzerMC3
+from mc4 import expandInputs, mapWorker
+
+ANALYZER = AnalyzerMC3()
+
+def metricsFile(path):
+    """Worker entry point. Returns the MetricsMC3 of a file, or None if it
+       cannot be read, parsed (MemoryError included) or analyzed.
+    """
+    try:
+        with open(path, 'rb') as file:
+            return ANALYZER.metrics(ast.parse(file.read()))
+    except Exception:
+        return None
+
+def metricsWorker(path, thresholds, dedup):
+    """metricsFile with the (path, thresholds, dedup) signature of the workers
+       of mc4.mapWorker; metrics do not depend on the constants.
+    """
+    return metricsFile(path)
+
+def cumulativeLengths(lengthsPerFile):
+    """Column j of the result holds, for each file, how many names have
+       length <= j - 1 (so column 0 is always 0).
+    """
+    counts = np.array([len(lengths) for lengths in lengthsPerFile], dtype=np.int64)
+    flat = np.fromiter((length for lengths in lengthsPerFile for length in lengths),
+                       dtype=np.int64, count=int(counts.sum()))
+    maxLength = int(flat.max()) if len(flat) > 0 else 0
+
+    histogram = np.zeros((len(lengthsPerFile), maxLength + 2), dtype=np.int32)
+    np.add.at(histogram, (np.repeat(np.arange(len(lengthsPerFile)), counts), flat + 1), 1)
+    return np.cumsum(histogram, axis=1, dtype=np.int32), counts
+
+class MetricsTable:
+    """Columnar MetricsMC3 of a corpus, one row per submission.
+    """
+    def __init__(self, metrics):
+        metrics = list(metrics)
+
+        self.maxRangeConstant = np.array([item.maxRangeFloat(-np.inf) for item in metrics],
+                                         dtype=np.float64)
+        self.numLists = np.array([item.numLists for item in metrics], dtype=np.int64)
+        self.varCumulative, self.numVars = cumulativeLengths([item.varNameLengths
+                                                              for item in metrics])
+        self.funcCumulative, self.numFuncs = cumulativeLengths([item.funcNameLengths
+                                                                for item in metrics])
+
+    def __len__(self):
+        return len(self.numLists)
+
+def countUpTo(cumulative, threshold):
+    """Number of names with length <= threshold, for every file.
+    """
+    return cumulative[:, int(np.clip(threshold + 1, 0, cumulative.shape[1] - 1))]
+
+def sweepC4(table, thresholds):
+    """C4 flag rate for each threshold (constThreshold of getC4).
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    return (table.maxRangeConstant[:, None] >= thresholds[None, :]).mean(axis=0)
+
+def sweepE2(table, thresholds):
+    """E2 flag rate for each threshold (numListsThreshold of getE2).
+    """
+    thresholds = np.asarray(thresholds)
+    flags = (table.numLists[:, None] > 0) & (table.numLists[:, None] >= thresholds[None, :])
+    return flags.mean(axis=0)
+
+def sweepG4(table, varLenThresholds, funcLenThresholds, percentages, chunkSize = 65536):
+    """G4 flag rate for every combination of thresholds, as an array indexed
+       [varLenThreshold, funcLenThreshold, percentage]. Files are processed in
+       chunks so memory does not grow with the corpus.
+    """
+    rates = np.zeros((len(varLenThresholds), len(funcLenThresholds), len(percentages)))
+
+    for start in range(0, len(table), chunkSize):
+        stop = start + chunkSize
+        numVars = table.numVars[start:stop].astype(np.float64)
+        numFuncs = table.numFuncs[start:stop].astype(np.float64)
+
+        shortVars = np.stack([countUpTo(table.varCumulative[start:stop], threshold)
+                              for threshold in varLenThresholds], axis=1)
+        shortFuncs = np.stack([countUpTo(table.funcCumulative[start:stop], threshold)
+                               for threshold in funcLenThresholds], axis=1)
+
+        for k, percentage in enumerate(percentages):
+            #Same expression as checkdeclaredVars/checkdeclaredFuncs: total*threshold/100
+            varFlags = (numVars[:, None] > 0) & \
+                       (shortVars >= (numVars*percentage/100)[:, None])
+            funcFlags = (numFuncs[:, None] > 0) & \
+                        (shortFuncs >= (numFuncs*percentage/100)[:, None])
+
+            rates[:, :, k] += (varFlags[:, :, None] | funcFlags[:, None, :]).sum(axis=0)
+
+    return rates/max(len(table), 1)
+
+def sweepReport(table, c4Thresholds, e2Thresholds, varLenThresholds, funcLenThresholds,
+                percentages):
+    """Returns the flag rates for every threshold as printable lines.
+    """
+    lines = [f"{len(table)} submissions"]
+
+    for threshold, rate in zip(c4Thresholds, sweepC4(table, c4Thresholds)):
+        lines.append(f"C4 constThreshold={threshold}: {rate:.2%}")
+
+    for threshold, rate in zip(e2Thresholds, sweepE2(table, e2Thresholds)):
+        lines.append(f"E2 numListsThreshold={threshold}: {rate:.2%}")
+
+    if varLenThresholds and funcLenThresholds and percentages:
+        rates = sweepG4(table, varLenThresholds, funcLenThresholds, percentages)
+        for i, varLen in enumerate(varLenThresholds):
+            for j, funcLen in enumerate(funcLenThresholds):
+                for k, percentage in enumerate(percentages):
+                    lines.append(f"G4 varLen={varLen} funcLen={funcLen} "
+                                 f"percentage={percentage}: {rates[i, j, k]:.2%}")
+
+    return lines
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Flag rates of C4, E2 and G4 for a grid of '
+                                                 'thresholds.')
+    parser.add_argument('inputs', nargs='+', help='files, directories or glob patterns')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--c4', type=int, nargs='*', default=[10, 50, 100, 1000])
+    parser.add_argument('--e2', type=int, nargs='*', default=[1, 3, 5, 10])
+    parser.add_argument('--g4-var', type=int, nargs='*', default=[1, 2, 3, 4])
+    parser.add_argument('--g4-func', type=int, nargs='*', default=[4, 6, 8])
+    parser.add_argument('--g4-percent', type=float, nargs='*', default=[50, 70, 90])
+    args = parser.parse_args(argv)
+
+    #Files that cannot be analyzed, or crash their worker process, are left out
+    metrics = [item for item in mapWorker(metricsWorker, expandInputs(args.inputs), None,
+                                          args.jobs, 64, None, False,
+                                          crashed=lambda path: None)
+               if item is not None]
+
+    table = MetricsTable(metrics)
+    for line in sweepReport(table, args.c4, args.e2, args.g4_var, args.g4_func,
+                            args.g4_percent):
+        print(line)
+
+if __name__ == '__main__':
+    main()